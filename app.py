@@ -2,8 +2,14 @@ from urllib import request
 from flask import Flask, jsonify, redirect, render_template, url_for, request, flash
 
 from fb_api import FacebookAPI
+from job_runner import cancel_job, enqueue_job, get_job, start_embedded_worker
+from event_log import get_event_log
+from webhook_processor import events_from_webhook
+from webhook_queue import enqueue_events, start_embedded_workers
 from models import Conversation, Message, MessageResponse, OpenAILog, Post, Session, Comment, CommentReply, ResponseDraft
 from datetime import datetime
+import hashlib
+import hmac
 import json
 from text_analysis import extract_trending_topics
 from sqlalchemy.orm import joinedload
@@ -39,6 +45,9 @@ def inject_global_vars():
         'FACEBOOK_PAGE_NAME': os.getenv('FACEBOOK_PAGE_NAME', 'N/A')
     }
 
+# Append every raw webhook body to the replayable event log
+WEBHOOK_EVENT_LOG = os.getenv('WEBHOOK_EVENT_LOG', 'true').lower() == 'true'
+
 # Your routes here...
 
 @app.route('/')
@@ -412,29 +421,38 @@ def get_post_facebook_url(post_id):
 
 @app.route('/fetch-posts')
 def fetch_posts():
-    """Manually trigger post fetching with progress updates"""
+    """Queue a background post sync and return right away"""
     try:
-        # Create a simple progress tracking mechanism
-        # In a real application, you might want to use a more sophisticated
-        # solution like Celery with WebSockets for real-time progress updates
-        
-        # For now, we'll simulate progress with a simple approach
-        fb_api = FacebookAPI()
-        
-        # Show loading immediately
-        # The JavaScript will handle showing the indicator on click
-        # We'll rely on the page reload to hide it
-        
-        # Fetch posts
-        posts_saved, comments_saved = fb_api.fetch_and_save_posts_with_comments(
-            posts_limit=100)
-        
-        flash(f"Successfully fetched {posts_saved} posts with {comments_saved} comments", "success")
+        job_id, created = enqueue_job('fetch_posts', {'posts_limit': 100, 'incremental': True})
+        if created:
+            flash(f"Post sync started in the background (job #{job_id})", "info")
+        else:
+            flash(f"A post sync is already in progress (job #{job_id})", "info")
     except Exception as e:
-        flash(f"Error fetching posts: {str(e)}", "danger")
+        flash(f"Error starting post sync: {str(e)}", "danger")
     
     return redirect(url_for('index'))
 
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """Status and progress of a background sync job"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_sync_job(job_id):
+    """Cancel a queued or running sync job"""
+    cancelled = cancel_job(job_id)
+    if request.is_json or request.accept_mimetypes.best == 'application/json':
+        return jsonify({'success': cancelled})
+    if cancelled:
+        flash(f"Cancellation requested for job #{job_id}", "info")
+    else:
+        flash(f"Job #{job_id} has already finished", "warning")
+    return redirect(request.referrer or url_for('index'))
+
 @app.route('/comment/<comment_id>/delete', methods=['POST'])
 def delete_comment(comment_id):
     """Delete a comment from Facebook and local database"""
@@ -474,54 +492,51 @@ def delete_comment(comment_id):
     finally:
         session.close()
 
-import time
 import json
 from flask import Response
+from progress_channel import tail
+
+PROGRESS_SYNC_PARAMS = {'posts_limit': 10, 'comments_per_post': 20, 'incremental': True}
+
+
+def _progress_job_id():
+    """Job to follow: ?job_id=, or the (deduplicated) post sync job started for the progress page"""
+    job_id = request.args.get('job_id', type=int)
+    if job_id is None:
+        job_id, _ = enqueue_job('fetch_posts', PROGRESS_SYNC_PARAMS)
+    return job_id
+
 
 @app.route('/fetch-posts-with-progress')
 def fetch_posts_with_progress():
-    """Fetch posts with real-time progress updates"""
+    """Stream a sync job's progress events as Server-Sent Events.
+
+    Only tails the job's progress channel, so any number of tabs can watch
+    one job; a reconnecting EventSource resumes after Last-Event-ID.
+    """
+    job_id = _progress_job_id()
+    after_id = request.headers.get('Last-Event-ID', type=int) or 0
+
     def generate():
-        # Create a new FacebookAPI instance with progress callback
-        fb_api = FacebookAPI()
-        
-        # Set up progress callback
-        def progress_callback(progress, message):
-            data = json.dumps({'progress': progress, 'message': message})
-            yield f"data: {data}\n\n"
-        
-        # Set the callback
-        fb_api.set_progress_callback(progress_callback)
-        
-        try:
-            # Start the process
-            yield from progress_callback(0, "Starting post fetch...")
-            
-            # Fetch posts
-            posts_saved, comments_saved = fb_api.fetch_and_save_posts_with_comments(
-                posts_limit=10, 
-                comments_per_post=20
-            )
-            
-            # Final update
-            yield from progress_callback(100, f"Successfully fetched {posts_saved} posts with {comments_saved} comments")
-            
-            # Add a small delay before closing the connection
-            time.sleep(1)
-            yield "event: close\ndata: {}\n\n"
-            
-        except Exception as e:
-            yield from progress_callback(0, f"Error: {str(e)}")
-            time.sleep(1)
-            yield "event: close\ndata: {}\n\n"
-    
-    return Response(generate(), mimetype='text/event-stream')
+        yield "retry: 2000\n\n"
+        status = None
+        for event in tail(job_id, after_id=after_id):
+            status = event['status']
+            yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+
+        job = get_job(job_id) or {}
+        data = json.dumps({'job_id': job_id, 'status': job.get('status', status), 'result': job.get('result')},
+                          default=str)
+        yield f"event: close\ndata: {data}\n\n"
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Add a new template for the progress page
 @app.route('/fetch-posts-progress')
 def fetch_posts_progress():
     """Page that shows progress of post fetching"""
-    return render_template('fetch_progress.html')
+    return render_template('fetch_progress.html', job_id=_progress_job_id())
 
 
 @app.errorhandler(500)
@@ -696,29 +711,7 @@ def get_comment_replies(comment_id):
         replies = session.query(CommentReply).filter_by(comment_id=comment_id)\
                      .order_by(CommentReply.created_time.desc()).all()
         
-        # If no replies in DB, try to fetch from Facebook
-        if not replies:
-            fb_api = FacebookAPI()
-            fb_replies = fb_api.get_comment_replies(comment_id)
-            
-            # Save fetched replies to database
-            for fb_reply in fb_replies:
-                reply = CommentReply(
-                    comment_id=comment_id,
-                    reply_id=fb_reply['id'],
-                    message=fb_reply.get('message', ''),
-                    created_time=datetime.strptime(
-                        fb_reply['created_time'], 
-                        '%Y-%m-%dT%H:%M:%S%z'
-                    ),
-                    user_name=fb_reply.get('from', {}).get('name', 'Unknown')
-                )
-                session.add(reply)
-            
-            session.commit()
-            replies = session.query(CommentReply).filter_by(comment_id=comment_id)\
-                         .order_by(CommentReply.created_time.desc()).all()
-        
+        # Reply threads are ingested by the post sync, so the UI never waits on Graph
         return jsonify({
             'success': True,
             'replies': [{
@@ -1628,9 +1621,6 @@ def openai_usage():
         session.close()
         
 
-# Add to your app.py
-from message_evaluator import MessageEvaluator
-
 @app.route('/webhook', methods=['GET'])
 def verify_webhook():
     """
@@ -1647,143 +1637,54 @@ def verify_webhook():
         app.logger.error("Webhook verification failed")
         return "Verification failed", 403
 
+
+def valid_webhook_signature(body, signature):
+    """
+    Check the X-Hub-Signature-256 header Facebook sends with every webhook:
+    'sha256=' followed by the HMAC-SHA256 of the raw body, keyed with the app secret
+    """
+    app_secret = os.getenv('FACEBOOK_APP_SECRET')
+    if not app_secret:
+        app.logger.error("FACEBOOK_APP_SECRET is not set; cannot verify webhook signatures")
+        return False
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(app_secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len('sha256='):])
+
+@csrf.exempt
 @app.route('/webhook', methods=['POST'])
 def handle_webhook():
     """
-    Handle incoming webhook events from Facebook
+    Handle incoming webhook events from Facebook.
+
+    The raw body is appended to the event log (event_log.py) and its events
+    are written to the durable webhook queue, so Facebook gets its 200
+    within milliseconds; webhook workers process them. Requests without a
+    valid signature are rejected before anything is logged or queued.
     """
+    if not valid_webhook_signature(request.get_data(), request.headers.get('X-Hub-Signature-256')):
+        app.logger.warning("Rejected webhook with a missing or invalid signature")
+        return "Invalid signature", 403
+
+    if WEBHOOK_EVENT_LOG:
+        # Keep the raw payload for replay even if it cannot be parsed or queued
+        try:
+            get_event_log().append(request.get_data())
+        except Exception as e:
+            app.logger.error(f"Could not append webhook payload to the event log: {str(e)}")
+    
     try:
         data = request.get_json()
         app.logger.debug(f"Webhook received: {data}")
         
-        # Make sure this is a page subscription
-        if data.get('object') == 'page':
-            # Iterate over each entry
-            for entry in data['entry']:
-                page_id = entry['id']
-                timestamp = entry['time']
-                
-                # Iterate over each messaging event
-                for messaging_event in entry.get('messaging', []):
-                    # Handle the message event
-                    handle_message_event(messaging_event)
-        
+        enqueue_events(events_from_webhook(data or {}))
         return "EVENT_RECEIVED", 200
         
     except Exception as e:
         app.logger.error(f"Error handling webhook: {str(e)}")
         return "ERROR", 500
 
-def handle_message_event(event):
-    """
-    Process a message event from Facebook
-    """
-    session = Session()
-    try:
-        sender_id = event['sender']['id']
-        recipient_id = event['recipient']['id']
-        
-        # Check if this is a message event
-        if 'message' in event:
-            message_text = event['message'].get('text', '')
-            message_id = event['message'].get('mid')
-            
-            if not message_text:
-                app.logger.warning("Received message with no text")
-                return
-            
-            app.logger.info(f"New message from {sender_id}: {message_text[:50]}...")
-            
-            # Get or create conversation
-            conversation = session.query(Conversation).filter_by(
-                conversation_id=sender_id).first()
-            
-            if not conversation:
-                conversation = Conversation(
-                    conversation_id=sender_id,
-                    snippet=message_text[:100],
-                    updated_time=datetime.now(),
-                    participants=json.dumps({'sender_id': sender_id, 'recipient_id': recipient_id})
-                )
-                session.add(conversation)
-            
-            # Save the incoming message
-            message = Message(
-                conversation_id=sender_id,
-                message_id=message_id,
-                sender_id=sender_id,
-                sender_name="Customer",  # We'll try to get the actual name later
-                recipient_id=recipient_id,
-                recipient_name=os.getenv('FACEBOOK_PAGE_NAME', 'Page'),
-                message_text=message_text,
-                created_time=datetime.now()
-            )
-            session.add(message)
-            session.commit()
-            
-            # Generate AI response
-            message_evaluator = MessageEvaluator()
-            
-            # Get conversation history for context
-            history_messages = session.query(Message).filter_by(
-                conversation_id=sender_id).order_by(Message.created_time.desc()).limit(10).all()
-            
-            conversation_history = ""
-            if len(history_messages) > 1:  # More than just the current message
-                # Format the conversation history
-                history_list = []
-                for msg in reversed(history_messages[:-1]):  # Exclude the current message
-                    sender = "Customer" if msg.sender_id == sender_id else "You"
-                    history_list.append(f"{sender}: {msg.message_text}")
-                
-                conversation_history = "\n".join(history_list)
-            
-            # Generate response
-            response = message_evaluator.generate_response(message_text, conversation_history)
-            
-            if response['success']:
-                # Send the response via Facebook API
-                fb_api = FacebookAPI()
-                send_success = fb_api.send_message(sender_id, response['response'])
-                
-                # Save the response
-                message_response = MessageResponse(
-                    message_id=message_id,
-                    response_text=response['response'],
-                    generated_at=datetime.now(),
-                    sent_at=datetime.now() if send_success else None,
-                    ai_generated=True,
-                    tokens_used=response.get('tokens_used', 0),
-                    processing_time=response.get('processing_time', 0)
-                )
-                session.add(message_response)
-                
-                # If sent successfully, also save as a message in the conversation
-                if send_success:
-                    response_message = Message(
-                        conversation_id=sender_id,
-                        message_id=f"ai_{datetime.now().timestamp()}",
-                        sender_id=recipient_id,
-                        sender_name=os.getenv('FACEBOOK_PAGE_NAME', 'Page'),
-                        recipient_id=sender_id,
-                        recipient_name="Customer",
-                        message_text=response['response'],
-                        created_time=datetime.now(),
-                        is_ai_generated=True
-                    )
-                    session.add(response_message)
-                
-                session.commit()
-                app.logger.info(f"AI response sent to {sender_id}")
-            else:
-                app.logger.error(f"Failed to generate response: {response.get('error')}")
-        
-    except Exception as e:
-        app.logger.error(f"Error handling message event: {str(e)}")
-        session.rollback()
-    finally:
-        session.close()
-
 
 # Add to your app.py
 @app.route('/messages/ai')
@@ -1863,117 +1764,18 @@ def respond_to_message(message_id):
 # app.py
 @app.route('/fetch_messages')
 def fetch_messages():
-    """Fetch messages from Facebook and save to database"""
-    session = Session()
+    """Queue a background conversation and message sync and return right away"""
     try:
-        fb_api = FacebookAPI()
-        
-        # Show loading immediately
-        flash('Starting message fetch...', 'info')
-        
-        # Fetch conversations and messages
-        result = fb_api.fetch_all_conversations_with_messages(
-            conversations_limit=50,
-            messages_limit=100
-        )
-        
-        if 'error' in result:
-            flash(f'Error fetching messages: {result["error"]}', 'danger')
-            return redirect(url_for('messages'))
-        
-        # Process and save to database
-        saved_conversations = 0
-        saved_messages = 0
-        
-        for conv_data in result['conversations']:
-            conversation = conv_data['conversation']
-            messages = conv_data['messages']
-            
-            # Save or update conversation
-            existing_conv = session.query(Conversation).filter_by(
-                conversation_id=conversation['id']).first()
-            
-            if existing_conv:
-                # Update existing conversation
-                existing_conv.snippet = conversation.get('snippet', '')[:500]
-                existing_conv.updated_time = datetime.fromisoformat(
-                    conversation['updated_time'].replace('Z', '+00:00'))
-                existing_conv.message_count = conversation.get('message_count', 0)
-                existing_conv.participants = json.dumps(conversation.get('participants', {}))
-                existing_conv.can_reply = conversation.get('can_reply', True)
-            else:
-                # Create new conversation
-                new_conv = Conversation(
-                    conversation_id=conversation['id'],
-                    snippet=conversation.get('snippet', '')[:500],
-                    updated_time=datetime.fromisoformat(
-                        conversation['updated_time'].replace('Z', '+00:00')),
-                    message_count=conversation.get('message_count', 0),
-                    participants=json.dumps(conversation.get('participants', {})),
-                    can_reply=conversation.get('can_reply', True)
-                )
-                session.add(new_conv)
-            
-            saved_conversations += 1
-            
-            # Save messages
-            for msg in messages:
-                # Check if message already exists
-                existing_msg = session.query(Message).filter_by(
-                    message_id=msg['id']).first()
-                
-                if existing_msg:
-                    # Update existing message
-                    existing_msg.message_text = msg.get('message', '')
-                    existing_msg.created_time = datetime.fromisoformat(
-                        msg['created_time'].replace('Z', '+00:00'))
-                    
-                    # Update sender/recipient info if available
-                    if 'from' in msg:
-                        existing_msg.sender_id = msg['from'].get('id', '')
-                        existing_msg.sender_name = msg['from'].get('name', '')
-                    if 'to' in msg and msg['to'].get('data'):
-                        existing_msg.recipient_id = msg['to']['data'][0].get('id', '')
-                        existing_msg.recipient_name = msg['to']['data'][0].get('name', '')
-                else:
-                    # Create new message
-                    sender_id = msg['from'].get('id', '') if 'from' in msg else ''
-                    sender_name = msg['from'].get('name', '') if 'from' in msg else ''
-                    
-                    recipient_id = ''
-                    recipient_name = ''
-                    if 'to' in msg and msg['to'].get('data'):
-                        recipient_id = msg['to']['data'][0].get('id', '')
-                        recipient_name = msg['to']['data'][0].get('name', '')
-                    
-                    new_msg = Message(
-                        conversation_id=conversation['id'],
-                        message_id=msg['id'],
-                        sender_id=sender_id,
-                        sender_name=sender_name,
-                        recipient_id=recipient_id,
-                        recipient_name=recipient_name,
-                        message_text=msg.get('message', ''),
-                        created_time=datetime.fromisoformat(
-                            msg['created_time'].replace('Z', '+00:00')),
-                        has_attachments=bool(msg.get('attachments', {}).get('data', []))
-                    )
-                    session.add(new_msg)
-                
-                saved_messages += 1
-        
-        session.commit()
-        
-        flash(f'Successfully fetched {saved_conversations} conversations with {saved_messages} messages', 'success')
-        return redirect(url_for('messages'))
-        
+        job_id, created = enqueue_job('fetch_messages')
+        if created:
+            flash(f'Message sync started in the background (job #{job_id})', 'info')
+        else:
+            flash(f'A message sync is already in progress (job #{job_id})', 'info')
     except Exception as e:
-        session.rollback()
-        logger.error(f"Error fetching messages: {str(e)}")
-        flash(f'Error fetching messages: {str(e)}', 'danger')
-        return redirect(url_for('messages'))
-    finally:
-        session.close()
+        logger.error(f"Error starting message sync: {str(e)}")
+        flash(f'Error starting message sync: {str(e)}', 'danger')
+    
+    return redirect(url_for('messages'))
 
 @app.route('/api/conversations')
 def api_conversations():
@@ -2034,5 +1836,37 @@ def api_conversation_messages(conversation_id):
     finally:
         session.close()
 
+def start_background_workers(embedded_webhook_workers='true'):
+    """
+    Start the embedded workers; call once, in the process serving requests
+
+    Args:
+        embedded_webhook_workers (str): Default for WEBHOOK_EMBEDDED_WORKERS
+    """
+    # Run queued sync jobs inside the web process unless dedicated workers
+    # (python job_runner.py) handle them. Jobs are claimed atomically, so a
+    # worker in each web process is safe.
+    if os.getenv('SYNC_JOB_EMBEDDED_WORKER', 'true').lower() == 'true':
+        start_embedded_worker()
+
+    # Process queued webhook events inside the web process unless dedicated
+    # workers (python webhook_queue.py) handle them. The pool owns every
+    # partition, so a second pool polling the same queue would break the
+    # per-sender ordering.
+    if os.getenv('WEBHOOK_EMBEDDED_WORKERS', embedded_webhook_workers).lower() == 'true':
+        start_embedded_workers()
+    else:
+        app.logger.info("Webhook events are queued but not processed here; run python webhook_queue.py")
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # The debug reloader runs this file twice: a watcher process that never
+    # serves requests, and a child (WERKZEUG_RUN_MAIN=true) that does
+    if os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
+    app.run(debug=True, host='0.0.0.0', port=5001)
+else:
+    # Imported by a WSGI server, which may run several worker processes:
+    # each would start its own pool, so webhook workers only run here when
+    # WEBHOOK_EMBEDDED_WORKERS=true is set for a single-process server
+    start_background_workers(embedded_webhook_workers='false')
@@ -0,0 +1,411 @@
+# async_fb_api.py
+"""
+Asyncio ingestion engine for the Facebook Graph API.
+
+AsyncFacebookAPI mirrors the read methods of FacebookAPI on top of aiohttp.
+Requests fan out concurrently, bounded by a semaphore, so a single process
+can sync thousands of posts and conversations without a thread per request.
+SyncFacebookAPI wraps it behind the blocking FacebookAPI interface for the
+command line scripts.
+
+Like the blocking client, a post whose comments could not be read after
+retries carries the failure under post['comments_error'], and with strict
+set a failed page of posts raises GraphAPIError, so a sync never mistakes
+a failed read for an empty one.
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional
+
+import aiohttp
+from dotenv import load_dotenv
+
+from fb_api import EXPANDED_POSTS_PAGE_SIZE, GRAPH_URL, FacebookAPI, parse_graph_time, to_utc_naive
+from rate_limiter import get_rate_limiter
+from retry_policy import GraphAPIError, get_retry_policy
+
+logger = logging.getLogger('fb_api')
+
+# Load environment variables
+load_dotenv()
+
+
+class AsyncFacebookAPI:
+    def __init__(self, max_concurrency: Optional[int] = None):
+        """
+        Initialize the async client
+
+        Args:
+            max_concurrency (int): Maximum number of Graph requests in flight
+                (default: FACEBOOK_ASYNC_CONCURRENCY or 50)
+        """
+        self.base_url = os.getenv('FACEBOOK_GRAPH_URL', GRAPH_URL).rstrip('/')
+        self.access_token = os.getenv('FACEBOOK_PAGE_ACCESS_TOKEN')
+        self.page_id = os.getenv('FACEBOOK_PAGE_ID')
+        self.max_concurrency = max_concurrency or int(os.getenv('FACEBOOK_ASYNC_CONCURRENCY', '50'))
+        self.rate_limiter = get_rate_limiter()
+        self.retry_policy = get_retry_policy()
+        # Graph requests that still failed after retries, newest last
+        self.failed_requests = []
+        self._semaphore = None
+        self._http = None
+
+    async def open(self):
+        """
+        Open the underlying aiohttp session
+        """
+        if self._http is None:
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=float(os.getenv('FACEBOOK_HTTP_CONNECT_TIMEOUT', '5')),
+                sock_read=float(os.getenv('FACEBOOK_HTTP_READ_TIMEOUT', '30'))
+            )
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._http = aiohttp.ClientSession(timeout=timeout, connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        """
+        Close the underlying aiohttp session
+        """
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get(self, url: str, params: Optional[Dict] = None, strict: bool = False) -> Optional[Dict]:
+        """
+        GET a Graph URL, paced by the shared rate limiter, bounded by the
+        semaphore and retried according to the shared retry policy.
+
+        A request that still fails returns None, or raises GraphAPIError
+        with strict set.
+        """
+        await self.open()
+        query = {k: str(v) for k, v in (params or {}).items()}
+        if 'access_token=' not in url:
+            query['access_token'] = self.access_token
+
+        self.retry_policy.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            async with self._semaphore:
+                delay = self.rate_limiter.reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                try:
+                    async with self._http.get(url, params=query) as response:
+                        data = await response.json(content_type=None)
+                        error = data.get('error') if isinstance(data, dict) else None
+                        retry_after = response.headers.get('Retry-After')
+                        self.rate_limiter.observe(response.headers, error, retry_after)
+
+                        if response.status == 200:
+                            return data
+                        failure = {'status_code': response.status, 'error': error}
+                        message = f"{response.status}: {error or data}"
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    failure = {'exception': e}
+                    message = str(e) or type(e).__name__
+
+            if not self.retry_policy.should_retry(attempt, 'GET', **failure):
+                failure = GraphAPIError(message, endpoint=url, status_code=failure.get('status_code'),
+                                        error=failure.get('error'), attempts=attempt)
+                self.failed_requests.append(failure)
+                logger.error(f"Graph request to {url} failed after {attempt} attempt(s): {message}")
+                if strict:
+                    raise failure
+                return None
+            delay = self.retry_policy.backoff(attempt, retry_after)
+            logger.warning(f"Graph request to {url} failed ({message}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def iter_edge(self, endpoint: str, params: Optional[Dict] = None, max_items: Optional[int] = None,
+                        first_page: Optional[Dict] = None, strict: bool = False):
+        """
+        Yield the records of a Graph edge, following paging.next cursors.
+
+        first_page, if given, is used instead of requesting the edge (e.g. a
+        page embedded through field expansion). With strict set, a page that
+        fails after retries raises GraphAPIError instead of ending the edge.
+        """
+        if max_items is not None and max_items <= 0:
+            return
+
+        count = 0
+        if first_page is None:
+            response_data = await self._get(f"{self.base_url}/{endpoint}", params, strict=strict)
+        else:
+            response_data = first_page
+        while response_data and 'data' in response_data:
+            for record in response_data['data']:
+                yield record
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
+
+            next_url = response_data.get('paging', {}).get('next')
+            if not next_url:
+                return
+            response_data = await self._get(next_url, strict=strict)
+
+    async def _collect(self, endpoint: str, params: Optional[Dict] = None, max_items: Optional[int] = None,
+                       first_page: Optional[Dict] = None, strict: bool = False) -> List[Dict]:
+        """
+        Read a whole edge into a list
+        """
+        return [record async for record in self.iter_edge(endpoint, params, max_items, first_page, strict)]
+
+    async def fetch_posts(self, limit: int = 100, strict: bool = False,
+                          comments_field: Optional[str] = None) -> List[Dict]:
+        """
+        Fetch posts from the Facebook page, with comments_field (a field
+        expansion) added to the requested fields if given
+        """
+        params = {
+            'fields': 'id,message,created_time,updated_time',
+            'limit': min(limit, 100)
+        }
+        if comments_field:
+            params['fields'] += ',' + comments_field
+            params['limit'] = min(limit, EXPANDED_POSTS_PAGE_SIZE)
+        return await self._collect(f"{self.page_id}/posts", params, max_items=limit, strict=strict)
+
+    async def fetch_post_comments(self, post_id: str, comments_per_post: int = 100, first_page: Optional[Dict] = None,
+                                  strict: bool = False) -> List[Dict]:
+        """
+        Fetch all comments of a post with their reply counts, comments_per_post per page
+        """
+        params = {
+            'fields': 'id,message,created_time,from{name},comment_count',
+            'limit': comments_per_post
+        }
+        return await self._collect(f"{post_id}/comments", params, first_page=first_page, strict=strict)
+
+    async def _fetch_comments_for_post(self, post: Dict, comments_per_post: int):
+        """
+        Store a post's comments under post['comments'], continuing from an
+        embedded page that has more, or the failure under post['comments_error']
+        """
+        embedded = post.get('comments')
+        if embedded is not None and not embedded.get('paging', {}).get('next'):
+            post['comments'] = {'data': embedded.get('data', [])}
+            return
+        try:
+            comments = await self.fetch_post_comments(post['id'], comments_per_post, first_page=embedded,
+                                                      strict=True)
+            post['comments'] = {'data': comments}
+        except GraphAPIError as e:
+            logger.warning(f"Could not fetch comments for post {post['id']}: {e}")
+            post['comments'] = {'data': []}
+            post['comments_error'] = e.to_dict()
+
+    async def _fetch_replies(self, comment: Dict):
+        try:
+            comment['replies'] = {'data': await self.get_comment_replies(comment['id'], 100, strict=True)}
+        except GraphAPIError as e:
+            logger.warning(f"Could not fetch replies for comment {comment['id']}: {e}")
+
+    async def fetch_posts_with_comments(self, limit: int = 50, comments_per_post: int = 100, strict: bool = False,
+                                        expand_comments: bool = False, replies: bool = False) -> List[Dict]:
+        """
+        Fetch posts, then the comments of every post concurrently.
+
+        With expand_comments each post's first page of comments is read
+        with the posts, and only posts with more comments need follow-up
+        requests; if the expanded request is rejected the comments are
+        fetched separately. With replies, the reply threads of comments
+        whose comment_count says they have replies are stored under
+        comment['replies'].
+        """
+        posts = None
+        if expand_comments:
+            try:
+                posts = await self.fetch_posts(
+                    limit, strict=True, comments_field=FacebookAPI._expanded_comments_field(comments_per_post))
+                for post in posts:
+                    # Posts without comments have no 'comments' field at all
+                    post.setdefault('comments', {'data': []})
+            except GraphAPIError as e:
+                logger.warning(f"Expanded posts request failed ({e}), fetching comments separately")
+        if posts is None:
+            posts = await self.fetch_posts(limit, strict=strict)
+        await asyncio.gather(*(self._fetch_comments_for_post(post, comments_per_post) for post in posts))
+
+        if replies:
+            threaded = [comment for post in posts for comment in post['comments']['data']
+                        if comment.get('comment_count')]
+            await asyncio.gather(*(self._fetch_replies(comment) for comment in threaded))
+
+        logger.info(f"Fetched {len(posts)} posts with {sum(len(post['comments']['data']) for post in posts)} comments")
+        return posts
+
+    async def fetch_conversations(self, limit: int = 50) -> List[Dict]:
+        """
+        Fetch recent conversations from the Facebook page
+        """
+        params = {
+            'fields': 'id,snippet,updated_time,message_count,participants,can_reply',
+            'limit': min(limit, 50)
+        }
+        return await self._collect(f"{self.page_id}/conversations", params, max_items=limit)
+
+    async def fetch_messages(self, conversation_id: str, limit: int = 100) -> List[Dict]:
+        """
+        Fetch all messages of a conversation, limit messages per page
+        """
+        params = {
+            'fields': 'id,from,to,message,created_time,attachments',
+            'limit': limit
+        }
+        return await self._collect(f"{conversation_id}/messages", params)
+
+    async def fetch_messages_for_conversations(self, conversation_ids: List[str],
+                                               limit: int = 100) -> Dict[str, List[Dict]]:
+        """
+        Fetch the messages of many conversations concurrently
+        """
+        message_lists = await asyncio.gather(
+            *(self.fetch_messages(conversation_id, limit) for conversation_id in conversation_ids)
+        )
+        return dict(zip(conversation_ids, message_lists))
+
+    async def get_comment_replies(self, comment_id: str, limit: int = 10, strict: bool = False) -> List[Dict]:
+        """
+        Get all replies to a comment, limit replies per page
+        """
+        params = {
+            'fields': 'id,message,created_time,from{name}',
+            'limit': limit
+        }
+        return await self._collect(f"{comment_id}/comments", params, strict=strict)
+
+    async def fetch_user_profile(self, user_id: str) -> Optional[Dict]:
+        """
+        Fetch user profile information
+        """
+        return await self._get(f"{self.base_url}/{user_id}", {'fields': 'name,first_name,last_name,profile_pic'})
+
+
+class SyncFacebookAPI(FacebookAPI):
+    """
+    FacebookAPI whose reads run on AsyncFacebookAPI.
+
+    Drop-in replacement for FacebookAPI in blocking code such as
+    fetch_posts.py and fetch_messages.py: each read call runs its async
+    counterpart to completion. fetch_conversations also fetches the
+    messages of every returned conversation concurrently, so the usual
+    "list conversations, then fetch_messages for each" loop is served from
+    that prefetch instead of one request at a time.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, page_id: Optional[str] = None,
+                 access_token: Optional[str] = None):
+        super().__init__(page_id, access_token)
+        self.max_concurrency = max_concurrency
+        self._prefetched_messages = {}
+
+    def _client(self) -> AsyncFacebookAPI:
+        """
+        Async client configured with this instance's page, token, rate limit bucket and base URL
+        """
+        api = AsyncFacebookAPI(self.max_concurrency)
+        api.base_url = self.base_url
+        api.page_id = self.page_id
+        api.access_token = self.access_token
+        api.rate_limiter = self.rate_limiter
+        return api
+
+    def _run(self, method_name: str, *args, **kwargs):
+        """
+        Run one AsyncFacebookAPI method in a fresh event loop
+        """
+        async def call():
+            async with self._client() as api:
+                try:
+                    return await getattr(api, method_name)(*args, **kwargs)
+                finally:
+                    self.failed_requests.extend(api.failed_requests)
+
+        return asyncio.run(call())
+
+    def fetch_posts(self, limit: int = 100) -> List[Dict]:
+        return self._run('fetch_posts', limit)
+
+    def iter_posts(self, limit: Optional[int] = 100):
+        return iter(self.fetch_posts(limit or 100))
+
+    def fetch_posts_with_comments(self, limit: int = 50, comments_per_post: int = 100,
+                                  max_workers: Optional[int] = None,
+                                  expand_comments: Optional[bool] = None, strict: bool = False) -> List[Dict]:
+        if expand_comments is None:
+            expand_comments = self.expand_comments
+        return self._run('fetch_posts_with_comments', limit, comments_per_post, strict=strict,
+                         expand_comments=expand_comments, replies=self.sync_replies)
+
+    def iter_posts_with_comments(self, limit: int = 50, comments_per_post: int = 100,
+                                 max_workers: Optional[int] = None, use_batch: Optional[bool] = None,
+                                 since=None, incremental: bool = False, strict: bool = False,
+                                 expand_comments: Optional[bool] = None):
+        if use_batch is None:
+            use_batch = self.use_batch
+        if since is not None or incremental or use_batch:
+            # Incremental syncs need the watermark-aware blocking path, and
+            # Graph batch calls are a blocking transport
+            return super().iter_posts_with_comments(limit, comments_per_post, max_workers=max_workers,
+                                                    use_batch=use_batch, since=since, incremental=incremental,
+                                                    strict=strict, expand_comments=expand_comments)
+
+        def posts():
+            # Run on first next(), so a strict failure is raised where the stream is read
+            yield from self.fetch_posts_with_comments(limit, comments_per_post, expand_comments=expand_comments,
+                                                      strict=strict)
+
+        return posts()
+
+    def fetch_conversations(self, limit: int = 50, prefetch_messages: bool = True,
+                            messages_limit: int = 100) -> List[Dict]:
+        async def call():
+            async with self._client() as api:
+                conversations = await api.fetch_conversations(limit)
+                messages = {}
+                if prefetch_messages:
+                    messages = await api.fetch_messages_for_conversations(
+                        [conv['id'] for conv in conversations], messages_limit)
+                self.failed_requests.extend(api.failed_requests)
+                return conversations, messages
+
+        conversations, self._prefetched_messages = asyncio.run(call())
+        return conversations
+
+    def fetch_messages(self, conversation_id: str, limit: int = 100, since=None, strict: bool = False) -> List[Dict]:
+        if since is None and conversation_id in self._prefetched_messages:
+            return self._prefetched_messages.pop(conversation_id)
+        async def call():
+            async with self._client() as api:
+                return await api.fetch_messages(conversation_id, limit), api.failed_requests
+
+        messages, failures = asyncio.run(call())
+        self.failed_requests.extend(failures)
+        if strict and failures:
+            raise failures[-1]
+        if since is not None:
+            messages = [msg for msg in messages
+                        if to_utc_naive(parse_graph_time(msg['created_time'])) > since]
+        return messages
+
+    def get_comment_replies(self, comment_id: str, limit: int = 10) -> List[Dict]:
+        return self._run('get_comment_replies', comment_id, limit)
+
+    def fetch_user_profile(self, user_id: str) -> Optional[Dict]:
+        return self._run('fetch_user_profile', user_id)
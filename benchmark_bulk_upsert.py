@@ -0,0 +1,119 @@
+# benchmark_bulk_upsert.py
+"""
+Compare the row-by-row comment insert loop with the bulk upsert path.
+
+Both paths write the same synthetic posts and comments into a fresh
+temporary SQLite database; sentiment and keyword analysis is done up front
+so only database time is measured.
+
+Usage:
+    python benchmark_bulk_upsert.py --posts 200 --comments-per-post 50
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from fb_api import FacebookAPI
+from models import Base, Comment, Post
+
+
+def make_posts(posts: int, comments_per_post: int):
+    """
+    Build parsed posts in the shape parse_post_with_comments_data returns
+    """
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    data = []
+    for p in range(posts):
+        comments = [{
+            'id': f"{p}_{c}",
+            'message': f"Comment {c} on post {p}",
+            'created_time': start + timedelta(minutes=p * comments_per_post + c),
+            'from': f"User {c}",
+            'sentiment_score': 0.1,
+            'sentiment_category': 'positive',
+            'keywords': []
+        } for c in range(comments_per_post)]
+        data.append({
+            'post_id': f"page_{p}",
+            'message': f"Post {p}",
+            'created_time': start + timedelta(hours=p),
+            'comments': comments,
+            'keywords': [],
+            'avg_sentiment': 0.1,
+            'analyzed': True
+        })
+    return data
+
+
+def row_by_row(session, posts_data):
+    """
+    The previous save loop: one existence query and one ORM object per row
+    """
+    for post_data in posts_data:
+        session.add(Post(page_id='page', post_id=post_data['post_id'], message=post_data['message'],
+                         created_time=post_data['created_time'], trending_topics='[]'))
+        session.flush()
+        for comment_data in post_data['comments']:
+            if session.query(Comment).filter_by(comment_id=comment_data['id']).count() == 0:
+                session.add(Comment(
+                    post_id=post_data['post_id'],
+                    comment_id=comment_data['id'],
+                    message=comment_data['message'],
+                    created_time=comment_data['created_time'],
+                    user_name=comment_data['from'],
+                    sentiment_score=comment_data['sentiment_score'],
+                    sentiment_category=comment_data['sentiment_category'],
+                    keywords=json.dumps(comment_data['keywords'])
+                ))
+        session.commit()
+
+
+def bulk(session, posts_data, batch_size):
+    """
+    The bulk path used by FacebookAPI.save_post_with_comments
+    """
+    api = FacebookAPI.__new__(FacebookAPI)
+    api.page_id = 'page'
+    api.session = session
+    for i in range(0, len(posts_data), batch_size):
+        api.bulk_save_posts_with_comments(posts_data[i:i + batch_size])
+
+
+def timed(label, func, rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        start = time.perf_counter()
+        func(session)
+        elapsed = time.perf_counter() - start
+        session.close()
+        engine.dispose()
+    print(f"{label:<12} {elapsed:8.2f}s {rows / elapsed:10.0f} rows/sec")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark row-by-row vs bulk comment ingestion')
+    parser.add_argument('--posts', type=int, default=200, help='Number of posts')
+    parser.add_argument('--comments-per-post', type=int, default=50, help='Comments per post')
+    parser.add_argument('--batch-size', type=int, default=25, help='Posts per bulk transaction')
+    args = parser.parse_args()
+
+    rows = args.posts * (args.comments_per_post + 1)
+    print(f"Writing {args.posts} posts with {args.comments_per_post} comments each ({rows} rows)")
+
+    slow = timed('row-by-row', lambda s: row_by_row(s, make_posts(args.posts, args.comments_per_post)), rows)
+    fast = timed('bulk', lambda s: bulk(s, make_posts(args.posts, args.comments_per_post), args.batch_size), rows)
+    print(f"Speedup: {slow / fast:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+# benchmark_sync.py
+"""
+Benchmark the sync, reply and messaging paths offline against fake_graph_server.py.
+
+Starts a fake Graph API in-process, points FacebookAPI at it and runs
+each scenario against a fresh temporary SQLite database, so results are
+repeatable and nothing touches production Facebook.
+
+Usage:
+    python benchmark_sync.py --posts 500 --comments 50 --latency-ms 40
+    python benchmark_sync.py --scenarios conversations --conversations 1000 --error-rate 0.02
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ('posts', 'resync', 'replies', 'conversations', 'reply', 'messaging')
+
+BENCH_PAGE_ID = '1000'
+
+
+def run_scenario(name: str, fb_api, args) -> int:
+    """
+    Run one scenario and return the number of items it processed
+    """
+    if name == 'posts':
+        posts, comments = fb_api.fetch_and_save_posts_with_comments(posts_limit=args.posts, incremental=True)
+        return posts + comments
+    if name == 'resync':
+        # Incremental re-sync after 'posts': only watermark checks, no new rows
+        posts, comments = fb_api.fetch_and_save_posts_with_comments(posts_limit=args.posts, incremental=True)
+        return posts + comments
+    if name == 'replies':
+        return fb_api.sync_comment_replies(comments_limit=args.posts * args.comments)
+    if name == 'conversations':
+        from conversation_sync import ConversationSync
+        stats = ConversationSync(fb_api).run()
+        return stats['conversations_synced'] + stats['messages_saved']
+    if name == 'reply':
+        comment_ids = [f"{BENCH_PAGE_ID}_{i % args.posts}_c{i % args.comments}" for i in range(args.writes)]
+        with ThreadPoolExecutor(max_workers=args.write_workers) as executor:
+            results = list(executor.map(lambda comment_id: fb_api.reply_to_comment(comment_id, 'Thanks!'),
+                                        comment_ids))
+        return sum(1 for result in results if result)
+    if name == 'messaging':
+        recipients = [f"psid_{BENCH_PAGE_ID}_{i % max(args.conversations, 1)}" for i in range(args.writes)]
+        with ThreadPoolExecutor(max_workers=args.write_workers) as executor:
+            results = list(executor.map(lambda recipient: fb_api.send_message(recipient, 'Hello!'), recipients))
+        return sum(1 for result in results if result)
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sync paths against a local fake Graph API')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run, in order (default: {','.join(SCENARIOS)})")
+    parser.add_argument('--posts', type=int, default=200, help='Posts on the page')
+    parser.add_argument('--comments', type=int, default=20, help='Comments per post')
+    parser.add_argument('--replies', type=int, default=2, help='Replies per threaded comment')
+    parser.add_argument('--conversations', type=int, default=100, help='Conversations on the page')
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--writes', type=int, default=200, help='Comment replies / messages sent by write scenarios')
+    parser.add_argument('--write-workers', type=int, default=8, help='Threads sending writes')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Delay added to every request')
+    parser.add_argument('--jitter-ms', type=float, default=10.0, help='Random extra delay per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of transient 500 errors')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of rate limit errors')
+    parser.add_argument('--usage', type=float, default=0.0, help='Usage %% reported in usage headers')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the fault decisions')
+    args = parser.parse_args()
+
+    from fake_graph_server import FakeGraphData, FakeGraphServer, FaultInjector
+
+    data = FakeGraphData(args.posts, args.comments, args.replies, conversations=args.conversations,
+                         messages=args.messages)
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                           args.usage, seed=args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp, FakeGraphServer(data, faults) as server:
+        # The database and Graph URL are read when models and fb_api are imported
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        os.environ['FACEBOOK_GRAPH_URL'] = server.base_url
+        from fb_api import FacebookAPI
+        from models import Base, engine
+
+        Base.metadata.create_all(engine)
+        print(f"Fake Graph API at {server.base_url}: {args.posts} posts x {args.comments} comments, "
+              f"{args.conversations} conversations x {args.messages} messages, "
+              f"{args.latency_ms:.0f}ms (+{args.jitter_ms:.0f}ms) latency")
+        print(f"{'scenario':<14} {'seconds':>8} {'items':>8} {'items/s':>9} {'requests':>9} {'errors':>7}")
+
+        for name in [name.strip() for name in args.scenarios.split(',') if name.strip()]:
+            fb_api = FacebookAPI(page_id=BENCH_PAGE_ID, access_token='fake-token')
+            before = server.stats()
+            start = time.perf_counter()
+            items = run_scenario(name, fb_api, args)
+            elapsed = time.perf_counter() - start
+            after = server.stats()
+            errors = sum(count for status, count in after['status_counts'].items() if status >= 400) - \
+                sum(count for status, count in before['status_counts'].items() if status >= 400)
+            print(f"{name:<14} {elapsed:8.2f} {items:8d} {items / elapsed:9.0f} "
+                  f"{after['requests'] - before['requests']:9d} {errors:7d}")
+            fb_api.session.close()
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
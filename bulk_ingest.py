@@ -0,0 +1,118 @@
+# bulk_ingest.py
+"""
+Set-based helpers for bulk ingestion on SQLite and PostgreSQL.
+
+Instead of checking and inserting rows one ORM object at a time, callers
+look up which keys already exist with one IN query per chunk and insert
+the rest with INSERT ... ON CONFLICT DO NOTHING / DO UPDATE.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import case, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Rows per INSERT statement / values per IN list; stays well below
+# SQLite's bound-parameter limit for our widest tables
+DEFAULT_BATCH_SIZE = 500
+
+_UPSERT_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def supports_upsert(session) -> bool:
+    """
+    Check whether the session's database supports INSERT ... ON CONFLICT
+    """
+    return session.get_bind().dialect.name in _UPSERT_DIALECTS
+
+
+def existing_keys(session, column, keys: Iterable, batch_size: int = DEFAULT_BATCH_SIZE) -> Set:
+    """
+    Return the subset of keys already present in column, one query per chunk
+    """
+    keys = list(set(keys))
+    found = set()
+    for chunk in _chunks(keys, batch_size):
+        found.update(session.execute(select(column).where(column.in_(chunk))).scalars())
+    return found
+
+
+def insert_ignore(session, model, rows: List[Dict], conflict_columns: List[str],
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Insert rows, skipping any that conflict on conflict_columns.
+
+    Uses INSERT ... ON CONFLICT DO NOTHING where supported and falls back to
+    filtering out existing keys first on other databases. Returns the number
+    of rows submitted for insertion.
+    """
+    if not rows:
+        return 0
+
+    insert = _UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if insert is None:
+        key = conflict_columns[0]
+        present = existing_keys(session, getattr(model, key), [row[key] for row in rows], batch_size)
+        rows = [row for row in rows if row[key] not in present]
+        for chunk in _chunks(rows, batch_size):
+            session.execute(model.__table__.insert(), chunk)
+        return len(rows)
+
+    for chunk in _chunks(rows, batch_size):
+        statement = insert(model.__table__).values(chunk)
+        session.execute(statement.on_conflict_do_nothing(index_elements=conflict_columns))
+    return len(rows)
+
+
+def upsert_max(session, model, rows: List[Dict], conflict_columns: List[str], column: str,
+               batch_size: int = DEFAULT_BATCH_SIZE) -> Optional[int]:
+    """
+    Insert rows or, on conflict, keep the larger of the stored and new value of column.
+
+    Returns None when the database has no ON CONFLICT support so the caller
+    can fall back to a per-row path.
+    """
+    insert = _UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if insert is None:
+        return None
+
+    for chunk in _chunks(rows, batch_size):
+        statement = insert(model.__table__).values(chunk)
+        current = getattr(model.__table__.c, column)
+        incoming = getattr(statement.excluded, column)
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: case((current.is_(None), incoming), (incoming > current, incoming), else_=current)}
+        )
+        session.execute(statement)
+    return len(rows)
+
+
+def upsert(session, model, rows: List[Dict], conflict_columns: List[str], update_columns: List[str],
+           batch_size: int = DEFAULT_BATCH_SIZE) -> Optional[int]:
+    """
+    Insert rows or, on conflict, overwrite update_columns with the new values.
+
+    Returns None when the database has no ON CONFLICT support so the caller
+    can fall back to a per-row path.
+    """
+    insert = _UPSERT_DIALECTS.get(session.get_bind().dialect.name)
+    if insert is None:
+        return None
+
+    for chunk in _chunks(rows, batch_size):
+        statement = insert(model.__table__).values(chunk)
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: getattr(statement.excluded, column) for column in update_columns}
+        )
+        session.execute(statement)
+    return len(rows)
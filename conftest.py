@@ -0,0 +1,101 @@
+"""
+Shared pytest fixtures and helpers for the webhook and ingestion tests.
+
+Every fixture patches module state through monkeypatch, so the real
+sessions, handlers and services are back in place after each test.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+
+import idempotency
+import page_registry
+import webhook_processor
+from fake_graph_server import FakeGraphData, FakeGraphServer
+from idempotency import IdempotencyIndex
+from message_coalescer import MessageCoalescer
+from models import Base, Session
+from webhook_queue import WEBHOOK_PARTITIONS, WebhookWorker
+
+
+@pytest.fixture
+def temp_database(monkeypatch, tmp_path):
+    """
+    Point every Session at a fresh SQLite database and forget the cached event keys
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    Base.metadata.create_all(engine)
+    # Session.configure(bind=...) only updates this dict
+    monkeypatch.setitem(Session.kw, 'bind', engine)
+    monkeypatch.setattr(idempotency, '_index', IdempotencyIndex())
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def fake_graph(temp_database, monkeypatch):
+    """
+    Serve a small synthetic page 'PG' from fake_graph_server.py and point
+    FacebookAPI clients built from the environment at it
+    """
+    server = FakeGraphServer(FakeGraphData(posts=5, comments=4, replies=2, reply_every=2))
+    monkeypatch.setenv('FACEBOOK_GRAPH_URL', server.start())
+    monkeypatch.setenv('FACEBOOK_PAGE_ID', 'PG')
+    monkeypatch.setenv('FACEBOOK_PAGE_ACCESS_TOKEN', 'test-token')
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def messenger_stubs(temp_database, monkeypatch):
+    """
+    Replace OpenAI and the Send API with stand-ins that record their calls.
+
+    Returns a namespace with the prompts sent to the evaluator, the
+    (page_id, recipient_id, text) replies sent to Messenger, and
+    use_coalescer(window, max_wait) to install a coalescer for the test.
+    """
+    stubs = SimpleNamespace(prompts=[], sends=[])
+
+    class RecordingEvaluator:
+        def generate_response(self, message_text, conversation_history=""):
+            stubs.prompts.append(message_text)
+            return {'success': True, 'response': 'Thanks, we will get back to you', 'tokens_used': 10}
+
+    class RecordingAPI:
+        def __init__(self, page_id=None):
+            self.page_id = page_id
+            self.session = Session()
+
+        def send_message(self, recipient_id, text):
+            stubs.sends.append((self.page_id, recipient_id, text))
+            return True
+
+    def use_coalescer(window=3.0, max_wait=15.0):
+        monkeypatch.setattr(webhook_processor, '_coalescer', MessageCoalescer(window=window, max_wait=max_wait))
+
+    monkeypatch.setattr(webhook_processor, 'MessageEvaluator', RecordingEvaluator)
+    monkeypatch.setattr(page_registry, 'api_for_page', lambda page_id=None, api_class=None: RecordingAPI(page_id))
+    monkeypatch.setattr(webhook_processor.get_profile_resolver(), 'schedule_backfill', lambda: None)
+    use_coalescer()
+    stubs.use_coalescer = use_coalescer
+    return stubs
+
+
+def message(mid, text='hello', sender='u1'):
+    """
+    A Messenger message event as queued by enqueue_events
+    """
+    return ('messaging', 'pg', sender, {'sender': {'id': sender}, 'recipient': {'id': 'pg'},
+                                        'message': {'mid': mid, 'text': text}})
+
+
+def drain():
+    """
+    Handle every queued event that is due, on all partitions
+    """
+    worker = WebhookWorker(list(range(WEBHOOK_PARTITIONS)), worker_id='test')
+    while worker.poll():
+        pass
@@ -0,0 +1,222 @@
+# conversation_sync.py
+"""
+Concurrent, paginated sync of page conversations and their messages.
+
+ConversationSync pages through every conversation of the page, skips
+conversations whose updated_time matches the stored one, fetches the new
+messages of the remaining conversations in parallel and saves each page of
+conversations with set-based inserts. A conversation's stored updated_time
+and message watermark only move forward once its messages are saved, so a
+conversation that failed is picked up again by the next sync.
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from bulk_ingest import insert_ignore, upsert
+from fb_api import FacebookAPI, SYNC_CONVERSATION_MESSAGES, parse_graph_time, to_utc_naive
+from models import Conversation, Message
+from retry_policy import GraphAPIError
+
+logger = logging.getLogger('fb_api')
+
+CONVERSATION_FIELDS = 'id,snippet,updated_time,message_count,participants,can_reply'
+
+
+def conversation_row(conversation: Dict) -> Dict:
+    """
+    Conversations table row for a Graph conversation object
+    """
+    return {
+        'conversation_id': conversation['id'],
+        'snippet': (conversation.get('snippet') or '')[:500],
+        'updated_time': to_utc_naive(parse_graph_time(conversation['updated_time'])),
+        'message_count': conversation.get('message_count', 0),
+        'participants': json.dumps(conversation.get('participants', {})),
+        'can_reply': conversation.get('can_reply', True)
+    }
+
+
+def message_row(conversation_id: str, msg: Dict) -> Dict:
+    """
+    Messages table row for a Graph message object
+    """
+    sender = msg.get('from') or {}
+    recipients = (msg.get('to') or {}).get('data') or [{}]
+    return {
+        'conversation_id': conversation_id,
+        'message_id': msg['id'],
+        'sender_id': sender.get('id', ''),
+        'sender_name': sender.get('name', ''),
+        'recipient_id': recipients[0].get('id', ''),
+        'recipient_name': recipients[0].get('name', ''),
+        'message_text': (msg.get('message') or '')[:1000],
+        'created_time': to_utc_naive(parse_graph_time(msg['created_time'])),
+        'has_attachments': bool((msg.get('attachments') or {}).get('data'))
+    }
+
+
+class ConversationSync:
+    def __init__(self, fb_api: Optional[FacebookAPI] = None, max_workers: Optional[int] = None,
+                 messages_page_size: int = 100, conversations_page_size: int = 50):
+        """
+        Initialize the sync engine
+
+        Args:
+            fb_api (FacebookAPI): Client to read from; its DB session is used for writes
+            max_workers (int): Conversations whose messages are fetched in parallel
+                (default: FACEBOOK_CONVERSATION_WORKERS or 16)
+            messages_page_size (int): Messages per page of the messages edge
+            conversations_page_size (int): Conversations per page of the conversations edge
+        """
+        self.fb_api = fb_api or FacebookAPI()
+        self.session = self.fb_api.session
+        self.max_workers = max_workers or int(os.getenv('FACEBOOK_CONVERSATION_WORKERS', '16'))
+        self.messages_page_size = messages_page_size
+        self.conversations_page_size = conversations_page_size
+
+    def stored_updated_times(self, conversation_ids: List[str]) -> Dict:
+        """
+        updated_time of the given conversations as stored in the database
+        """
+        rows = self.session.query(Conversation.conversation_id, Conversation.updated_time)\
+            .filter(Conversation.conversation_id.in_(conversation_ids)).all()
+        return {conversation_id: updated_time for conversation_id, updated_time in rows}
+
+    def _fetch_messages(self, conversation: Dict, since) -> Dict:
+        """
+        Fetch a conversation's messages newer than since; errors are returned, not raised
+        """
+        try:
+            messages = self.fb_api.fetch_messages(conversation['id'], self.messages_page_size,
+                                                  since=since, strict=True)
+            return {'conversation': conversation, 'messages': messages}
+        except GraphAPIError as e:
+            return {'conversation': conversation, 'messages': [], 'error': str(e)}
+
+    def _merge_conversations(self, rows: List[Dict], update_columns: List[str]):
+        """
+        Insert or update conversations one by one on databases without ON CONFLICT
+        """
+        existing = {
+            conversation.conversation_id: conversation
+            for conversation in self.session.query(Conversation).filter(
+                Conversation.conversation_id.in_([row['conversation_id'] for row in rows]))
+        }
+        for row in rows:
+            conversation = existing.get(row['conversation_id'])
+            if conversation is None:
+                self.session.add(Conversation(**row))
+            else:
+                for column in update_columns:
+                    setattr(conversation, column, row[column])
+
+    def _save(self, results: List[Dict]) -> int:
+        """
+        Save one page of synced conversations and their messages in a single transaction
+        """
+        conversation_rows = [conversation_row(result['conversation']) for result in results]
+        message_rows = {}
+        watermarks = {}
+        for result in results:
+            conversation_id = result['conversation']['id']
+            for msg in result['messages']:
+                row = message_row(conversation_id, msg)
+                message_rows[row['message_id']] = row
+                if watermarks.get(conversation_id) is None or row['created_time'] > watermarks[conversation_id]:
+                    watermarks[conversation_id] = row['created_time']
+
+        try:
+            update_columns = ['snippet', 'updated_time', 'message_count', 'participants', 'can_reply']
+            if upsert(self.session, Conversation, conversation_rows, ['conversation_id'], update_columns) is None:
+                self._merge_conversations(conversation_rows, update_columns)
+            insert_ignore(self.session, Message, list(message_rows.values()), ['message_id'])
+            self.fb_api.set_watermarks(SYNC_CONVERSATION_MESSAGES, watermarks, commit=False)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return len(message_rows)
+
+    def _report_progress(self, stats: Dict, expected: int):
+        """
+        Pass sync progress (percent, message, conversation and message counts) to the client's
+        progress callback, if one is set
+        """
+        if self.fb_api.progress_callback:
+            progress = min(99, stats['conversations_seen'] * 100 / max(expected, stats['conversations_seen'], 1))
+            self.fb_api.progress_callback(progress, f"Synced {stats['conversations_synced']} conversations "
+                                                    f"with {stats['messages_saved']} new messages",
+                                          conversations=stats['conversations_seen'],
+                                          messages=stats['messages_saved'])
+
+    def run(self, conversations_limit: Optional[int] = None) -> Dict:
+        """
+        Sync up to conversations_limit conversations (all of them by default).
+
+        Returns counts of conversations seen, synced, skipped as unchanged
+        and failed, messages saved, and the ids of failed conversations.
+        """
+        start = time.time()
+        stats = {'conversations_seen': 0, 'conversations_synced': 0, 'conversations_skipped': 0,
+                 'messages_saved': 0, 'failed': [], 'error': None}
+
+        params = {
+            'fields': CONVERSATION_FIELDS,
+            'limit': min(self.conversations_page_size, conversations_limit or self.conversations_page_size)
+        }
+        pages = self.fb_api.iter_edge_pages(f"{self.fb_api.page_id}/conversations", params, strict=True)
+        # Conversations stored by earlier syncs estimate how many there are to page through
+        known_conversations = self.session.query(Conversation).count()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for conversations in pages:
+                    if conversations_limit is not None:
+                        conversations = conversations[:conversations_limit - stats['conversations_seen']]
+                    stats['conversations_seen'] += len(conversations)
+
+                    # Skip conversations nothing happened in since the last sync
+                    stored = self.stored_updated_times([conv['id'] for conv in conversations])
+                    changed = [
+                        conv for conv in conversations
+                        if stored.get(conv['id']) is None
+                        or to_utc_naive(parse_graph_time(conv['updated_time'])) > to_utc_naive(stored[conv['id']])
+                    ]
+                    stats['conversations_skipped'] += len(conversations) - len(changed)
+
+                    if changed:
+                        watermarks = self.fb_api.get_watermarks(SYNC_CONVERSATION_MESSAGES,
+                                                                [conv['id'] for conv in changed])
+                        results = list(executor.map(
+                            lambda conv: self._fetch_messages(conv, watermarks.get(conv['id'])), changed))
+
+                        for result in results:
+                            if 'error' in result:
+                                logger.error(f"Messages of conversation {result['conversation']['id']} "
+                                             f"could not be fetched: {result['error']}")
+                                stats['failed'].append(result['conversation']['id'])
+                        synced = [result for result in results if 'error' not in result]
+
+                        stats['messages_saved'] += self._save(synced)
+                        stats['conversations_synced'] += len(synced)
+
+                    logger.info(f"Conversation sync: {stats['conversations_seen']} seen, "
+                                f"{stats['conversations_synced']} synced, {stats['messages_saved']} messages")
+                    self._report_progress(stats, conversations_limit or known_conversations)
+                    if conversations_limit is not None and stats['conversations_seen'] >= conversations_limit:
+                        break
+            except GraphAPIError as e:
+                # Conversations after the failed page are picked up by the next sync
+                logger.error(f"Stopped paging conversations: {e}")
+                stats['error'] = str(e)
+
+        if self.fb_api.progress_callback:
+            self.fb_api.progress_callback(100, "Completed!")
+        stats['elapsed'] = time.time() - start
+        logger.info(f"Conversation sync finished in {stats['elapsed']:.1f}s: {stats}")
+        return stats
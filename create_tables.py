@@ -1,8 +1,34 @@
-from sqlalchemy import create_engine
-from models import Base, Post, Comment, Conversation, Message
+from sqlalchemy import create_engine, inspect, text
+from models import Base, Post, Comment, Conversation, Message, SyncState, FacebookPage, UserProfile, SyncJob, SyncJobEvent, WebhookEvent, ProcessedEvent
 import os
 from dotenv import load_dotenv
 
+def add_missing_columns(engine):
+    """
+    Add nullable columns introduced after a table was created (create_all
+    only creates missing tables, it never alters existing ones)
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                print(f"Added column {table.name}.{column.name}")
+
+def add_missing_indexes(engine):
+    """
+    Create indexes declared after a table was created
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
 def init_db():
     # Load environment variables
     load_dotenv()
@@ -15,9 +41,11 @@ def init_db():
     
     # Create all tables
     Base.metadata.create_all(engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
     
     print(f"Database tables created successfully at: {database_url}")
     return engine
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
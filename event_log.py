@@ -0,0 +1,250 @@
+# event_log.py
+"""
+Durable append-only log of raw webhook payloads.
+
+Every body POSTed to /webhook is appended, before it is parsed, to a log
+of segment files in WEBHOOK_LOG_DIR. Each record gets a monotonically
+increasing offset and is stored as a fixed header (offset, receive time,
+length, CRC32) followed by the raw body, so a payload that later fails to
+process can always be read back and replayed (see replay_webhooks.py).
+
+- Bodies larger than WEBHOOK_LOG_MAX_BODY_BYTES are not logged, so one
+  oversized request cannot fill the disk.
+- A segment is named after the offset of its first record and is closed
+  once it grows past WEBHOOK_LOG_SEGMENT_BYTES; segments older than
+  WEBHOOK_LOG_RETENTION_DAYS are deleted when a new one is started.
+- Appends from several processes (e.g. gunicorn workers) are serialised
+  with an advisory file lock where the platform supports it.
+- A record torn by a crash mid-write fails its length or CRC check and is
+  cut off when the log is next opened; reads stop at it.
+
+Inspect the log with: python event_log.py [--dir DIR]
+"""
+
+import argparse
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, NamedTuple, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialised within one process
+    fcntl = None
+
+logger = logging.getLogger('fb_api')
+
+# offset, receive time (Unix seconds), body length, CRC32 of the body
+HEADER = struct.Struct('>QdII')
+SEGMENT_SUFFIX = '.log'
+
+
+class LogRecord(NamedTuple):
+    offset: int
+    timestamp: float
+    body: bytes
+
+
+def _segment_name(base_offset: int) -> str:
+    return f"{base_offset:020d}{SEGMENT_SUFFIX}"
+
+
+def _read_records(path: str) -> Iterator[LogRecord]:
+    """
+    Records of a segment file, stopping at the first torn or corrupt record
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            offset, timestamp, length, crc = HEADER.unpack(header)
+            body = f.read(length)
+            if len(body) < length or zlib.crc32(body) != crc:
+                logger.warning(f"Corrupt or incomplete record {offset} in {path}")
+                return
+            yield LogRecord(offset, timestamp, body)
+
+
+class EventLog:
+    def __init__(self, directory: Optional[str] = None, segment_bytes: Optional[int] = None,
+                 retention_days: Optional[float] = None, fsync: Optional[bool] = None,
+                 max_body_bytes: Optional[int] = None):
+        """
+        Initialize the log, recovering the next offset from the last segment
+
+        Args:
+            directory (str): Directory of the segment files (default: WEBHOOK_LOG_DIR or logs/webhook_events)
+            segment_bytes (int): Size after which a new segment is started
+                (default: WEBHOOK_LOG_SEGMENT_BYTES or 64 MB)
+            retention_days (float): Age after which closed segments are deleted, 0 to keep them
+                (default: WEBHOOK_LOG_RETENTION_DAYS or 30)
+            fsync (bool): Force every record to disk before returning (default: WEBHOOK_LOG_FSYNC or false)
+            max_body_bytes (int): Largest body that is logged (default: WEBHOOK_LOG_MAX_BODY_BYTES or 1 MB)
+        """
+        self.directory = directory or os.getenv('WEBHOOK_LOG_DIR', os.path.join('logs', 'webhook_events'))
+        self.segment_bytes = segment_bytes or int(os.getenv('WEBHOOK_LOG_SEGMENT_BYTES', str(64 * 1024 * 1024)))
+        self.retention_days = float(os.getenv('WEBHOOK_LOG_RETENTION_DAYS', '30')) \
+            if retention_days is None else retention_days
+        self.fsync = os.getenv('WEBHOOK_LOG_FSYNC', 'false').lower() == 'true' if fsync is None else fsync
+        self.max_body_bytes = max_body_bytes or int(os.getenv('WEBHOOK_LOG_MAX_BODY_BYTES', str(1024 * 1024)))
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_path = os.path.join(self.directory, '.lock')
+
+        # Where this process believes the log ends; re-checked under the file lock
+        self._segment: Optional[str] = None
+        self._segment_size = 0
+        self._next_offset = 0
+        with self._locked():
+            self._recover()
+
+    def segments(self) -> List[str]:
+        """
+        Segment file paths, oldest first
+        """
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, open(self._lock_path, 'a') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def next_offset(self) -> int:
+        return self._next_offset
+
+    def _recover(self):
+        """
+        Find the end of the log, cutting off a torn record at the tail
+        """
+        segments = self.segments()
+        if not segments:
+            self._segment, self._segment_size = None, 0
+            self._next_offset = 0
+            return
+        path = segments[-1]
+        self._next_offset = int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+        valid_size = 0
+        for record in _read_records(path):
+            valid_size += HEADER.size + len(record.body)
+            self._next_offset = record.offset + 1
+        if valid_size < os.path.getsize(path):
+            logger.warning(f"Truncating {os.path.getsize(path) - valid_size} bytes of torn records in {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid_size)
+        self._segment, self._segment_size = path, valid_size
+
+    def _catch_up(self):
+        # Another process appended since our last write: continue after its records
+        if self._segment is None or not os.path.exists(self._segment) or \
+                os.path.getsize(self._segment) != self._segment_size or self._segment != self.segments()[-1]:
+            self._recover()
+
+    def _roll(self):
+        self._segment = os.path.join(self.directory, _segment_name(self._next_offset))
+        self._segment_size = 0
+        open(self._segment, 'ab').close()
+        if self.retention_days:
+            cutoff = time.time() - self.retention_days * 86400
+            for path in self.segments()[:-1]:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    logger.info(f"Deleted expired webhook log segment {path}")
+
+    def append(self, body: bytes, timestamp: Optional[float] = None) -> int:
+        """
+        Append a raw payload and return its offset; raises ValueError if it
+        is larger than max_body_bytes
+        """
+        if len(body) > self.max_body_bytes:
+            raise ValueError(f"Webhook body of {len(body)} bytes exceeds the {self.max_body_bytes} byte log limit")
+        with self._locked():
+            self._catch_up()
+            if self._segment is None or self._segment_size >= self.segment_bytes:
+                self._roll()
+            offset = self._next_offset
+            record = HEADER.pack(offset, timestamp or time.time(), len(body), zlib.crc32(body)) + body
+            with open(self._segment, 'ab') as f:
+                f.write(record)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            self._segment_size += len(record)
+            self._next_offset = offset + 1
+            return offset
+
+    def read(self, start_offset: int = 0, end_offset: Optional[int] = None, since: Optional[datetime] = None,
+             until: Optional[datetime] = None) -> Iterator[LogRecord]:
+        """
+        Records with start_offset <= offset < end_offset received between since and until, in order
+        """
+        since_ts = since.timestamp() if since else None
+        until_ts = until.timestamp() if until else None
+        segments = self.segments()
+        bases = [int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)]) for path in segments]
+        for i, path in enumerate(segments):
+            # Skip segments that end before start_offset
+            if i + 1 < len(bases) and bases[i + 1] <= start_offset:
+                continue
+            if end_offset is not None and bases[i] >= end_offset:
+                return
+            for record in _read_records(path):
+                if record.offset < start_offset or (since_ts and record.timestamp < since_ts):
+                    continue
+                if (end_offset is not None and record.offset >= end_offset) or \
+                        (until_ts and record.timestamp >= until_ts):
+                    return
+                yield record
+
+
+_event_log: Optional[EventLog] = None
+_event_log_lock = threading.Lock()
+
+
+def get_event_log() -> EventLog:
+    """
+    Get the process-wide webhook log
+    """
+    global _event_log
+    with _event_log_lock:
+        if _event_log is None:
+            _event_log = EventLog()
+        return _event_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the segments of the webhook event log')
+    parser.add_argument('--dir', default=None, help='Log directory (default: WEBHOOK_LOG_DIR or logs/webhook_events)')
+    args = parser.parse_args()
+
+    log = EventLog(args.dir)
+    total = 0
+    for path in log.segments():
+        records = list(_read_records(path))
+        total += len(records)
+        if records:
+            first, last = records[0], records[-1]
+            print(f"{os.path.basename(path)}  offsets {first.offset}-{last.offset}  "
+                  f"{datetime.fromtimestamp(first.timestamp):%Y-%m-%d %H:%M:%S} - "
+                  f"{datetime.fromtimestamp(last.timestamp):%Y-%m-%d %H:%M:%S}  "
+                  f"{os.path.getsize(path)} bytes")
+        else:
+            print(f"{os.path.basename(path)}  empty")
+    print(f"{total} records, next offset {log.next_offset}")
+
+
+if __name__ == "__main__":
+    main()
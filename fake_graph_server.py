@@ -0,0 +1,588 @@
+# fake_graph_server.py
+"""
+Local stand-in for the Facebook Graph API, for load and regression tests.
+
+Serves synthetic pages, posts, comments, reply threads, conversations,
+messages and user profiles in the shapes FacebookAPI reads, including
+paging cursors, 'since' filters, comments field expansion, ?ids= lookups
+and batch calls. Comment replies, edits (POST /{id}), deletes and
+Messenger sends are applied to an in-memory overlay, so write paths and
+re-syncs can be exercised too.
+
+Content is generated from object ids, so every run with the same sizes
+serves the same data, and any page id works without configuration. Faults
+can be injected: latency, transient errors, throttling errors and usage
+headers, either at fixed rates or from a per-minute call quota.
+
+Point the clients at it with FACEBOOK_GRAPH_URL:
+
+    python fake_graph_server.py --port 8765 --posts 500 --comments 50 --latency-ms 40
+    FACEBOOK_GRAPH_URL=http://127.0.0.1:8765/v19.0 python fetch_posts_with_comments.py
+
+or start it in-process with FakeGraphServer(...).start().
+"""
+
+import argparse
+import base64
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+GRAPH_VERSION = 'v19.0'
+
+# Newest generated post; everything else is older, so runs are repeatable
+BASE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+POST_SPACING = timedelta(hours=1)
+COMMENT_SPACING = timedelta(minutes=1)
+REPLY_SPACING = timedelta(seconds=30)
+CONVERSATION_SPACING = timedelta(minutes=10)
+MESSAGE_SPACING = timedelta(minutes=1)
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+WORDS = ('great', 'love', 'terrible', 'price', 'delivery', 'shop', 'quality', 'thanks', 'order', 'size',
+         'colour', 'fast', 'slow', 'broken', 'happy', 'when', 'available', 'again', 'store', 'help')
+
+_POST_ID = re.compile(r'^(?P<page>[^_]+)_(?P<post>\d+)$')
+_COMMENT_ID = re.compile(r'^(?P<post>[^_]+_\d+)_c(?P<comment>\d+)$')
+_REPLY_ID = re.compile(r'^(?P<comment>[^_]+_\d+_c\d+)_r(?P<reply>\d+)$')
+_CONVERSATION_ID = re.compile(r'^t_(?P<page>[^_]+)_(?P<conversation>\d+)$')
+_MESSAGE_ID = re.compile(r'^m_(?P<conversation>t_[^_]+_\d+)_(?P<message>\d+)$')
+_USER_ID = re.compile(r'^psid_(?P<page>[^_]+)_(?P<user>\d+)$')
+_EXPANSION = re.compile(r'comments\.limit\((\d+)\)')
+
+
+def graph_time(value: datetime) -> str:
+    return value.strftime('%Y-%m-%dT%H:%M:%S+0000')
+
+
+def _parse_since(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    if value.isdigit():
+        return datetime.fromtimestamp(int(value), tz=timezone.utc)
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z')
+
+
+def _text(object_id: str, words: int = 8) -> str:
+    rng = random.Random(zlib.crc32(object_id.encode('utf-8')))
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def graph_error(message: str, code: int = 100, error_type: str = 'GraphMethodException',
+                **extra) -> Dict:
+    return {'error': dict({'message': message, 'type': error_type, 'code': code,
+                           'fbtrace_id': 'FakeGraph'}, **extra)}
+
+
+class FakeGraphData:
+    def __init__(self, posts: int = 200, comments: int = 20, replies: int = 2, reply_every: int = 5,
+                 conversations: int = 100, messages: int = 20):
+        """
+        Initialize the synthetic data set (sizes are per page / per object)
+
+        Args:
+            posts (int): Posts per page
+            comments (int): Top-level comments per post
+            replies (int): Replies of each threaded comment
+            reply_every (int): Every reply_every-th comment has a reply thread
+            conversations (int): Conversations per page
+            messages (int): Messages per conversation
+        """
+        self.posts = posts
+        self.comments = comments
+        self.replies = replies
+        self.reply_every = max(reply_every, 1)
+        self.conversations = conversations
+        self.messages = messages
+        # Writes received through the API, layered over the generated data
+        self.edited: Dict[str, str] = {}
+        self.deleted = set()
+        self.added: Dict[str, List[Dict]] = {}
+        self.sent_messages: List[Dict] = []
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    # Generated objects
+
+    def post(self, page_id: str, index: int) -> Dict:
+        post_id = f"{page_id}_{index}"
+        return {'id': post_id, 'message': _text(post_id, 12),
+                'created_time': graph_time(BASE_TIME - index * POST_SPACING)}
+
+    def comment(self, post_id: str, index: int) -> Dict:
+        post_index = int(_POST_ID.match(post_id).group('post'))
+        comment_id = f"{post_id}_c{index}"
+        user = index % 50
+        return {'id': comment_id, 'message': _text(comment_id),
+                'created_time': graph_time(BASE_TIME - post_index * POST_SPACING + (index + 1) * COMMENT_SPACING),
+                'from': {'name': f"Fan {user}", 'id': f"fan_{user}"},
+                'comment_count': self.replies if index % self.reply_every == 0 else 0}
+
+    def reply(self, comment_id: str, index: int) -> Dict:
+        comment = self._generated(comment_id)
+        reply_id = f"{comment_id}_r{index}"
+        created = datetime.strptime(comment['created_time'], '%Y-%m-%dT%H:%M:%S%z') + (index + 1) * REPLY_SPACING
+        return {'id': reply_id, 'message': _text(reply_id, 6), 'created_time': graph_time(created),
+                'from': {'name': f"Fan {index}", 'id': f"fan_{index}"}, 'comment_count': 0}
+
+    def conversation(self, page_id: str, index: int) -> Dict:
+        conversation_id = f"t_{page_id}_{index}"
+        user = {'name': f"Customer {index}", 'id': f"psid_{page_id}_{index}"}
+        sent = [msg for msg in self.sent_messages if msg['conversation_id'] == conversation_id]
+        updated = sent[-1]['created_time'] if sent else graph_time(BASE_TIME - index * CONVERSATION_SPACING)
+        return {'id': conversation_id, 'snippet': _text(f"m_{conversation_id}_0", 5), 'updated_time': updated,
+                'message_count': self.messages + len(sent), 'can_reply': True,
+                'participants': {'data': [user, {'name': 'Page', 'id': page_id}]}}
+
+    def message(self, conversation_id: str, index: int) -> Dict:
+        match = _CONVERSATION_ID.match(conversation_id)
+        page_id, conversation_index = match.group('page'), int(match.group('conversation'))
+        user = {'name': f"Customer {conversation_index}", 'id': f"psid_{page_id}_{conversation_index}"}
+        page = {'name': 'Page', 'id': page_id}
+        # index 0 is the newest message, as on the messages edge
+        sender, recipient = (user, page) if index % 2 == 0 else (page, user)
+        message_id = f"m_{conversation_id}_{index}"
+        return {'id': message_id, 'message': _text(message_id),
+                'created_time': graph_time(BASE_TIME - conversation_index * CONVERSATION_SPACING
+                                           - index * MESSAGE_SPACING),
+                'from': sender, 'to': {'data': [recipient]}}
+
+    def profile(self, user_id: str) -> Optional[Dict]:
+        match = _USER_ID.match(user_id)
+        if not match:
+            return None
+        index = match.group('user')
+        return {'id': user_id, 'name': f"Customer {index}", 'first_name': 'Customer', 'last_name': index,
+                'profile_pic': f"https://example.invalid/{user_id}.jpg"}
+
+    def _generated(self, object_id: str) -> Optional[Dict]:
+        for pattern, build in ((_REPLY_ID, lambda m: self.reply(m.group('comment'), int(m.group('reply')))),
+                               (_COMMENT_ID, lambda m: self.comment(m.group('post'), int(m.group('comment')))),
+                               (_POST_ID, lambda m: self.post(m.group('page'), int(m.group('post'))))):
+            match = pattern.match(object_id)
+            if match:
+                return build(match)
+        return None
+
+    # Overlay of API writes
+
+    def _apply(self, obj: Dict) -> Optional[Dict]:
+        if obj['id'] in self.deleted:
+            return None
+        if obj['id'] in self.edited:
+            obj = dict(obj, message=self.edited[obj['id']])
+        if 'comment_count' in obj:
+            obj['comment_count'] += len(self.added.get(obj['id'], []))
+        return obj
+
+    def get_object(self, object_id: str) -> Optional[Dict]:
+        with self._lock:
+            for children in self.added.values():
+                for child in children:
+                    if child['id'] == object_id:
+                        return self._apply(dict(child))
+        obj = self._generated(object_id) or self.profile(object_id)
+        if obj is None and not _POST_ID.match(object_id) and '_' not in object_id:
+            obj = {'id': object_id, 'name': f"Page {object_id}", 'fan_count': 1000}
+        with self._lock:
+            return self._apply(obj) if obj else None
+
+    def add_comment(self, parent_id: str, message: str) -> Dict:
+        with self._lock:
+            self._next_id += 1
+            comment = {'id': f"{parent_id}_n{self._next_id}", 'message': message,
+                       'created_time': graph_time(datetime.now(timezone.utc)),
+                       'from': {'name': 'Page', 'id': 'page'}, 'comment_count': 0}
+            self.added.setdefault(parent_id, []).append(comment)
+            return comment
+
+    def edit(self, object_id: str, message: str):
+        with self._lock:
+            self.edited[object_id] = message
+
+    def delete(self, object_id: str):
+        with self._lock:
+            self.deleted.add(object_id)
+
+    def send_message(self, recipient_id: str, text: str) -> Dict:
+        match = _USER_ID.match(recipient_id)
+        with self._lock:
+            self._next_id += 1
+            message = {'id': f"m_sent_{self._next_id}", 'message': text, 'recipient_id': recipient_id,
+                       'conversation_id': f"t_{match.group('page')}_{match.group('user')}" if match else None,
+                       'created_time': graph_time(datetime.now(timezone.utc))}
+            self.sent_messages.append(message)
+            return message
+
+    # Edges
+
+    def edge(self, object_id: str, edge: str) -> Optional[Tuple[List[Dict], bool]]:
+        """
+        Every record of an edge and whether it is newest-first, or None for unknown edges
+        """
+        if edge in ('posts', 'feed', 'published_posts'):
+            records = [self.post(object_id, i) for i in range(self.posts)]
+            newest_first = True
+        elif edge == 'comments':
+            if _COMMENT_ID.match(object_id):
+                comment = self._generated(object_id)
+                records = [self.reply(object_id, i) for i in range(comment['comment_count'])]
+            elif _POST_ID.match(object_id):
+                records = [self.comment(object_id, i) for i in range(self.comments)]
+            else:
+                records = []
+            newest_first = False
+        elif edge == 'conversations':
+            records = sorted((self.conversation(object_id, i) for i in range(self.conversations)),
+                             key=lambda conversation: conversation['updated_time'], reverse=True)
+            newest_first = True
+        elif edge == 'messages' and _CONVERSATION_ID.match(object_id):
+            page = {'name': 'Page', 'id': _CONVERSATION_ID.match(object_id).group('page')}
+            sent = [{'id': msg['id'], 'message': msg['message'], 'created_time': msg['created_time'],
+                     'from': page, 'to': {'data': [{'id': msg['recipient_id']}]}}
+                    for msg in reversed(self.sent_messages) if msg['conversation_id'] == object_id]
+            records = sent + [self.message(object_id, i) for i in range(self.messages)]
+            newest_first = True
+        else:
+            return None
+
+        with self._lock:
+            added = [dict(child) for child in self.added.get(object_id, [])]
+            records = records + added if not newest_first else added[::-1] + records
+            return [record for record in map(self._apply, records) if record], newest_first
+
+
+class FaultInjector:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, usage: float = 0.0, quota_per_minute: Optional[int] = None,
+                 seed: int = 1):
+        """
+        Initialize the fault model
+
+        Args:
+            latency_ms (float): Delay added to every HTTP request
+            jitter_ms (float): Random extra delay of up to jitter_ms
+            error_rate (float): Share of requests (and batch operations) failing with a transient error
+            throttle_rate (float): Share of requests failing with a rate limit error
+            usage (float): Usage percentage reported in the X-App-Usage and X-Page-Usage headers
+            quota_per_minute (int): Calls allowed per minute; when set, usage is derived from
+                the calls of the last minute and calls over the quota are throttled
+            seed (int): Seed of the random fault decisions
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.usage = usage
+        self.quota_per_minute = quota_per_minute
+        self._random = random.Random(seed)
+        self._calls = deque()
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter_ms)
+        if self.latency_ms or jitter:
+            time.sleep((self.latency_ms + jitter) / 1000)
+
+    def record_call(self) -> float:
+        """
+        Count a call and return the usage percentage to report
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append(now)
+            while self._calls and self._calls[0] < now - 60:
+                self._calls.popleft()
+            if self.quota_per_minute:
+                return len(self._calls) * 100.0 / self.quota_per_minute
+            return self.usage
+
+    def fault(self, usage: float) -> Optional[Tuple[int, Dict]]:
+        """
+        (status, error body) to answer instead of the real response, or None
+        """
+        with self._lock:
+            roll = self._random.random()
+        if usage > 100 or roll < self.throttle_rate:
+            return 403, graph_error('(#32) Page request limit reached', code=32, error_type='OAuthException')
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, graph_error('An unexpected error has occurred. Please retry your request later.',
+                                    code=2, error_type='OAuthException', is_transient=True)
+        return None
+
+    @staticmethod
+    def usage_headers(usage: float) -> Dict[str, str]:
+        usage = int(min(usage, 100))
+        value = json.dumps({'call_count': usage, 'total_cputime': usage // 2, 'total_time': usage // 2})
+        return {'X-App-Usage': value, 'X-Page-Usage': value}
+
+
+class FakeGraphServer:
+    def __init__(self, data: Optional[FakeGraphData] = None, faults: Optional[FaultInjector] = None,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        Initialize the server
+
+        Args:
+            data (FakeGraphData): Data set to serve (default: FakeGraphData())
+            faults (FaultInjector): Fault model (default: no faults)
+            host (str): Interface to listen on
+            port (int): Port to listen on (0 picks a free one)
+        """
+        self.data = data or FakeGraphData()
+        self.faults = faults or FaultInjector()
+        self.requests = 0
+        self.status_counts: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{GRAPH_VERSION}"
+
+    def start(self) -> str:
+        """
+        Serve on a background thread and return the base URL
+        """
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='fake-graph', daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'requests': self.requests, 'status_counts': dict(self.status_counts)}
+
+    def _count(self, status: int):
+        with self._lock:
+            self.requests += 1
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    # Request handling
+
+    def _page(self, path: str, params: Dict, records: List[Dict], newest_first: bool) -> Dict:
+        """
+        One page of an edge, with cursors and a next URL like Graph's
+        """
+        since = _parse_since(params.get('since'))
+        if since is not None:
+            records = [r for r in records
+                       if datetime.strptime(r['created_time'], '%Y-%m-%dT%H:%M:%S%z') > since]
+        limit = min(int(params.get('limit') or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)
+        offset = int(base64.b64decode(params['after']).decode()) if params.get('after') else 0
+        data = records[offset:offset + limit]
+
+        page = {'data': data}
+        if data:
+            page['paging'] = {'cursors': {'before': base64.b64encode(str(offset).encode()).decode(),
+                                          'after': base64.b64encode(str(offset + len(data)).encode()).decode()}}
+            if offset + len(data) < len(records):
+                next_params = dict(params, after=page['paging']['cursors']['after'])
+                page['paging']['next'] = f"{self.base_url}/{path}?{urlencode(next_params)}"
+        return page
+
+    def _expand(self, post: Dict, fields: str) -> Dict:
+        match = _EXPANSION.search(fields or '')
+        if not match:
+            return post
+        comments = (self.data.edge(post['id'], 'comments') or ([], False))[0]
+        if comments:
+            post['comments'] = self._page(f"{post['id']}/comments", {'limit': match.group(1)}, comments, False)
+        return post
+
+    def handle_get(self, path: str, params: Dict) -> Tuple[int, Dict]:
+        parts = [part for part in path.split('/') if part]
+        if not parts:
+            if 'ids' not in params:
+                return 400, graph_error('Unsupported get request.')
+            found = {}
+            for object_id in params['ids'].split(','):
+                obj = self.data.get_object(object_id)
+                if obj is None:
+                    return 404, graph_error(f"Unsupported get request. Object with ID '{object_id}' does not exist")
+                found[object_id] = self._expand(obj, params.get('fields'))
+            return 200, found
+        if parts == ['debug_token']:
+            return 200, {'data': {'is_valid': True, 'scopes': ['pages_read_engagement', 'pages_show_list',
+                                                               'pages_messaging', 'pages_manage_engagement']}}
+        if len(parts) == 1:
+            obj = self.data.get_object(parts[0])
+            if obj is None:
+                return 404, graph_error(f"Unsupported get request. Object with ID '{parts[0]}' does not exist")
+            return 200, self._expand(obj, params.get('fields'))
+        if len(parts) == 2:
+            result = self.data.edge(parts[0], parts[1])
+            if result is None:
+                return 400, graph_error(f"Tried accessing nonexisting field ({parts[1]})")
+            records, newest_first = result
+            page = self._page(path.strip('/'), params, records, newest_first)
+            if parts[1] in ('posts', 'feed', 'published_posts'):
+                page['data'] = [self._expand(post, params.get('fields')) for post in page['data']]
+            return 200, page
+        return 400, graph_error('Unknown path components')
+
+    def handle_post(self, path: str, params: Dict, body: Dict) -> Tuple[int, object]:
+        parts = [part for part in path.split('/') if part]
+        if not parts and 'batch' in body:
+            return 200, self.handle_batch(json.loads(body['batch']))
+        if parts == ['me', 'messages']:
+            recipient = (body.get('recipient') or {}).get('id')
+            if not recipient:
+                return 400, graph_error('(#100) The parameter recipient is required')
+            message = self.data.send_message(recipient, (body.get('message') or {}).get('text', ''))
+            return 200, {'recipient_id': recipient, 'message_id': message['id']}
+        message = params.get('message', body.get('message'))
+        if len(parts) == 2 and parts[1] == 'comments':
+            if self.data.get_object(parts[0]) is None:
+                return 404, graph_error(f"Object with ID '{parts[0]}' does not exist")
+            return 200, {'id': self.data.add_comment(parts[0], message or '')['id']}
+        if len(parts) == 1 and message is not None:
+            if self.data.get_object(parts[0]) is None:
+                return 404, graph_error(f"Object with ID '{parts[0]}' does not exist")
+            self.data.edit(parts[0], message)
+            return 200, {'success': True}
+        return 400, graph_error('Unsupported post request.')
+
+    def handle_delete(self, path: str) -> Tuple[int, Dict]:
+        parts = [part for part in path.split('/') if part]
+        if len(parts) != 1 or self.data.get_object(parts[0]) is None:
+            return 404, graph_error('Unsupported delete request.')
+        self.data.delete(parts[0])
+        return 200, {'success': True}
+
+    def handle_batch(self, operations: List[Dict]) -> List[Optional[Dict]]:
+        results = []
+        for operation in operations:
+            url = urlsplit(operation.get('relative_url', ''))
+            params = dict(parse_qsl(url.query))
+            fault = self.faults.fault(0) if self.faults.error_rate else None
+            if fault and fault[0] == 500:
+                status, body = fault
+            elif operation.get('method', 'GET') == 'GET':
+                status, body = self.handle_get(url.path, params)
+            else:
+                status, body = 400, graph_error('Only GET operations are supported in fake batches')
+            results.append({'code': status, 'headers': [], 'body': json.dumps(body)})
+        return results
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self, method: str):
+                url = urlsplit(self.path)
+                path = url.path
+                if path.startswith(f"/{GRAPH_VERSION}"):
+                    path = path[len(GRAPH_VERSION) + 1:]
+                params = dict(parse_qsl(url.query))
+
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length).decode('utf-8') if length else ''
+                if 'json' in (self.headers.get('Content-Type') or ''):
+                    body = json.loads(raw or '{}')
+                else:
+                    body = dict(parse_qsl(raw))
+
+                server.faults.delay()
+                usage = server.faults.record_call()
+                status, payload = server.faults.fault(usage) or (None, None)
+                if status is None:
+                    try:
+                        if method == 'GET':
+                            status, payload = server.handle_get(path, params)
+                        elif method == 'POST':
+                            status, payload = server.handle_post(path, params, body)
+                        else:
+                            status, payload = server.handle_delete(path)
+                    except (ValueError, KeyError, AttributeError) as e:
+                        status, payload = 400, graph_error(f"Invalid request: {e}")
+
+                encoded = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(encoded)))
+                for header, value in FaultInjector.usage_headers(usage).items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(encoded)
+                server._count(status)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a fake Facebook Graph API for offline load tests')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--posts', type=int, default=200, help='Posts per page')
+    parser.add_argument('--comments', type=int, default=20, help='Comments per post')
+    parser.add_argument('--replies', type=int, default=2, help='Replies per threaded comment')
+    parser.add_argument('--reply-every', type=int, default=5, help='Every Nth comment has replies')
+    parser.add_argument('--conversations', type=int, default=100, help='Conversations per page')
+    parser.add_argument('--messages', type=int, default=20, help='Messages per conversation')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay added to every request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Random extra delay per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of transient 500 errors')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of rate limit errors')
+    parser.add_argument('--usage', type=float, default=0.0, help='Usage %% reported in usage headers')
+    parser.add_argument('--quota-per-minute', type=int, default=None,
+                        help='Derive usage from the calls of the last minute and throttle above the quota')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the fault decisions')
+    args = parser.parse_args()
+
+    data = FakeGraphData(args.posts, args.comments, args.replies, args.reply_every,
+                         args.conversations, args.messages)
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                           args.usage, args.quota_per_minute, args.seed)
+    server = FakeGraphServer(data, faults, args.host, args.port)
+    print(f"Fake Graph API listening on {server.base_url}")
+    print(f"Use it with FACEBOOK_GRAPH_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"Served {server.stats()}")
+
+
+if __name__ == '__main__':
+    main()
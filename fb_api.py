@@ -1,14 +1,23 @@
-
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 import time
 import requests
 import json
-from datetime import datetime
-from typing import List, Dict, Optional
-from models import Post, Comment, Session
+import calendar
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, List, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlsplit, parse_qsl
+from models import Post, Comment, CommentReply, Session, SyncState
+from sqlalchemy import func, select, update
 from text_analysis import enhanced_sentiment_analysis, analyze_comment_sentiments, extract_keywords, extract_trending_topics
+from rate_limiter import get_rate_limiter, is_throttle_error
+from http_client import get_http_session
+from retry_policy import GraphAPIError, get_retry_policy
+from bulk_ingest import DEFAULT_BATCH_SIZE, existing_keys, insert_ignore, upsert_max
 from dotenv import load_dotenv
 
 
@@ -30,19 +39,153 @@ logger.addHandler(console_handler)
 # Load environment variables
 load_dotenv()
 
+# The Graph API accepts at most 50 operations per batch request
+GRAPH_BATCH_LIMIT = 50
+
+# Posts per page when their first page of comments is embedded in the same
+# response; Graph rejects pages whose nested data gets too large
+EXPANDED_POSTS_PAGE_SIZE = 25
+
+GRAPH_URL = "https://graph.facebook.com/v19.0"
+
+# Resource types tracked in the sync_state table
+SYNC_PAGE_POSTS = 'page_posts'
+SYNC_POST_COMMENTS = 'post_comments'
+SYNC_CONVERSATION_MESSAGES = 'conversation_messages'
+
+
+def parse_graph_time(value) -> datetime:
+    """
+    Parse a Graph API timestamp (e.g. 2024-01-31T12:00:00+0000); datetimes pass through
+    """
+    if isinstance(value, datetime):
+        return value
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z')
+
+
+def to_utc_naive(value: datetime) -> datetime:
+    """
+    Normalise a datetime to naive UTC, the form watermarks are stored in
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def content_hash(message: Optional[str]) -> str:
+    """
+    Hash of a post's or comment's editable content, stored to detect edits cheaply
+    """
+    return hashlib.sha256((message or '').encode('utf-8')).hexdigest()
+
 class FacebookAPI:
 
-    def __init__(self):
-        self.base_url = "https://graph.facebook.com/v19.0"
-        self.access_token = os.getenv('FACEBOOK_PAGE_ACCESS_TOKEN')
-        self.page_id = os.getenv('FACEBOOK_PAGE_ID')
+    def __init__(self, page_id: Optional[str] = None, access_token: Optional[str] = None):
+        """
+        Initialize the client for one Facebook page
+
+        Args:
+            page_id (str): Page to read and write (default: FACEBOOK_PAGE_ID)
+            access_token (str): The page's access token (default: FACEBOOK_PAGE_ACCESS_TOKEN);
+                see page_registry.api_for_page for pages in the registry
+        """
+        # Point FACEBOOK_GRAPH_URL at fake_graph_server.py to run against a local stand-in
+        self.base_url = os.getenv('FACEBOOK_GRAPH_URL', GRAPH_URL).rstrip('/')
+        self.access_token = access_token or os.getenv('FACEBOOK_PAGE_ACCESS_TOKEN')
+        self.page_id = page_id or os.getenv('FACEBOOK_PAGE_ID')
         self.session = Session()
         self.progress_callback = None
-        self.page_access_token = os.environ.get('FACEBOOK_PAGE_ACCESS_TOKEN')
+        self.page_access_token = self.access_token
+        # Number of posts whose comments are fetched in parallel (1 = sequential)
+        self.max_workers = int(os.getenv('FACEBOOK_FETCH_WORKERS', '8'))
+        # Pack per-object reads into Graph batch calls instead of one request each
+        self.use_batch = os.getenv('FACEBOOK_USE_BATCH', 'false').lower() == 'true'
+        # Read each post's first page of comments through field expansion on /posts
+        self.expand_comments = os.getenv('FACEBOOK_EXPAND_COMMENTS', 'true').lower() == 'true'
+        # Ingest the reply threads of comments during post syncs
+        self.sync_replies = os.getenv('FACEBOOK_SYNC_REPLIES', 'true').lower() == 'true'
+        # Posts written per bulk insert transaction during syncs
+        self.save_batch_size = int(os.getenv('FACEBOOK_SAVE_BATCH_SIZE', '25'))
+        # Run syncs through the concurrent fetch/parse/analyze/write pipeline
+        self.pipelined = os.getenv('FACEBOOK_PIPELINED', 'false').lower() == 'true'
+        # Governor that paces requests from the Graph usage headers; Graph
+        # meters page tokens per page, so every page has its own bucket
+        # ('default' stays the bucket of the FACEBOOK_PAGE_ID page)
+        self.rate_limiter = get_rate_limiter(
+            'default' if self.page_id == os.getenv('FACEBOOK_PAGE_ID') else f"page:{self.page_id}")
+        # Shared keep-alive connection pool with default connect/read timeouts
+        self.http = get_http_session()
+        self.retry_policy = get_retry_policy()
+        # Graph requests that still failed after retries, newest last
+        self.failed_requests = deque(maxlen=1000)
 
     def set_progress_callback(self, callback):
         """Set a callback function for progress updates"""
         self.progress_callback = callback
+
+    def _graph_request(self, method: str, url: str, idempotent: Optional[bool] = None,
+                       **kwargs) -> requests.Response:
+        """
+        Send a Graph API request over the shared session, paced by the shared rate limiter.
+        
+        Transient failures are retried according to self.retry_policy;
+        idempotent overrides the method's default retry safety (e.g. for
+        batch POSTs that only contain GETs). Returns the last response, or
+        re-raises the last requests exception once retries are exhausted.
+        """
+        self.retry_policy.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            self.rate_limiter.wait()
+            try:
+                response = self.http.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if not self.retry_policy.should_retry(attempt, method, exception=e, idempotent=idempotent):
+                    e.attempts = attempt
+                    raise
+                delay = self.retry_policy.backoff(attempt)
+                logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s (attempt {attempt})")
+                time.sleep(delay)
+                continue
+            
+            error = None
+            if response.status_code >= 400:
+                try:
+                    error = response.json().get('error')
+                except (ValueError, AttributeError):
+                    pass
+            retry_after = response.headers.get('Retry-After')
+            self.rate_limiter.observe(response.headers, error, retry_after)
+            response.attempts = attempt
+            
+            if response.status_code >= 400 and self.retry_policy.should_retry(
+                    attempt, method, status_code=response.status_code, error=error, idempotent=idempotent):
+                delay = self.retry_policy.backoff(attempt, retry_after)
+                logger.warning(f"{method} {url} returned {response.status_code}, "
+                               f"retrying in {delay:.1f}s (attempt {attempt})")
+                time.sleep(delay)
+                continue
+            return response
+    
+    def _request_failed(self, endpoint: str, message: str, response: Optional[requests.Response] = None,
+                        attempts: int = 1) -> GraphAPIError:
+        """
+        Record a Graph request that failed for good and build the matching error
+        """
+        error = None
+        status_code = None
+        if response is not None:
+            status_code = response.status_code
+            attempts = getattr(response, 'attempts', attempts)
+            try:
+                error = response.json().get('error')
+            except (ValueError, AttributeError):
+                pass
+        failure = GraphAPIError(message, endpoint=endpoint, status_code=status_code, error=error, attempts=attempts)
+        self.failed_requests.append(failure)
+        logger.error(f"Graph request {endpoint} failed after {attempts} attempt(s): {message}")
+        return failure
     
     def debug_api_response(self, endpoint, params):
         """
@@ -52,7 +195,7 @@ class FacebookAPI:
             print(f"Making request to: {endpoint}")
             print(f"With params: {params}")
             
-            response = requests.get(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('GET', f"{self.base_url}/{endpoint}", params=params)
             print(f"Status code: {response.status_code}")
             
             if response.status_code != 200:
@@ -107,28 +250,18 @@ class FacebookAPI:
         """
         Fetch posts from a Facebook page with pagination handling
         """
-        all_posts = []
+        return list(self.iter_posts(limit))
+
+    def iter_posts(self, limit: Optional[int] = 100) -> Iterator[Dict]:
+        """
+        Yield posts from the Facebook page as each page of results arrives
+        """
         endpoint = f"{self.page_id}/posts"
         params = {
             'fields': 'id,message,created_time,updated_time',
-            'limit': min(limit, 100)  # Facebook's max limit per request is 100
+            'limit': min(limit or 100, 100)  # Facebook's max limit per request is 100
         }
-        
-        while endpoint and len(all_posts) < limit:
-            response_data = self.make_api_request(endpoint, params)
-            
-            if not response_data or 'data' not in response_data:
-                break
-                
-            all_posts.extend(response_data['data'])
-            
-            # Check for next page
-            endpoint = response_data.get('paging', {}).get('next', '').replace(self.base_url + '/', '')
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(1)
-        
-        return all_posts[:limit]
+        return self.iter_edge(endpoint, params, max_items=limit)
     
     def parse_post_data(self, post_data: Dict) -> Optional[Dict]:
         """
@@ -192,13 +325,9 @@ class FacebookAPI:
         """
         print(f"Fetching up to {limit} posts from page {self.page_id}")
         
-        # Fetch posts from API
-        raw_posts = self.fetch_posts(limit)
-        print(f"Retrieved {len(raw_posts)} posts from API")
-        
-        # Process and save posts
+        # Process and save posts as they are fetched from the API
         saved_count = 0
-        for raw_post in raw_posts:
+        for raw_post in self.iter_posts(limit):
             parsed_post = self.parse_post_data(raw_post)
             if parsed_post:
                 saved_post = self.save_post(parsed_post)
@@ -220,7 +349,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.get(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('GET', f"{self.base_url}/{endpoint}", params=params)
             response.raise_for_status()
             return response.json().get('data', [])
         except requests.exceptions.RequestException as e:
@@ -236,6 +365,72 @@ class FacebookAPI:
         except Exception as e:
             print(f"Error checking if comment exists: {e}")
             return False
+
+    def get_watermark(self, resource_type: str, resource_id: str) -> Optional[datetime]:
+        """
+        Get the newest created/updated time already ingested for a resource
+        """
+        state = self.session.query(SyncState).filter_by(
+            resource_type=resource_type, resource_id=resource_id).first()
+        return state.last_seen_time if state else None
+
+    def get_watermarks(self, resource_type: str, resource_ids: List[str]) -> Dict[str, datetime]:
+        """
+        Get the watermarks of many resources of one type with a single query
+        """
+        if not resource_ids:
+            return {}
+        states = self.session.query(SyncState).filter(
+            SyncState.resource_type == resource_type,
+            SyncState.resource_id.in_(resource_ids)
+        ).all()
+        return {state.resource_id: state.last_seen_time for state in states if state.last_seen_time}
+
+    def set_watermark(self, resource_type: str, resource_id: str, seen_time: Optional[datetime],
+                      commit: bool = True):
+        """
+        Advance a resource's watermark; it never moves backwards
+        """
+        if seen_time is None:
+            return
+        seen_time = to_utc_naive(seen_time)
+        
+        state = self.session.query(SyncState).filter_by(
+            resource_type=resource_type, resource_id=resource_id).first()
+        if not state:
+            state = SyncState(resource_type=resource_type, resource_id=resource_id)
+            self.session.add(state)
+        if state.last_seen_time is None or seen_time > state.last_seen_time:
+            state.last_seen_time = seen_time
+        
+        if commit:
+            self.session.commit()
+
+    def set_watermarks(self, resource_type: str, seen_times: Dict[str, datetime], commit: bool = True):
+        """
+        Advance the watermarks of many resources of one type with set-based upserts
+        """
+        rows = [
+            {'resource_type': resource_type, 'resource_id': resource_id,
+             'last_seen_time': to_utc_naive(seen_time), 'updated_at': datetime.now()}
+            for resource_id, seen_time in seen_times.items() if seen_time is not None
+        ]
+        if rows and upsert_max(self.session, SyncState, rows, ['resource_type', 'resource_id'],
+                               'last_seen_time') is None:
+            for row in rows:
+                self.set_watermark(resource_type, row['resource_id'], row['last_seen_time'], commit=False)
+        
+        if commit:
+            self.session.commit()
+
+    @staticmethod
+    def _since_param(watermark: Optional[datetime]) -> Optional[int]:
+        """
+        Convert a stored (naive UTC) watermark to the unix time used by the Graph 'since' parameter
+        """
+        if watermark is None:
+            return None
+        return calendar.timegm(watermark.timetuple())
     
     def fetch_and_save_posts_with_comments(self, posts_limit=50, comments_per_post=100):
         """
@@ -341,19 +536,33 @@ class FacebookAPI:
                             'id': comment_data['id'],
                             'message': comment_data.get('message', ''),
                             'created_time': comment_created_time,
-                            'from': comment_data.get('from', {}).get('name', 'Unknown')
+                            'from': comment_data.get('from', {}).get('name', 'Unknown'),
+                            'comment_count': comment_data.get('comment_count', 0)
                         }
+                        if 'replies' in comment_data:
+                            comment['replies'] = [
+                                {
+                                    'id': reply['id'],
+                                    'message': reply.get('message', ''),
+                                    'created_time': parse_graph_time(reply['created_time']),
+                                    'from': reply.get('from', {}).get('name', 'Unknown')
+                                }
+                                for reply in comment_data['replies'].get('data', [])
+                            ]
                         comments.append(comment)
                     except (KeyError, ValueError) as e:
                         print(f"Error parsing comment data: {e}")
                         continue
             
-            return {
+            parsed_post = {
                 'post_id': post_data['id'],
                 'message': message,
                 'created_time': created_time,
                 'comments': comments
             }
+            if post_data.get('comments_error'):
+                parsed_post['comments_error'] = post_data['comments_error']
+            return parsed_post
             
         except (KeyError, ValueError) as e:
             print(f"Error parsing post data: {e}")
@@ -421,99 +630,380 @@ class FacebookAPI:
     # In your fb_api.py, update the save_post_with_comments function
     def save_post_with_comments(self, post_data: Dict) -> int:
         """
-        Save a post and its comments to the database with enhanced analytics
+        Save a post and its comments to the database with enhanced analytics.
+        
+        If the post already exists, only comments that are not stored yet
+        are added and the post's average sentiment is recalculated.
         """
-        if self.post_exists(post_data['post_id']):
-            print(f"Post {post_data['post_id']} already exists in database")
-            return 0
-            
         try:
-            # Extract keywords from post
-            post_keywords = extract_keywords(post_data['message'])
-            
-            # Save the post
-            post = Post(
-                page_id=self.page_id,
-                post_id=post_data['post_id'],
-                message=post_data['message'],
-                created_time=post_data['created_time'],
-                trending_topics=json.dumps(post_keywords)  # Store keywords as JSON
-            )
-            
-            self.session.add(post)
-            self.session.flush()
-            
-            # Save the comments with sentiment analysis
-            comments_saved = 0
-            comments = post_data.get('comments', [])
-            
-            # Analyze sentiments for all comments
-            avg_sentiment, sentiment_data = analyze_comment_sentiments(comments)
-            post.avg_sentiment = avg_sentiment  # Store average sentiment
-            
-            for i, comment_data in enumerate(comments):
-                if not self.comment_exists(comment_data['id']):
-                    # Handle both string and datetime objects for created_time
-                    if isinstance(comment_data['created_time'], str):
-                        comment_created_time = datetime.strptime(
-                            comment_data['created_time'], 
-                            '%Y-%m-%dT%H:%M:%S%z'
-                        )
-                    else:
-                        comment_created_time = comment_data['created_time']
-                    
-                    # Extract keywords from comment
-                    comment_keywords = extract_keywords(comment_data.get('message', ''))
-                    
-                    comment = Comment(
-                        post_id=post_data['post_id'],
-                        comment_id=comment_data['id'],
-                        message=comment_data.get('message', ''),
-                        created_time=comment_created_time,
-                        user_name=comment_data.get('from', 'Unknown'),
-                        sentiment_score=comment_data.get('sentiment_score', 0.0),
-                        sentiment_category=comment_data.get('sentiment_category', 'neutral'),
-                        keywords=json.dumps(comment_keywords)
-                    )
-                    self.session.add(comment)
-                    comments_saved += 1
-            
-            self.session.commit()
-            print(f"Saved post {post_data['post_id']} with {comments_saved} comments")
-            print(f"Average sentiment: {avg_sentiment:.2f}")
+            _, comments_saved = self.bulk_save_posts_with_comments([post_data])
+            print(f"Saved post {post_data['post_id']} with {comments_saved} new comments")
             return comments_saved
             
         except Exception as e:
-            self.session.rollback()
             print(f"Error saving post {post_data['post_id']} with comments: {e}")
             import traceback
             traceback.print_exc()
             return 0
+
+    def analyze_post_with_comments(self, post_data: Dict) -> Dict:
+        """
+        Add keywords to a parsed post, and sentiment and keywords to its comments
+        """
+        if post_data.get('analyzed'):
+            return post_data
+        
+        post_data['keywords'] = extract_keywords(post_data['message'])
+        
+        comments = post_data.get('comments', [])
+        avg_sentiment, _ = analyze_comment_sentiments(comments)
+        post_data['avg_sentiment'] = float(avg_sentiment)
+        for comment_data in comments:
+            comment_data['keywords'] = extract_keywords(comment_data.get('message', ''))
+        
+        post_data['analyzed'] = True
+        return post_data
+
+    def bulk_save_posts_with_comments(self, posts_data: List[Dict],
+                                      batch_size: int = DEFAULT_BATCH_SIZE) -> Tuple[int, int]:
+        """
+        Save many parsed posts and their comments with set-based queries.
+        
+        Existing post and comment IDs are found with one IN query per chunk,
+        and new rows are written with INSERT ... ON CONFLICT DO NOTHING in
+        chunks of batch_size, all in a single transaction. Existing posts
+        keep their row; their new comments are merged and avg_sentiment is
+        recalculated over all stored comments. Returns (posts processed, new
+        comments saved); database errors are re-raised after a rollback.
+        """
+        if not posts_data:
+            return 0, 0
+        
+        try:
+            post_rows = {}
+            comment_rows = {}
+            reply_rows = {}
+            newest_comment_times = {}
+            
+            for post_data in posts_data:
+                self.analyze_post_with_comments(post_data)
+                post_id = post_data['post_id']
+                # Comments we could not read are fetched again next sync
+                comments_complete = not post_data.get('comments_error')
+                post_rows[post_id] = {
+                    'page_id': self.page_id,
+                    'post_id': post_id,
+                    'message': post_data['message'],
+                    'created_time': parse_graph_time(post_data['created_time']),
+                    'trending_topics': json.dumps(post_data['keywords']),  # Store keywords as JSON
+                    'avg_sentiment': post_data['avg_sentiment'],
+                    'content_hash': content_hash(post_data['message'])
+                }
+                
+                for comment_data in post_data.get('comments', []):
+                    comment_created_time = parse_graph_time(comment_data['created_time'])
+                    newest = newest_comment_times.get(post_id)
+                    if comments_complete and (newest is None or to_utc_naive(comment_created_time) > newest):
+                        newest_comment_times[post_id] = to_utc_naive(comment_created_time)
+                    
+                    for reply_data in comment_data.get('replies', []):
+                        reply_rows[reply_data['id']] = {
+                            'comment_id': comment_data['id'],
+                            'reply_id': reply_data['id'],
+                            'message': reply_data.get('message', ''),
+                            'created_time': parse_graph_time(reply_data['created_time']),
+                            'user_name': reply_data.get('from', 'Unknown'),
+                            'ai_generated': False,
+                            'posted_to_facebook': False
+                        }
+                    
+                    comment_rows[comment_data['id']] = {
+                        'post_id': post_id,
+                        'comment_id': comment_data['id'],
+                        'message': comment_data.get('message', ''),
+                        'created_time': comment_created_time,
+                        'user_name': comment_data.get('from', 'Unknown'),
+                        'sentiment_score': comment_data.get('sentiment_score', 0.0),
+                        'sentiment_category': comment_data.get('sentiment_category', 'neutral'),
+                        'keywords': json.dumps(comment_data.get('keywords', [])),
+                        'ai_responded': False,
+                        'content_hash': content_hash(comment_data.get('message', ''))
+                    }
+            
+            # Insert posts we don't have yet
+            stored_posts = existing_keys(self.session, Post.post_id, post_rows.keys(), batch_size)
+            insert_ignore(self.session, Post,
+                          [row for post_id, row in post_rows.items() if post_id not in stored_posts],
+                          ['post_id'], batch_size)
+            
+            # Insert comments we don't have yet
+            stored_comments = existing_keys(self.session, Comment.comment_id, comment_rows.keys(), batch_size)
+            new_comments = [row for comment_id, row in comment_rows.items() if comment_id not in stored_comments]
+            insert_ignore(self.session, Comment, new_comments, ['comment_id'], batch_size)
+            
+            # Insert reply threads ingested with the comments
+            stored_replies = existing_keys(self.session, CommentReply.reply_id, reply_rows.keys(), batch_size)
+            insert_ignore(self.session, CommentReply,
+                          [row for reply_id, row in reply_rows.items() if reply_id not in stored_replies],
+                          ['reply_id'], batch_size)
+            
+            # Average sentiment over every stored comment of the posts that gained comments
+            self.recompute_avg_sentiment({row['post_id'] for row in new_comments}, batch_size)
+            
+            self.set_watermarks(SYNC_POST_COMMENTS, newest_comment_times, commit=False)
+            
+            self.session.commit()
+            return len(post_rows), len(new_comments)
+            
+        except Exception:
+            self.session.rollback()
+            raise
     
-    def fetch_and_save_posts_with_comments(self, posts_limit: int = 50, comments_per_post: int = 100):
+    def recompute_avg_sentiment(self, post_ids, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Set avg_sentiment of posts to the average over all their stored
+        comments, with one correlated UPDATE per chunk (not committed)
+        """
+        post_ids = list(post_ids)
+        posts_table = Post.__table__
+        comments_table = Comment.__table__
+        avg_sentiment = select(func.coalesce(func.avg(comments_table.c.sentiment_score), 0.0))\
+            .where(comments_table.c.post_id == posts_table.c.post_id).scalar_subquery()
+        for i in range(0, len(post_ids), batch_size):
+            self.session.execute(
+                update(posts_table)
+                .where(posts_table.c.post_id.in_(post_ids[i:i + batch_size]))
+                .values(avg_sentiment=avg_sentiment)
+            )
+    
+    def fetch_and_save_posts_with_comments(self, posts_limit: int = 50, comments_per_post: int = 100,
+                                           max_workers: Optional[int] = None, incremental: bool = False,
+                                           pipelined: Optional[bool] = None):
         """
-        Main method to fetch posts with comments and save them to the database
+        Main method to fetch posts with comments and save them to the database.
+        
+        With incremental=True only posts newer than the page watermark are
+        requested, and comments are requested with 'since' set to each
+        post's watermark, including for the posts_limit most recent posts
+        already in the database, so new comments on old posts are merged in.
+        
+        With pipelined=True (default: FACEBOOK_PIPELINED) fetching, parsing,
+        analysis and writes run concurrently through an IngestPipeline.
         """
         print(f"Fetching up to {posts_limit} posts with comments from page {self.page_id}")
+        if self.progress_callback:
+            self.progress_callback(0, "Starting post fetch...")
         
-        # Fetch posts with comments from API
-        raw_posts = self.fetch_posts_with_comments(posts_limit, comments_per_post)
-        print(f"Retrieved {len(raw_posts)} posts with comments from API")
+        if incremental:
+            raw_posts = self.iter_incremental_posts_with_comments(posts_limit, comments_per_post,
+                                                                  max_workers=max_workers)
+        else:
+            raw_posts = self.iter_posts_with_comments(posts_limit, comments_per_post, max_workers=max_workers,
+                                                      strict=True)
         
-        # Process and save posts with comments
-        posts_saved = 0
-        total_comments_saved = 0
+        if pipelined is None:
+            pipelined = self.pipelined
+        if pipelined:
+            from ingest_pipeline import IngestPipeline
+            result = IngestPipeline(self).run(raw_posts, posts_limit)
+            if not result['failed']:
+                self.set_watermark(SYNC_PAGE_POSTS, self.page_id, result['newest_post_time'])
+            if self.progress_callback:
+                self.progress_callback(100, "Completed!")
+            print(f"Successfully processed {result['posts_saved']} posts with {result['comments_saved']} comments")
+            return result['posts_saved'], result['comments_saved']
         
-        for raw_post in raw_posts:
-            parsed_post = self.parse_post_with_comments_data(raw_post)
-            if parsed_post:
-                comments_saved = self.save_post_with_comments(parsed_post)
-                if comments_saved >= 0:  # 0 is valid if post already existed
-                    posts_saved += 1
-                    total_comments_saved += comments_saved
+        # Process and save posts with comments as they stream in from the API
+        posts_saved, total_comments_saved, newest_post_time, save_failed = \
+            self._save_post_stream(raw_posts, posts_limit)
         
+        if self.failed_requests:
+            print(f"{len(self.failed_requests)} Graph requests failed during this sync")
+        
+        # Only advance the page watermark once the whole stream was saved
+        if not save_failed:
+            self.set_watermark(SYNC_PAGE_POSTS, self.page_id, newest_post_time)
+        
+        if self.progress_callback:
+            self.progress_callback(100, "Completed!")
         print(f"Successfully processed {posts_saved} posts with {total_comments_saved} comments")
         return posts_saved, total_comments_saved
+
+    def _save_post_stream(self, raw_posts: Iterator[Dict],
+                          posts_limit: int) -> Tuple[int, int, Optional[datetime], bool]:
+        """
+        Parse and save posts with comments as they stream in from the API,
+        writing them in bulk batches of save_batch_size posts.
+        
+        Returns (posts saved, new comments saved, newest post time, whether
+        any post or batch failed).
+        """
+        posts_saved = 0
+        total_comments_saved = 0
+        newest_post_time = None
+        save_failed = False
+        pending = []
+        
+        def flush():
+            nonlocal posts_saved, total_comments_saved, save_failed
+            try:
+                saved, comments_saved = self.bulk_save_posts_with_comments(pending)
+                posts_saved += saved
+                total_comments_saved += comments_saved
+                print(f"Saved {saved} posts with {comments_saved} new comments")
+            except Exception as e:
+                save_failed = True
+                print(f"Error saving batch of {len(pending)} posts: {e}")
+            pending.clear()
+            self._report_sync_progress(posts_saved, total_comments_saved, posts_limit)
+        
+        try:
+            for raw_post in raw_posts:
+                parsed_post = self.parse_post_with_comments_data(raw_post)
+                if parsed_post:
+                    if parsed_post.get('comments_error'):
+                        save_failed = True
+                    pending.append(parsed_post)
+                    post_time = to_utc_naive(parsed_post['created_time'])
+                    if newest_post_time is None or post_time > newest_post_time:
+                        newest_post_time = post_time
+                    if len(pending) >= self.save_batch_size:
+                        flush()
+        except GraphAPIError as e:
+            # Keep what we have; the rest is picked up by the next sync
+            save_failed = True
+            print(f"Stopped fetching posts: {e}")
+        if pending:
+            flush()
+        return posts_saved, total_comments_saved, newest_post_time, save_failed
+
+    def sync_stored_post_comments(self, posts_limit: int = 100, comments_per_post: int = 100,
+                                  max_workers: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Merge new comments (and their replies) into the posts_limit most
+        recent stored posts, without paging the page's post feed.
+        
+        Returns (posts processed, new comments saved).
+        """
+        print(f"Refreshing comments of the {posts_limit} most recent stored posts of page {self.page_id}")
+        posts_saved, comments_saved, _, _ = self._save_post_stream(
+            self.iter_stored_posts_with_comments(posts_limit, comments_per_post, max_workers=max_workers),
+            posts_limit
+        )
+        if self.progress_callback:
+            self.progress_callback(100, "Completed!")
+        return posts_saved, comments_saved
+
+    def sync_comment_replies(self, comments_limit: int = 200, max_workers: Optional[int] = None) -> int:
+        """
+        Re-read the reply threads of the comments_limit most recent stored
+        comments and insert the replies we don't have yet.
+        
+        Incremental comment syncs only see comments newer than each post's
+        watermark, so this is what picks up new replies to older comments.
+        Returns the number of new replies saved.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        comment_ids = self.session.execute(
+            select(Comment.comment_id).join(Post, Post.post_id == Comment.post_id)
+            .where(Post.page_id == self.page_id)
+            .order_by(Comment.created_time.desc()).limit(comments_limit)
+        ).scalars().all()
+        print(f"Refreshing reply threads of {len(comment_ids)} comments")
+        
+        replies_saved = 0
+        for i in range(0, len(comment_ids), GRAPH_BATCH_LIMIT):
+            # comment_count is not stored, so every comment is treated as threaded
+            comments = [{'id': comment_id, 'comment_count': 1} for comment_id in comment_ids[i:i + GRAPH_BATCH_LIMIT]]
+            self._attach_replies([{'comments': {'data': comments}}], max_workers)
+            
+            reply_rows = {}
+            for comment in comments:
+                for reply in (comment.get('replies') or {}).get('data', []):
+                    reply_rows[reply['id']] = {
+                        'comment_id': comment['id'],
+                        'reply_id': reply['id'],
+                        'message': reply.get('message', ''),
+                        'created_time': parse_graph_time(reply['created_time']),
+                        'user_name': reply.get('from', {}).get('name', 'Unknown'),
+                        'ai_generated': False,
+                        'posted_to_facebook': False
+                    }
+            try:
+                stored = existing_keys(self.session, CommentReply.reply_id, reply_rows.keys())
+                new_replies = [row for reply_id, row in reply_rows.items() if reply_id not in stored]
+                insert_ignore(self.session, CommentReply, new_replies, ['reply_id'])
+                self.session.commit()
+            except Exception:
+                self.session.rollback()
+                raise
+            replies_saved += len(new_replies)
+            
+            if self.progress_callback:
+                done = min(i + GRAPH_BATCH_LIMIT, len(comment_ids))
+                self.progress_callback(done * 100 / max(len(comment_ids), 1),
+                                       f"Checked {done} comments, {replies_saved} new replies",
+                                       comments=done, replies=replies_saved)
+        
+        print(f"Saved {replies_saved} new replies")
+        return replies_saved
+
+    def _report_sync_progress(self, posts_saved: int, comments_saved: int, posts_limit: int):
+        """
+        Pass sync progress (percent, message, post and comment counts) to the progress callback, if one is set
+        """
+        if self.progress_callback:
+            # Incremental syncs also revisit stored posts, so stay below 100 until done
+            progress = min(99, posts_saved * 100 / max(posts_limit, 1))
+            self.progress_callback(progress, f"Saved {posts_saved} posts with {comments_saved} new comments",
+                                   posts=posts_saved, comments=comments_saved)
+
+    def iter_incremental_posts_with_comments(self, posts_limit: int = 50, comments_per_post: int = 100,
+                                             max_workers: Optional[int] = None,
+                                             use_batch: Optional[bool] = None) -> Iterator[Dict]:
+        """
+        Yield posts created since the page watermark, then the most recent
+        stored posts, each with only the comments newer than its watermark
+        """
+        page_since = self.get_watermark(SYNC_PAGE_POSTS, self.page_id)
+        print(f"Incremental sync of page {self.page_id} since {page_since or 'the beginning'}")
+        
+        seen_post_ids = set()
+        for post in self.iter_posts_with_comments(posts_limit, comments_per_post, max_workers=max_workers,
+                                                  use_batch=use_batch, since=page_since, incremental=True,
+                                                  strict=True):
+            seen_post_ids.add(post['id'])
+            yield post
+        
+        # Revisit posts we already have so their new comments are picked up
+        yield from self.iter_stored_posts_with_comments(posts_limit, comments_per_post, max_workers=max_workers,
+                                                        use_batch=use_batch, exclude=seen_post_ids)
+
+    def iter_stored_posts_with_comments(self, posts_limit: int = 50, comments_per_post: int = 100,
+                                        max_workers: Optional[int] = None, use_batch: Optional[bool] = None,
+                                        exclude=()) -> Iterator[Dict]:
+        """
+        Yield the posts_limit most recent stored posts (minus exclude), each
+        with only the comments newer than its watermark
+        """
+        known_posts = self.session.query(Post).filter_by(page_id=self.page_id)\
+            .order_by(Post.created_time.desc()).limit(posts_limit).all()
+        known_posts = [
+            {'id': post.post_id, 'message': post.message, 'created_time': post.created_time}
+            for post in known_posts if post.post_id not in exclude
+        ]
+        
+        if max_workers is None:
+            max_workers = self.max_workers
+        if use_batch is None:
+            use_batch = self.use_batch
+        
+        for i in range(0, len(known_posts), GRAPH_BATCH_LIMIT):
+            chunk = known_posts[i:i + GRAPH_BATCH_LIMIT]
+            self._attach_comments(chunk, comments_per_post, max_workers, use_batch, incremental=True)
+            self._attach_replies(chunk, max_workers)
+            yield from chunk
         
     def debug_api_response(self, endpoint, params):
         """
@@ -523,7 +1013,7 @@ class FacebookAPI:
             print(f"Making request to: {endpoint}")
             print(f"With params: {params}")
             
-            response = requests.get(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('GET', f"{self.base_url}/{endpoint}", params=params)
             print(f"Status code: {response.status_code}")
             
             if response.status_code != 200:
@@ -548,55 +1038,286 @@ class FacebookAPI:
             print(f"Debug request failed: {e}")
             return None
         
-    def fetch_posts_with_comments(self, limit: int = 50, comments_per_post: int = 100) -> List[Dict]:
+    def fetch_posts_with_comments(self, limit: int = 50, comments_per_post: int = 100,
+                                  max_workers: Optional[int] = None,
+                                  expand_comments: Optional[bool] = None) -> List[Dict]:
+        """
+        Fetch posts and their comments.
+        
+        With expand_comments (defaults to self.expand_comments) the first
+        page of every post's comments comes embedded in the /posts response;
+        otherwise the fallback approach fetches comments separately per post.
+        """
+        if expand_comments is None:
+            expand_comments = self.expand_comments
+        if not expand_comments:
+            print("Using fallback approach: fetching posts first, then comments separately")
+            return self.fetch_posts_separate_from_comments(limit, comments_per_post, max_workers=max_workers)
+        
+        posts_data = list(self.iter_posts_with_comments(limit, comments_per_post, max_workers=max_workers,
+                                                        expand_comments=True))
+        print(f"Fetched {len(posts_data)} posts with comments")
+        return posts_data
+
+    def _comments_params(self, limit: int, since: Optional[datetime] = None) -> Dict:
         """
-        Fetch posts and their comments with a fallback approach
+        Query parameters used when reading a comments edge
         """
-        print("Using fallback approach: fetching posts first, then comments separately")
-        return self.fetch_posts_separate_from_comments(limit, comments_per_post)
+        params = {
+            'fields': 'id,message,created_time,from{name},comment_count',
+            'limit': limit
+        }
+        if since is not None:
+            params['since'] = self._since_param(since)
+        return params
 
-    def fetch_posts_separate_from_comments(self, limit: int = 50, comments_per_post: int = 100) -> List[Dict]:
+    def fetch_post_comments(self, post_id: str, comments_per_post: int = 100,
+                            since: Optional[datetime] = None, strict: bool = False) -> List[Dict]:
+        """
+        Fetch all comments of a single post (created after since, if given), comments_per_post per page.
+        
+        With strict set, a page that fails after retries raises GraphAPIError
+        instead of returning the comments read so far.
+        """
+        comments = list(self.iter_post_comments(post_id, comments_per_post, since=since, strict=strict))
+        print(f"Found {len(comments)} comments for post {post_id}")
+        return comments
+
+    def iter_post_comments(self, post_id: str, page_size: int = 100,
+                           first_page: Optional[Dict] = None,
+                           since: Optional[datetime] = None, strict: bool = False) -> Iterator[Dict]:
+        """
+        Yield every comment of a post, following the paging cursors
+        """
+        return self.iter_edge(f"{post_id}/comments", self._comments_params(page_size, since),
+                              first_page=first_page, strict=strict)
+
+    def _fetch_comments_for_post(self, post: Dict, comments_per_post: int, since: Optional[datetime] = None,
+                                 first_page: Optional[Dict] = None):
+        """
+        Store a post's comments under post['comments'], or the failure under
+        post['comments_error'] so the post's watermark is left alone
+        """
+        try:
+            if first_page is None:
+                comments = self.fetch_post_comments(post['id'], comments_per_post, since=since, strict=True)
+            else:
+                comments = list(self.iter_post_comments(post['id'], comments_per_post,
+                                                        first_page=first_page, strict=True))
+            post['comments'] = {'data': comments}
+        except GraphAPIError as e:
+            print(f"Could not fetch comments for post {post['id']}: {e}")
+            post['comments'] = {'data': []}
+            post['comments_error'] = e.to_dict()
+
+    def fetch_posts_separate_from_comments(self, limit: int = 50, comments_per_post: int = 100,
+                                           max_workers: Optional[int] = None,
+                                           use_batch: Optional[bool] = None) -> List[Dict]:
         """
         Fetch posts first, then fetch comments for each post separately
         """
-        # First, fetch just the posts
+        posts_data = list(self.iter_posts_with_comments(limit, comments_per_post, max_workers=max_workers,
+                                                        use_batch=use_batch, expand_comments=False))
+        print(f"Fetched {len(posts_data)} posts with comments")
+        return posts_data
+
+    def iter_posts_with_comments(self, limit: int = 50, comments_per_post: int = 100,
+                                 max_workers: Optional[int] = None,
+                                 use_batch: Optional[bool] = None,
+                                 since: Optional[datetime] = None,
+                                 incremental: bool = False,
+                                 strict: bool = False,
+                                 expand_comments: Optional[bool] = None) -> Iterator[Dict]:
+        """
+        Yield posts with all of their comments, one page of posts at a time.
+        
+        With expand_comments (defaults to self.expand_comments) each post's
+        first page of comments is read in the same request as the posts
+        through field expansion, and only posts with more comments than that
+        need follow-up requests; if the expanded request is rejected the
+        comments are fetched separately instead.
+        
+        Separately fetched comments are read by a pool of up to max_workers
+        threads (defaults to self.max_workers); posts are yielded in the
+        order the API returned them. A max_workers of 1 fetches the comments
+        one post at a time. With use_batch (defaults to self.use_batch) the
+        first comment page of every post is read through Graph batch calls.
+        comments_per_post is the comment page size; further pages are
+        followed until each post's comments are complete. since limits the
+        posts to those created after it, and incremental limits each post's
+        comments to those newer than its stored watermark. With strict set, a
+        page of posts that fails after retries raises GraphAPIError instead
+        of ending the stream early.
+        """
+        if max_workers is None:
+            max_workers = self.max_workers
+        if use_batch is None:
+            use_batch = self.use_batch
+        if expand_comments is None:
+            expand_comments = self.expand_comments
+        
         posts_endpoint = f"{self.page_id}/posts"
         posts_params = {
             'fields': 'id,message,created_time',
-            'limit': limit,
-            'access_token': self.access_token
+            'limit': min(limit, 100)
         }
+        if expand_comments:
+            posts_params['fields'] += ',' + self._expanded_comments_field(comments_per_post)
+            posts_params['limit'] = min(limit, EXPANDED_POSTS_PAGE_SIZE)
+        if since is not None:
+            posts_params['since'] = self._since_param(since)
         
-        posts_response = self.make_api_request(posts_endpoint, posts_params)
-        if not posts_response or 'data' not in posts_response:
-            print("Failed to fetch posts")
-            return []
+        remaining = limit
+        pages = self.iter_edge_pages(posts_endpoint, posts_params, strict=strict or expand_comments)
+        first_page = True
+        while remaining > 0:
+            try:
+                posts_data = next(pages)
+            except StopIteration:
+                return
+            except GraphAPIError as e:
+                if expand_comments and first_page:
+                    print(f"Expanded posts request failed ({e}), fetching comments separately")
+                    yield from self.iter_posts_with_comments(limit, comments_per_post, max_workers=max_workers,
+                                                             use_batch=use_batch, since=since,
+                                                             incremental=incremental, strict=strict,
+                                                             expand_comments=False)
+                    return
+                if strict:
+                    raise
+                return
+            first_page = False
+            
+            posts_data = posts_data[:remaining]
+            print(f"Fetched {len(posts_data)} posts")
+            if expand_comments:
+                self._attach_expanded_comments(posts_data, comments_per_post, max_workers, use_batch, incremental)
+            else:
+                self._attach_comments(posts_data, comments_per_post, max_workers, use_batch, incremental)
+            self._attach_replies(posts_data, max_workers)
+            
+            yield from posts_data
+            
+            remaining -= len(posts_data)
+
+    def _attach_replies(self, posts_data: List[Dict], max_workers: int, page_size: int = 100):
+        """
+        Store the reply threads of a page of posts' comments under comment['replies'].
         
-        posts_data = posts_response['data']
-        print(f"Fetched {len(posts_data)} posts")
+        Only comments whose comment_count says they have replies are read;
+        their first reply pages go through Graph batch calls and longer
+        threads follow the paging cursors.
+        """
+        if not self.sync_replies:
+            return
         
-        # Now fetch comments for each post
-        for i, post in enumerate(posts_data):
-            print(f"Fetching comments for post {i+1}/{len(posts_data)}: {post['id']}")
-            comments_endpoint = f"{post['id']}/comments"
-            comments_params = {
-                'fields': 'id,message,created_time,from{name}',
-                'limit': comments_per_post,
-                'access_token': self.access_token
-            }
-            
-            comments_response = self.make_api_request(comments_endpoint, comments_params)
-            if comments_response and 'data' in comments_response:
-                post['comments'] = {'data': comments_response['data']}
-                print(f"Found {len(comments_response['data'])} comments")
+        threaded = [
+            comment for post in posts_data
+            for comment in (post.get('comments') or {}).get('data', [])
+            if comment.get('comment_count')
+        ]
+        if not threaded:
+            return
+        
+        print(f"Fetching reply threads for {len(threaded)} comments")
+        pages = self.make_batch_request(
+            [(f"{comment['id']}/comments", self._comments_params(page_size)) for comment in threaded],
+            max_workers=max_workers
+        )
+        for comment, page in zip(threaded, pages):
+            # Operations that failed inside the batch are retried on their own
+            try:
+                comment['replies'] = {
+                    'data': list(self.iter_comment_replies(comment['id'], page_size, first_page=page, strict=True))
+                }
+            except GraphAPIError as e:
+                print(f"Could not fetch replies for comment {comment['id']}: {e}")
+
+    @staticmethod
+    def _expanded_comments_field(limit: int) -> str:
+        """
+        Field expansion that embeds a post's first page of comments, with reply counts
+        """
+        return f"comments.limit({min(limit, 100)}){{id,message,created_time,from{{name}},comment_count}}"
+
+    def _attach_expanded_comments(self, posts_data: List[Dict], comments_per_post: int,
+                                  max_workers: int, use_batch: bool, incremental: bool = False):
+        """
+        Complete the comments embedded in a page of expanded posts.
+        
+        Posts whose embedded page has a next cursor continue from it; posts
+        with a stored watermark are re-read with 'since' during incremental
+        syncs, since the embedded page is not limited to new comments.
+        """
+        watermarks = {}
+        if incremental:
+            watermarks = self.get_watermarks(SYNC_POST_COMMENTS, [post['id'] for post in posts_data])
+        
+        overflowing = []
+        for post in posts_data:
+            if post['id'] in watermarks:
+                continue
+            embedded = post.get('comments') or {}
+            if embedded.get('paging', {}).get('next'):
+                overflowing.append(post)
             else:
-                post['comments'] = {'data': []}
-                print("No comments found")
-            
-            # Add a small delay to avoid rate limiting
-            time.sleep(1)
+                # Posts without comments have no 'comments' field at all
+                post['comments'] = {'data': embedded.get('data', [])}
         
-        return posts_data
+        known = [post for post in posts_data if post['id'] in watermarks]
+        if known:
+            self._attach_comments(known, comments_per_post, max_workers, use_batch, incremental=True)
+        
+        if not overflowing:
+            return
+        print(f"Following comment cursors for {len(overflowing)} of {len(posts_data)} posts")
+        if max_workers <= 1:
+            for post in overflowing:
+                self._fetch_comments_for_post(post, comments_per_post, first_page=post['comments'])
+            return
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(overflowing))) as executor:
+            list(executor.map(
+                lambda post: self._fetch_comments_for_post(post, comments_per_post, first_page=post['comments']),
+                overflowing
+            ))
+
+    def _attach_comments(self, posts_data: List[Dict], comments_per_post: int,
+                         max_workers: int, use_batch: bool, incremental: bool = False):
+        """
+        Fetch the comments of a page of posts and store them under post['comments']
+        """
+        watermarks = {}
+        if incremental:
+            watermarks = self.get_watermarks(SYNC_POST_COMMENTS, [post['id'] for post in posts_data])
+        
+        if use_batch:
+            comment_pages = self.make_batch_request(
+                [(f"{post['id']}/comments", self._comments_params(comments_per_post, watermarks.get(post['id'])))
+                 for post in posts_data],
+                max_workers=max_workers
+            )
+            for post, page in zip(posts_data, comment_pages):
+                # Operations that failed inside the batch are retried on their own
+                self._fetch_comments_for_post(post, comments_per_post, since=watermarks.get(post['id']),
+                                              first_page=page)
+            print(f"Fetched comments for {len(posts_data)} posts in batch mode")
+            return
+        
+        if max_workers <= 1:
+            # Now fetch comments for each post
+            for i, post in enumerate(posts_data):
+                print(f"Fetching comments for post {i+1}/{len(posts_data)}: {post['id']}")
+                self._fetch_comments_for_post(post, comments_per_post, since=watermarks.get(post['id']))
+            return
+        
+        # Fetch comments for many posts at once; each worker fills in its own post
+        print(f"Fetching comments for {len(posts_data)} posts with {max_workers} workers")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(
+                lambda post: self._fetch_comments_for_post(post, comments_per_post,
+                                                           since=watermarks.get(post['id'])),
+                posts_data
+            ))
     
     def check_permissions(self):
         """
@@ -652,7 +1373,21 @@ class FacebookAPI:
 
     def make_api_request(self, endpoint: str, params: Optional[Dict] = None) -> Optional[Dict]:
         """
-        Make a request to the Facebook Graph API with enhanced error handling
+        Make a request to the Facebook Graph API with enhanced error handling.
+        
+        Returns None if the request failed; the failure is kept in
+        self.failed_requests. Use graph_get to get the error raised instead.
+        """
+        try:
+            return self.graph_get(endpoint, params)
+        except GraphAPIError:
+            return None
+
+    def graph_get(self, endpoint: str, params: Optional[Dict] = None) -> Dict:
+        """
+        GET a Graph endpoint, retrying transient failures.
+        
+        Raises GraphAPIError if the request still fails after retries.
         """
         if params is None:
             params = {}
@@ -664,28 +1399,29 @@ class FacebookAPI:
             print(f"Making request to: {endpoint}")
             print(f"Params: { {k: v for k, v in params.items() if k != 'access_token'} }")  # Don't print token
             
-            response = requests.get(f"{self.base_url}/{endpoint}", params=params, timeout=30)
+            response = self._graph_request('GET', f"{self.base_url}/{endpoint}", params=params)
             print(f"Response status: {response.status_code}")
             
             # Check for specific error status codes
             if response.status_code == 400:
                 print("Bad Request - check your parameters")
                 print(f"Response: {response.text}")
-                return None
+                raise self._request_failed(endpoint, "Bad Request", response)
             elif response.status_code == 401:
                 print("Unauthorized - check your access token")
                 print(f"Response: {response.text}")
-                return None
+                raise self._request_failed(endpoint, "Unauthorized", response)
             elif response.status_code == 403:
                 print("Forbidden - check your permissions")
                 print(f"Response: {response.text}")
-                return None
+                raise self._request_failed(endpoint, "Forbidden", response)
             elif response.status_code == 404:
                 print("Not Found - check your endpoint URL")
                 print(f"Response: {response.text}")
-                return None
-            
-            response.raise_for_status()
+                raise self._request_failed(endpoint, "Not Found", response)
+            elif response.status_code >= 400:
+                print(f"Response: {response.text}")
+                raise self._request_failed(endpoint, f"HTTP {response.status_code}", response)
             
             # Try to parse JSON
             try:
@@ -694,17 +1430,148 @@ class FacebookAPI:
                 return data
             except json.JSONDecodeError:
                 print(f"Failed to parse JSON response: {response.text}")
-                return None
+                raise self._request_failed(endpoint, "Invalid JSON response", response)
                 
-        except requests.exceptions.Timeout:
-            print("Request timed out after 30 seconds")
-            return None
-        except requests.exceptions.ConnectionError:
+        except requests.exceptions.Timeout as e:
+            print(f"Request timed out (connect/read timeout {self.http.timeout})")
+            raise self._request_failed(endpoint, f"Timeout: {e}", attempts=getattr(e, 'attempts', 1)) from e
+        except requests.exceptions.ConnectionError as e:
             print("Connection error - check your internet connection")
-            return None
+            raise self._request_failed(endpoint, f"Connection error: {e}", attempts=getattr(e, 'attempts', 1)) from e
         except requests.exceptions.RequestException as e:
             print(f"API request failed: {e}")
-            return None
+            raise self._request_failed(endpoint, str(e), attempts=getattr(e, 'attempts', 1)) from e
+
+    def _split_next_url(self, next_url: str) -> Tuple[str, Dict]:
+        """
+        Turn an absolute paging.next URL into an (endpoint, params) pair
+        """
+        parts = urlsplit(next_url)
+        path = parts.path.lstrip('/')
+        version_prefix = urlsplit(self.base_url).path.strip('/')
+        if version_prefix and path.startswith(version_prefix + '/'):
+            path = path[len(version_prefix) + 1:]
+        params = {k: v for k, v in parse_qsl(parts.query) if k != 'access_token'}
+        return path, params
+
+    def iter_edge_pages(self, endpoint: Optional[str], params: Optional[Dict] = None,
+                        first_page: Optional[Dict] = None, strict: bool = False) -> Iterator[List[Dict]]:
+        """
+        Yield each page of records of a Graph edge, following paging.next cursors.
+        
+        If first_page is given (e.g. a response already read through a batch
+        call) it is used instead of requesting the first page again. A page
+        that fails after retries ends the edge early, or raises
+        GraphAPIError if strict is set.
+        """
+        request = self.graph_get if strict else self.make_api_request
+        response_data = first_page
+        if response_data is None and endpoint:
+            response_data = request(endpoint, dict(params or {}))
+        
+        while response_data and 'data' in response_data:
+            yield response_data['data']
+            
+            next_url = response_data.get('paging', {}).get('next')
+            if not next_url:
+                return
+            endpoint, next_params = self._split_next_url(next_url)
+            response_data = request(endpoint, next_params)
+
+    def iter_edge(self, endpoint: Optional[str], params: Optional[Dict] = None,
+                  max_items: Optional[int] = None, first_page: Optional[Dict] = None,
+                  strict: bool = False) -> Iterator[Dict]:
+        """
+        Yield the records of a Graph edge one by one across all pages
+        """
+        if max_items is not None and max_items <= 0:
+            return
+        
+        count = 0
+        for records in self.iter_edge_pages(endpoint, params, first_page=first_page, strict=strict):
+            for record in records:
+                yield record
+                count += 1
+                if max_items is not None and count >= max_items:
+                    return
+
+    def _relative_url(self, endpoint: str, params: Optional[Dict] = None) -> str:
+        """
+        Build a relative Graph URL (without the access token) for a batch operation
+        """
+        query = {k: v for k, v in (params or {}).items() if k != 'access_token'}
+        return f"{endpoint}?{urlencode(query)}" if query else endpoint
+
+    def _send_batch_chunk(self, chunk: List[Tuple[str, Optional[Dict]]]) -> List[Optional[Dict]]:
+        """
+        Send one Graph batch call of at most GRAPH_BATCH_LIMIT GET operations
+        """
+        operations = [
+            {'method': 'GET', 'relative_url': self._relative_url(endpoint, params)}
+            for endpoint, params in chunk
+        ]
+        payload = {
+            'access_token': self.access_token,
+            'include_headers': 'false',
+            'batch': json.dumps(operations)
+        }
+        
+        try:
+            # The batch only contains GETs, so it is safe to repeat
+            response = self._graph_request('POST', self.base_url, idempotent=True, data=payload)
+            response.raise_for_status()
+            results = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"Batch request of {len(chunk)} operations failed: {e}")
+            return [None] * len(chunk)
+        
+        bodies = []
+        for (endpoint, _), result in zip(chunk, results):
+            # A null entry means Facebook timed out this operation
+            if not result:
+                logger.warning(f"Batch operation for {endpoint} returned no result")
+                bodies.append(None)
+                continue
+            if result.get('code') != 200:
+                try:
+                    error = json.loads(result.get('body') or '{}').get('error')
+                except json.JSONDecodeError:
+                    error = None
+                if is_throttle_error(error):
+                    self.rate_limiter.record_throttle()
+                logger.error(f"Batch operation for {endpoint} failed ({result.get('code')}): {result.get('body')}")
+                bodies.append(None)
+                continue
+            try:
+                bodies.append(json.loads(result.get('body') or '{}'))
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse batch response for {endpoint}")
+                bodies.append(None)
+        return bodies
+
+    def make_batch_request(self, batch_requests: List[Tuple[str, Optional[Dict]]],
+                           max_workers: int = 1) -> List[Optional[Dict]]:
+        """
+        Run many (endpoint, params) GET requests through the Graph batch API.
+        
+        The requests are packed into chunks of GRAPH_BATCH_LIMIT; chunks are
+        sent by up to max_workers threads. Returns one parsed response body
+        per request, in request order, with None for failed operations.
+        """
+        if not batch_requests:
+            return []
+        
+        chunks = [batch_requests[i:i + GRAPH_BATCH_LIMIT]
+                  for i in range(0, len(batch_requests), GRAPH_BATCH_LIMIT)]
+        print(f"Sending {len(batch_requests)} requests in {len(chunks)} batch call(s)")
+        
+        if max_workers <= 1 or len(chunks) == 1:
+            chunk_results = [self._send_batch_chunk(chunk) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+                chunk_results = list(executor.map(self._send_batch_chunk, chunks))
+        
+        return [body for bodies in chunk_results for body in bodies]
 
     def verify_credentials(self):
         """
@@ -713,14 +1580,14 @@ class FacebookAPI:
         print("Verifying credentials...")
         
         # First, verify the access token
-        debug_url = f"https://graph.facebook.com/debug_token"
+        debug_url = f"{self.base_url}/debug_token"
         debug_params = {
             'input_token': self.access_token,
             'access_token': self.access_token
         }
         
         try:
-            response = requests.get(debug_url, params=debug_params)
+            response = self._graph_request('GET', debug_url, params=debug_params)
             debug_data = response.json()
             
             if 'data' in debug_data and debug_data['data']['is_valid']:
@@ -737,13 +1604,13 @@ class FacebookAPI:
         
         # Next, verify the page ID
         try:
-            page_url = f"https://graph.facebook.com/{self.page_id}"
+            page_url = f"{self.base_url}/{self.page_id}"
             page_params = {
                 'fields': 'id,name',
                 'access_token': self.access_token
             }
             
-            response = requests.get(page_url, params=page_params)
+            response = self._graph_request('GET', page_url, params=page_params)
             page_data = response.json()
             
             if 'id' in page_data:
@@ -769,7 +1636,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.post(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('POST', f"{self.base_url}/{endpoint}", params=params)
             
             if response.status_code == 200:
                 print(f"Successfully edited post {post_id}")
@@ -790,7 +1657,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.delete(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('DELETE', f"{self.base_url}/{endpoint}", params=params)
             
             if response.status_code == 200:
                 print(f"Successfully deleted post {post_id}")
@@ -851,7 +1718,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.post(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('POST', f"{self.base_url}/{endpoint}", params=params)
             
             if response.status_code == 200:
                 print(f"Successfully edited post {post_id}")
@@ -874,7 +1741,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.delete(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('DELETE', f"{self.base_url}/{endpoint}", params=params)
             
             if response.status_code == 200:
                 print(f"Successfully deleted post {post_id}")
@@ -952,7 +1819,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.delete(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('DELETE', f"{self.base_url}/{endpoint}", params=params)
             
             if response.status_code == 200:
                 print(f"Successfully deleted comment {comment_id}")
@@ -995,7 +1862,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.post(f"{self.base_url}/{endpoint}", params=params)
+            response = self._graph_request('POST', f"{self.base_url}/{endpoint}", params=params)
             response.raise_for_status()
             response_data = response.json()
             
@@ -1010,26 +1877,31 @@ class FacebookAPI:
 
     def get_comment_replies(self, comment_id: str, limit: int = 10) -> List[Dict]:
         """
-        Get replies to a comment
+        Get all replies to a comment, limit replies per page
         """
-        endpoint = f"{comment_id}/comments"
-        params = {
-            'fields': 'id,message,created_time,from{name}',
-            'limit': limit,
-            'access_token': self.access_token
+        return list(self.iter_comment_replies(comment_id, limit))
+
+    def iter_comment_replies(self, comment_id: str, page_size: int = 10,
+                             first_page: Optional[Dict] = None, strict: bool = False) -> Iterator[Dict]:
+        """
+        Yield every reply to a comment, following the paging cursors
+        """
+        return self.iter_edge(f"{comment_id}/comments", self._comments_params(page_size),
+                              first_page=first_page, strict=strict)
+
+    def get_comment_replies_batch(self, comment_ids: List[str], limit: int = 10) -> Dict[str, List[Dict]]:
+        """
+        Get replies for many comments at once through the Graph batch API
+        """
+        pages = self.make_batch_request(
+            [(f"{comment_id}/comments", self._comments_params(limit)) for comment_id in comment_ids],
+            max_workers=self.max_workers
+        )
+        return {
+            comment_id: list(self.iter_comment_replies(comment_id, limit, first_page=page)) if page else []
+            for comment_id, page in zip(comment_ids, pages)
         }
         
-        try:
-            response = requests.get(f"{self.base_url}/{endpoint}", params=params)
-            response.raise_for_status()
-            response_data = response.json()
-            
-            return response_data.get('data', [])
-            
-        except requests.exceptions.RequestException as e:
-            print(f"Error getting comment replies {comment_id}: {e}")
-            return []
-        
     def check_reply_permissions(self):
         """
         Check if the app has permissions to reply to comments
@@ -1041,7 +1913,7 @@ class FacebookAPI:
         }
         
         try:
-            response = requests.get(f"{self.base_url}/{debug_token_endpoint}", params=params)
+            response = self._graph_request('GET', f"{self.base_url}/{debug_token_endpoint}", params=params)
             response.raise_for_status()
             data = response.json()
             
@@ -1066,13 +1938,13 @@ class FacebookAPI:
         """
         try:
             # Get page access token
-            page_access_token = os.environ.get('FACEBOOK_PAGE_ACCESS_TOKEN')
+            page_access_token = self.page_access_token
             if not page_access_token:
                 logger.error("No Facebook Page Access Token configured")
                 return False
             
             # API endpoint
-            url = f"https://graph.facebook.com/v19.0/me/messages?access_token={page_access_token}"
+            url = f"{self.base_url}/me/messages?access_token={page_access_token}"
             
             # Request payload
             payload = {
@@ -1082,7 +1954,7 @@ class FacebookAPI:
             }
             
             # Send request
-            response = requests.post(url, json=payload)
+            response = self._graph_request('POST', url, json=payload)
             result = response.json()
             
             if response.status_code == 200:
@@ -1108,7 +1980,7 @@ class FacebookAPI:
                 'limit': limit
             }
             
-            response = requests.get(url, params=params)
+            response = self._graph_request('GET', url, params=params)
             data = response.json()
             
             if response.status_code == 200:
@@ -1122,36 +1994,56 @@ class FacebookAPI:
             logger.error(f"Exception fetching conversations: {str(e)}")
             return []
     
-    def fetch_messages(self, conversation_id: str, limit: int = 100) -> List[Dict[str, any]]:
+    def _messages_params(self, limit: int) -> Dict:
         """
-        Fetch messages from a specific conversation
+        Query parameters used when reading a conversation's messages edge
         """
-        try:
-            url = f"{self.base_url}/{conversation_id}/messages"
-            params = {
-                'access_token': self.page_access_token,
-                'fields': 'id,from,to,message,created_time,attachments',
-                'limit': limit
-            }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
-            
-            if response.status_code == 200:
-                logger.info(f"Fetched {len(data.get('data', []))} messages from conversation {conversation_id}")
-                return data.get('data', [])
-            else:
-                logger.error(f"Error fetching messages: {data}")
-                return []
-                
-        except Exception as e:
-            logger.error(f"Exception fetching messages: {str(e)}")
-            return []
+        return {
+            'fields': 'id,from,to,message,created_time,attachments',
+            'limit': limit
+        }
+
+    def fetch_messages(self, conversation_id: str, limit: int = 100,
+                       since: Optional[datetime] = None, strict: bool = False) -> List[Dict[str, any]]:
+        """
+        Fetch all messages (newer than since, if given) from a specific conversation, limit messages per page.
+        
+        With strict set, a page that fails after retries raises GraphAPIError
+        instead of returning the messages read so far.
+        """
+        messages = list(self.iter_messages(conversation_id, limit, since=since, strict=strict))
+        logger.info(f"Fetched {len(messages)} messages from conversation {conversation_id}")
+        return messages
+
+    def iter_messages(self, conversation_id: str, page_size: int = 100,
+                      first_page: Optional[Dict] = None,
+                      since: Optional[datetime] = None, strict: bool = False) -> Iterator[Dict[str, any]]:
+        """
+        Yield every message of a conversation, newest first, following the paging cursors.
+        
+        The messages edge has no 'since' filter, so when since is given
+        paging stops at the first message that is not newer than it.
+        """
+        messages = self.iter_edge(f"{conversation_id}/messages", self._messages_params(page_size),
+                                  first_page=first_page, strict=strict)
+        for message in messages:
+            if since is not None and to_utc_naive(parse_graph_time(message['created_time'])) <= since:
+                return
+            yield message
     
-    def fetch_all_conversations_with_messages(self, conversations_limit: int = 50, messages_limit: int = 50) -> Dict[str, any]:
+    def fetch_all_conversations_with_messages(self, conversations_limit: int = 50, messages_limit: int = 50,
+                                              use_batch: Optional[bool] = None,
+                                              incremental: bool = False) -> Dict[str, any]:
         """
-        Fetch all conversations and their messages
+        Fetch all conversations and their messages.
+        
+        With incremental=True only messages newer than each conversation's
+        watermark are returned; callers advance the watermarks with
+        set_watermark(SYNC_CONVERSATION_MESSAGES, ...) once they are saved.
         """
+        if use_batch is None:
+            use_batch = self.use_batch
+        
         try:
             conversations = self.fetch_conversations(conversations_limit)
             result = {
@@ -1160,17 +2052,32 @@ class FacebookAPI:
                 'fetched_at': datetime.now().isoformat()
             }
             
+            watermarks = {}
+            if incremental:
+                watermarks = self.get_watermarks(SYNC_CONVERSATION_MESSAGES, [conv['id'] for conv in conversations])
+            
+            if use_batch:
+                message_pages = self.make_batch_request(
+                    [(f"{conv['id']}/messages", self._messages_params(messages_limit)) for conv in conversations],
+                    max_workers=self.max_workers
+                )
+                for conv, page in zip(conversations, message_pages):
+                    messages = list(self.iter_messages(conv['id'], messages_limit, first_page=page,
+                                                       since=watermarks.get(conv['id']))) if page else []
+                    result['conversations'].append({'conversation': conv, 'messages': messages})
+                    result['total_messages'] += len(messages)
+                
+                logger.info(f"Fetched {len(conversations)} conversations with {result['total_messages']} total messages (batch)")
+                return result
+            
             for conv in conversations:
-                messages = self.fetch_messages(conv['id'], messages_limit)
+                messages = self.fetch_messages(conv['id'], messages_limit, since=watermarks.get(conv['id']))
                 conv_data = {
                     'conversation': conv,
                     'messages': messages
                 }
                 result['conversations'].append(conv_data)
                 result['total_messages'] += len(messages)
-                
-                # Add a small delay to avoid rate limiting
-                time.sleep(0.1)
             
             logger.info(f"Fetched {len(conversations)} conversations with {result['total_messages']} total messages")
             return result
@@ -1181,27 +2088,35 @@ class FacebookAPI:
     
     def fetch_user_profile(self, user_id: str) -> Optional[Dict[str, any]]:
         """
-        Fetch user profile information
+        Fetch user profile information, served from the shared profile cache when possible
         """
-        try:
-            url = f"{self.base_url}/{user_id}"
+        from profile_resolver import get_profile_resolver
+        return get_profile_resolver().resolve([user_id], fb_api=self).get(user_id)
+
+    def fetch_user_profiles(self, user_ids: List[str]) -> Dict[str, Dict[str, any]]:
+        """
+        Fetch the profiles of many users from Graph with ?ids= lookups of up to
+        GRAPH_BATCH_LIMIT users each. Users whose profile could not be read
+        are missing from the result.
+        """
+        profiles = {}
+        user_ids = list(dict.fromkeys(user_ids))
+        for i in range(0, len(user_ids), GRAPH_BATCH_LIMIT):
+            chunk = user_ids[i:i + GRAPH_BATCH_LIMIT]
             params = {
-                'access_token': self.page_access_token,
+                'ids': ','.join(chunk),
                 'fields': 'name,first_name,last_name,profile_pic'
             }
-            
-            response = requests.get(url, params=params)
-            data = response.json()
-            
-            if response.status_code == 200:
-                return data
-            else:
-                logger.error(f"Error fetching user profile: {data}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Exception fetching user profile: {str(e)}")
-            return None
+            try:
+                profiles.update(self.graph_get('', params))
+            except GraphAPIError as e:
+                # One unreadable ID fails the whole lookup, so fall back to single lookups
+                logger.warning(f"Profile lookup for {len(chunk)} users failed ({e}), retrying one by one")
+                for user_id in chunk:
+                    data = self.make_api_request(user_id, {'fields': 'name,first_name,last_name,profile_pic'})
+                    if data:
+                        profiles[user_id] = data
+        return profiles
 
     # Your existing methods below...
     def send_message(self, recipient_id, message_text):
@@ -1223,7 +2138,7 @@ class FacebookAPI:
             }
             
             # Send request
-            response = requests.post(url, json=payload)
+            response = self._graph_request('POST', url, json=payload)
             result = response.json()
             
             if response.status_code == 200:
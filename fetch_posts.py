@@ -4,17 +4,20 @@ Main script to fetch posts from a Facebook page and store them in the database.
 """
 
 from fb_api import FacebookAPI
+from async_fb_api import SyncFacebookAPI
 import argparse
 
 def main():
     parser = argparse.ArgumentParser(description='Fetch posts from a Facebook Page')
     parser.add_argument('--limit', type=int, default=50, 
                        help='Maximum number of posts to fetch (default: 50)')
+    parser.add_argument('--use-async', action='store_true',
+                       help='Fetch through the asyncio ingestion engine')
     
     args = parser.parse_args()
     
     # Initialize Facebook API
-    fb_api = FacebookAPI()
+    fb_api = SyncFacebookAPI() if args.use_async else FacebookAPI()
     
     # Fetch and save posts
     saved_count = fb_api.fetch_and_save_posts(limit=args.limit)
@@ -12,6 +12,12 @@ def main():
                        help='Maximum number of posts to fetch (default: 50)')
     parser.add_argument('--comments-limit', type=int, default=100,
                        help='Maximum number of comments to fetch per post (default: 100)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Number of posts to fetch comments for in parallel (default: FACEBOOK_FETCH_WORKERS or 8)')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Only fetch posts and comments newer than the last sync')
+    parser.add_argument('--pipelined', action='store_true', default=None,
+                       help='Fetch, analyze and save posts concurrently (default: FACEBOOK_PIPELINED)')
     
     args = parser.parse_args()
     
@@ -21,7 +27,10 @@ def main():
     # Fetch and save posts with comments
     posts_saved, comments_saved = fb_api.fetch_and_save_posts_with_comments(
         posts_limit=args.posts_limit,
-        comments_per_post=args.comments_limit
+        comments_per_post=args.comments_limit,
+        max_workers=args.workers,
+        incremental=args.incremental,
+        pipelined=args.pipelined
     )
     
     print(f"Process completed. {posts_saved} posts and {comments_saved} comments were saved.")
@@ -0,0 +1,72 @@
+# http_client.py
+"""
+Process-wide pooled HTTP session for Graph API calls.
+
+Every FacebookAPI instance, Flask request and sync job in a process shares
+one requests.Session, so TCP and TLS connections to graph.facebook.com are
+kept alive and reused instead of being set up again for every call.
+"""
+
+import os
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class GraphHTTPSession(requests.Session):
+    def __init__(self, pool_size: int = 20, timeout: Tuple[float, float] = (5.0, 30.0)):
+        """
+        Initialize the session
+
+        Args:
+            pool_size (int): Maximum number of kept-alive connections per host
+            timeout (tuple): Default (connect, read) timeout in seconds
+        """
+        super().__init__()
+        self.timeout = timeout
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=False)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+        self.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request, applying the default timeout when none is given
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+_session: Optional[GraphHTTPSession] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> GraphHTTPSession:
+    """
+    Get the shared session, creating it on first use.
+
+    Pooled sockets must not be shared between processes, so a forked
+    worker process gets its own session.
+    """
+    global _session, _session_pid
+
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = GraphHTTPSession(
+                pool_size=int(os.getenv('FACEBOOK_HTTP_POOL_SIZE', '20')),
+                timeout=(
+                    float(os.getenv('FACEBOOK_HTTP_CONNECT_TIMEOUT', '5')),
+                    float(os.getenv('FACEBOOK_HTTP_READ_TIMEOUT', '30'))
+                )
+            )
+            _session_pid = os.getpid()
+        return _session
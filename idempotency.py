@@ -0,0 +1,138 @@
+# idempotency.py
+"""
+Deduplication of redelivered webhook events.
+
+Facebook delivers webhook events at least once, so the same message (same
+mid) or feed change can arrive several times. Each event gets an
+idempotency key, and keys of events that were handled are recorded in the
+processed_events table and in a bounded in-memory LRU set of recent keys.
+Duplicates are dropped when they are queued and again just before they
+would be handled, so a redelivery never triggers a second OpenAI call or a
+second reply. Copies of an event share its partition key, so one worker
+sees them one after the other and never handles two copies at once.
+
+Checks hit memory first; the table is only read for keys not seen
+recently (e.g. after a restart, or handled by another process).
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set
+
+from sqlalchemy import delete
+
+from bulk_ingest import existing_keys, insert_ignore
+from fb_api import content_hash
+from models import ProcessedEvent, Session
+
+logger = logging.getLogger('fb_api')
+
+
+def event_key(event_type: str, event: Dict) -> Optional[str]:
+    """
+    Idempotency key of a webhook event, or None for events that are not deduplicated
+    """
+    if event_type == 'messaging':
+        mid = (event.get('message') or {}).get('mid')
+        return f"mid:{mid}" if mid else None
+    if event_type == 'feed' and event.get('comment_id'):
+        # Changes carry no id of their own. A comment can be edited back to
+        # an earlier text, so an edit is told apart by when it was made too;
+        # edits without a time are never dropped.
+        verb = event.get('verb')
+        message_hash = content_hash(event.get('message'))[:16]
+        if verb == 'edited':
+            if event.get('created_time') is None:
+                return None
+            return f"feed:{verb}:{event['comment_id']}:{event['created_time']}:{message_hash}"
+        return f"feed:{verb}:{event['comment_id']}:{message_hash}"
+    return None
+
+
+class IdempotencyIndex:
+    def __init__(self, capacity: Optional[int] = None):
+        """
+        Initialize the index
+
+        Args:
+            capacity (int): Recent keys kept in memory (default: WEBHOOK_DEDUP_CACHE_SIZE or 10000)
+        """
+        self.capacity = capacity or int(os.getenv('WEBHOOK_DEDUP_CACHE_SIZE', '10000'))
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, keys: Iterable[str]):
+        with self._lock:
+            for key in keys:
+                self._recent[key] = True
+                self._recent.move_to_end(key)
+            while len(self._recent) > self.capacity:
+                self._recent.popitem(last=False)
+
+    def processed(self, keys: Iterable[str]) -> Set[str]:
+        """
+        The subset of keys whose events were already handled
+        """
+        keys = {key for key in keys if key}
+        with self._lock:
+            found = {key for key in keys if key in self._recent}
+        missing = keys - found
+        if missing:
+            session = Session()
+            try:
+                stored = existing_keys(session, ProcessedEvent.event_key, missing)
+            finally:
+                session.close()
+            self._remember(stored)
+            found |= stored
+        return found
+
+    def is_processed(self, key: Optional[str]) -> bool:
+        return bool(key) and key in self.processed([key])
+
+    def mark_processed(self, key: Optional[str], event_type: str):
+        """
+        Record that the event with this key was handled
+        """
+        if not key:
+            return
+        session = Session()
+        try:
+            insert_ignore(session, ProcessedEvent, [{'event_key': key, 'event_type': event_type,
+                                                     'processed_at': datetime.now()}], ['event_key'])
+            session.commit()
+        finally:
+            session.close()
+        self._remember([key])
+
+
+def prune_processed(max_age_days: float) -> int:
+    """
+    Forget keys older than max_age_days; Facebook stops redelivering long before
+    """
+    session = Session()
+    try:
+        deleted = session.execute(delete(ProcessedEvent).where(
+            ProcessedEvent.processed_at < datetime.now() - timedelta(days=max_age_days))).rowcount
+        session.commit()
+        return deleted
+    finally:
+        session.close()
+
+
+_index: Optional[IdempotencyIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_idempotency_index() -> IdempotencyIndex:
+    """
+    Get the process-wide index, so every worker shares one cache
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IdempotencyIndex()
+        return _index
@@ -0,0 +1,261 @@
+# ingest_pipeline.py
+"""
+Pipelined ingestion of posts with comments.
+
+Fetching, parsing, sentiment/keyword analysis and database writes run as
+concurrent stages connected by bounded queues:
+
+    fetch -> parse (N threads) -> analyze (M threads) -> batched writer
+
+While the writer is committing one batch, the analyzers work on the next
+posts and the fetcher is already downloading the following page, so a sync
+takes roughly as long as its slowest stage instead of the sum of all of
+them. A full queue blocks the stage feeding it, which keeps memory bounded
+when one stage falls behind.
+"""
+
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+from fb_api import to_utc_naive
+from models import Session
+
+logger = logging.getLogger('fb_api')
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class IngestPipeline:
+    def __init__(self, api, parse_workers: Optional[int] = None, analyze_workers: Optional[int] = None,
+                 queue_size: Optional[int] = None, batch_size: Optional[int] = None):
+        """
+        Initialize the pipeline
+
+        Args:
+            api (FacebookAPI): Client used to parse, analyze and save posts
+            parse_workers (int): Threads parsing raw posts (default: FACEBOOK_PIPELINE_PARSE_WORKERS or 1)
+            analyze_workers (int): Threads running sentiment and keyword analysis
+                (default: FACEBOOK_PIPELINE_ANALYZE_WORKERS or 2)
+            queue_size (int): Capacity of each queue between stages
+                (default: FACEBOOK_PIPELINE_QUEUE_SIZE or 100)
+            batch_size (int): Posts written per database transaction (default: api.save_batch_size)
+        """
+        self.api = api
+        self.parse_workers = parse_workers or int(os.getenv('FACEBOOK_PIPELINE_PARSE_WORKERS', '1'))
+        self.analyze_workers = analyze_workers or int(os.getenv('FACEBOOK_PIPELINE_ANALYZE_WORKERS', '2'))
+        self.queue_size = queue_size or int(os.getenv('FACEBOOK_PIPELINE_QUEUE_SIZE', '100'))
+        self.batch_size = batch_size or api.save_batch_size
+
+        self._expected_posts = None
+        self._error = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stage_seconds = {}
+        self._reset()
+
+    def _reset(self):
+        self.posts_saved = 0
+        self.comments_saved = 0
+        self.newest_post_time = None
+        self.failed = False
+        self._error = None
+        self._stop.clear()
+        self._stage_seconds = {'fetch': 0.0, 'parse': 0.0, 'analyze': 0.0, 'write': 0.0}
+
+    def _put(self, out_q: queue.Queue, item) -> bool:
+        """
+        Put an item on a queue, blocking while it is full unless the pipeline is stopping
+        """
+        while not self._stop.is_set():
+            try:
+                out_q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _busy(self, stage: str, seconds: float):
+        with self._lock:
+            self._stage_seconds[stage] += seconds
+
+    def _fetch(self, raw_posts: Iterable[Dict], out_q: queue.Queue, consumers: int):
+        """
+        Stage 1: pull raw posts from the API iterator
+        """
+        posts = iter(raw_posts)
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    raw_post = next(posts)
+                except StopIteration:
+                    break
+                finally:
+                    self._busy('fetch', time.perf_counter() - start)
+                self._put(out_q, raw_post)
+        except Exception as e:
+            # Posts after the failure were never seen, so the sync is incomplete
+            self.failed = True
+            logger.error(f"Fetch stage failed: {e}")
+        finally:
+            if self._stop.is_set() and hasattr(posts, 'close'):
+                # Stop the API iterator's own fetch workers too
+                posts.close()
+            for _ in range(consumers):
+                self._put(out_q, _DONE)
+
+    def _transform(self, stage: str, func: Callable[[Dict], Optional[Dict]], in_q: queue.Queue,
+                   out_q: queue.Queue, remaining: Dict[str, int], consumers: int):
+        """
+        Stages 2 and 3: apply func to every item; the last worker to finish
+        passes the end marker on to each consumer of the next stage
+        """
+        while True:
+            try:
+                item = in_q.get(timeout=0.5)
+            except queue.Empty:
+                # A stopped writer means no end marker may ever arrive
+                if self._stop.is_set():
+                    break
+                continue
+            if item is _DONE:
+                break
+            start = time.perf_counter()
+            try:
+                result = func(item)
+            except Exception as e:
+                logger.error(f"{stage} stage failed on a post: {e}")
+                result = None
+            self._busy(stage, time.perf_counter() - start)
+            if result is not None:
+                self._put(out_q, result)
+
+        with self._lock:
+            remaining[stage] -= 1
+            last = remaining[stage] == 0
+        if last:
+            for _ in range(consumers):
+                self._put(out_q, _DONE)
+
+    def _write(self, in_q: queue.Queue):
+        """
+        Stage 4: save analyzed posts in batches on the writer's own session
+        """
+        writer = copy.copy(self.api)
+        writer.session = Session()
+        pending = []
+
+        def flush():
+            start = time.perf_counter()
+            try:
+                saved, comments_saved = writer.bulk_save_posts_with_comments(pending)
+                self.posts_saved += saved
+                self.comments_saved += comments_saved
+                print(f"Saved {saved} posts with {comments_saved} new comments")
+            except Exception as e:
+                self.failed = True
+                print(f"Error saving batch of {len(pending)} posts: {e}")
+            self._busy('write', time.perf_counter() - start)
+            pending.clear()
+            self.api._report_sync_progress(self.posts_saved, self.comments_saved,
+                                           self._expected_posts or self.posts_saved)
+
+        try:
+            while True:
+                try:
+                    item = in_q.get(timeout=1.0)
+                except queue.Empty:
+                    # Upstream is slow; don't hold finished posts back
+                    if pending:
+                        flush()
+                    continue
+                if item is _DONE:
+                    break
+                if item.get('comments_error'):
+                    self.failed = True
+                pending.append(item)
+                post_time = to_utc_naive(item['created_time'])
+                if self.newest_post_time is None or post_time > self.newest_post_time:
+                    self.newest_post_time = post_time
+                if len(pending) >= self.batch_size:
+                    flush()
+            if pending:
+                flush()
+        except Exception as e:
+            # Also raised by the progress callback to cancel the sync
+            # (JobCancelled, SyncStopped); run() re-raises it
+            self.failed = True
+            self._error = e
+            logger.error(f"Write stage stopped: {e!r}")
+            # Let blocked upstream stages exit
+            self._stop.set()
+        finally:
+            writer.session.close()
+
+    def run(self, raw_posts: Iterable[Dict], expected_posts: Optional[int] = None) -> Dict:
+        """
+        Run raw posts through every stage and wait for the writer to finish.
+
+        After each batch the writer reports progress through the API's
+        progress callback, relative to expected_posts if given.
+
+        An exception that stopped the writer, including one raised by the
+        progress callback to cancel the sync, is re-raised once every stage
+        has exited.
+
+        Returns a dict with posts_saved, comments_saved, newest_post_time,
+        failed (True if any post may not have been saved) and the busy
+        seconds of each stage.
+        """
+        self._reset()
+        self._expected_posts = expected_posts
+
+        raw_q = queue.Queue(maxsize=self.queue_size)
+        parsed_q = queue.Queue(maxsize=self.queue_size)
+        analyzed_q = queue.Queue(maxsize=self.queue_size)
+        remaining = {'parse': self.parse_workers, 'analyze': self.analyze_workers}
+
+        threads = [threading.Thread(target=self._fetch, args=(raw_posts, raw_q, self.parse_workers),
+                                    name='ingest-fetch', daemon=True)]
+        threads += [
+            threading.Thread(target=self._transform,
+                             args=('parse', self.api.parse_post_with_comments_data, raw_q, parsed_q,
+                                   remaining, self.analyze_workers),
+                             name=f'ingest-parse-{i}', daemon=True)
+            for i in range(self.parse_workers)
+        ]
+        threads += [
+            threading.Thread(target=self._transform,
+                             args=('analyze', self.api.analyze_post_with_comments, parsed_q, analyzed_q,
+                                   remaining, 1),
+                             name=f'ingest-analyze-{i}', daemon=True)
+            for i in range(self.analyze_workers)
+        ]
+        threads.append(threading.Thread(target=self._write, args=(analyzed_q,), name='ingest-write', daemon=True))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        stages = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in self._stage_seconds.items())
+        logger.info(f"Pipeline finished in {elapsed:.1f}s (busy time: {stages})")
+        if self._error is not None:
+            raise self._error
+
+        return {
+            'posts_saved': self.posts_saved,
+            'comments_saved': self.comments_saved,
+            'newest_post_time': self.newest_post_time,
+            'failed': self.failed,
+            'elapsed': elapsed,
+            'stage_seconds': dict(self._stage_seconds)
+        }
@@ -0,0 +1,421 @@
+# job_runner.py
+"""
+Persistent background jobs for sync work.
+
+Web routes enqueue a SyncJob row and return immediately; worker processes
+(python job_runner.py --workers N), or the worker thread embedded in the
+Flask app, claim queued jobs one at a time and run them. A job reports
+progress through the same (percent, message) callback FacebookAPI already
+uses, published to the job's progress channel (progress_channel.py), and
+each progress update doubles as a heartbeat and a cancellation check.
+Enqueueing a job identical to one that is still queued or running returns
+the existing job instead of starting a second sync; a unique index on the
+active_key of queued and running jobs keeps two concurrent requests from
+both inserting one. While a job runs, a heartbeat thread also refreshes
+its heartbeat, so a sync paused for a long time (e.g. waiting out a Graph
+rate-limit block) is not taken for a dead worker's job and run twice.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from models import Session, SyncJob
+from progress_channel import ProgressTracker, prune_events
+
+logger = logging.getLogger('fb_api')
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# job_type -> handler(context, **params) returning a JSON-serialisable result
+JOB_HANDLERS: Dict[str, Callable] = {}
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job once cancellation has been requested
+    """
+
+
+def register_job(job_type: str):
+    """
+    Decorator registering a handler for a job type
+    """
+    def decorator(func):
+        JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def dedup_key(job_type: str, params: Dict) -> str:
+    return f"{job_type}:{json.dumps(params, sort_keys=True)}"
+
+
+def enqueue_job(job_type: str, params: Optional[Dict] = None) -> Tuple[int, bool]:
+    """
+    Queue a job unless an identical one is already queued or running.
+
+    Returns (job id, True if a new job was created).
+    """
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+    params = params or {}
+    key = dedup_key(job_type, params)
+
+    session = Session()
+    try:
+        def active_job_id():
+            return session.query(SyncJob.id).filter(SyncJob.dedup_key == key,
+                                                    SyncJob.status.in_(ACTIVE_STATUSES)).limit(1).scalar()
+
+        existing = active_job_id()
+        if existing:
+            return existing, False
+
+        job = SyncJob(job_type=job_type, params=json.dumps(params), dedup_key=key, active_key=key,
+                      status='queued')
+        session.add(job)
+        try:
+            session.commit()
+        except IntegrityError:
+            # A concurrent request queued the same job between our check and insert
+            session.rollback()
+            existing = active_job_id()
+            if existing is None:
+                raise
+            return existing, False
+        logger.info(f"Queued {job_type} job {job.id}")
+        return job.id, True
+    finally:
+        session.close()
+
+
+def get_job(job_id: int) -> Optional[Dict]:
+    session = Session()
+    try:
+        job = session.get(SyncJob, job_id)
+        return job.to_dict() if job else None
+    finally:
+        session.close()
+
+
+def cancel_job(job_id: int) -> bool:
+    """
+    Cancel a queued job right away, or ask a running job to stop at its
+    next progress update. Returns False if the job had already finished.
+    """
+    session = Session()
+    try:
+        now = datetime.now()
+        cancelled = session.execute(
+            update(SyncJob).where(SyncJob.id == job_id, SyncJob.status == 'queued')
+            .values(status='cancelled', cancel_requested=True, finished_at=now, active_key=None)
+        ).rowcount
+        if not cancelled:
+            cancelled = session.execute(
+                update(SyncJob).where(SyncJob.id == job_id, SyncJob.status == 'running')
+                .values(cancel_requested=True)
+            ).rowcount
+        session.commit()
+        return bool(cancelled)
+    finally:
+        session.close()
+
+
+def requeue_stale_jobs(timeout: float) -> int:
+    """
+    Put running jobs whose worker stopped sending heartbeats back in the queue
+    """
+    session = Session()
+    try:
+        stale_before = datetime.now() - timedelta(seconds=timeout)
+        requeued = session.execute(
+            update(SyncJob).where(SyncJob.status == 'running', SyncJob.heartbeat_at < stale_before)
+            .values(status='queued', worker_id=None)
+        ).rowcount
+        session.commit()
+        if requeued:
+            logger.warning(f"Requeued {requeued} jobs whose worker stopped responding")
+        return requeued
+    finally:
+        session.close()
+
+
+class JobContext:
+    def __init__(self, job_id: int, heartbeat_interval: float = 1.0, expected_items: Optional[int] = None):
+        """
+        Initialize the context handed to a running job
+
+        Args:
+            job_id (int): The job being run
+            heartbeat_interval (float): Least seconds between two progress writes
+            expected_items (int): Items the job expects to process, for the ETA
+        """
+        self.job_id = job_id
+        self.heartbeat_interval = heartbeat_interval
+        self.tracker = ProgressTracker(job_id, expected_items)
+        self.cancelled = False
+        self.last_counts = {}
+        self._last_write = 0.0
+
+    def update_progress(self, progress: Optional[float], message: str = '', **counts):
+        """
+        Record progress and publish it to the job's channel; raises
+        JobCancelled if the job was cancelled.
+
+        Matches FacebookAPI's progress callback signature, so it can be
+        passed to set_progress_callback directly. counts (e.g. posts=,
+        comments=) are published with throughput and ETA.
+        """
+        if counts:
+            self.last_counts = counts
+        now = time.monotonic()
+        if progress is not None and progress < 100 and now - self._last_write < self.heartbeat_interval:
+            return
+        self._last_write = now
+
+        session = Session()
+        try:
+            values = {'progress_message': message[:500], 'heartbeat_at': datetime.now()}
+            if progress is not None:
+                values['progress'] = float(progress)
+            session.execute(update(SyncJob).where(SyncJob.id == self.job_id).values(**values))
+            self.tracker.publish(progress, message, session=session, **self.last_counts)
+            cancel_requested = session.query(SyncJob.cancel_requested).filter(
+                SyncJob.id == self.job_id).scalar()
+        finally:
+            session.close()
+
+        if cancel_requested:
+            self.cancelled = True
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+
+class JobWorker:
+    def __init__(self, worker_id: Optional[str] = None, poll_interval: Optional[float] = None,
+                 stale_timeout: Optional[float] = None, heartbeat_interval: Optional[float] = None):
+        """
+        Initialize the worker
+
+        Args:
+            worker_id (str): Name recorded on claimed jobs (default: host:pid:thread)
+            poll_interval (float): Seconds to wait when the queue is empty
+                (default: SYNC_JOB_POLL_INTERVAL or 2)
+            stale_timeout (float): Seconds without heartbeat after which a running job
+                is requeued (default: SYNC_JOB_STALE_TIMEOUT or 600)
+            heartbeat_interval (float): Seconds between heartbeats of a running job
+                (default: SYNC_JOB_HEARTBEAT_INTERVAL or 30)
+        """
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.poll_interval = poll_interval or float(os.getenv('SYNC_JOB_POLL_INTERVAL', '2'))
+        self.stale_timeout = stale_timeout or float(os.getenv('SYNC_JOB_STALE_TIMEOUT', '600'))
+        self.heartbeat_interval = heartbeat_interval or float(os.getenv('SYNC_JOB_HEARTBEAT_INTERVAL', '30'))
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def claim_next_job(self) -> Optional[SyncJob]:
+        """
+        Atomically take the oldest queued job; only one worker can win the
+        status='queued' -> 'running' update for a given job
+        """
+        session = Session()
+        try:
+            candidates = session.query(SyncJob.id).filter(SyncJob.status == 'queued')\
+                .order_by(SyncJob.created_at, SyncJob.id).limit(5).all()
+            for (job_id,) in candidates:
+                now = datetime.now()
+                claimed = session.execute(
+                    update(SyncJob).where(SyncJob.id == job_id, SyncJob.status == 'queued')
+                    .values(status='running', worker_id=self.worker_id, started_at=now, heartbeat_at=now)
+                ).rowcount
+                session.commit()
+                if claimed:
+                    job = session.get(SyncJob, job_id)
+                    session.expunge(job)
+                    return job
+            return None
+        finally:
+            session.close()
+
+    def _finish(self, context: 'JobContext', status: str, result=None, error: Optional[str] = None):
+        session = Session()
+        try:
+            values = {'status': status, 'finished_at': datetime.now(), 'error': error, 'active_key': None}
+            if result is not None:
+                values['result'] = json.dumps(result, default=str)
+            if status == 'succeeded':
+                values['progress'] = 100.0
+            session.execute(update(SyncJob).where(SyncJob.id == context.job_id).values(**values))
+            # The final event is committed with the status so tailing readers see both
+            message = f"Job {status}" + (f": {error.strip().splitlines()[-1]}" if error else '')
+            context.tracker.publish(values.get('progress'), message, status=status, session=session,
+                                    **context.last_counts)
+        finally:
+            session.close()
+
+    def _heartbeat(self, job_id: int, done: threading.Event):
+        """
+        Keep a running job's heartbeat fresh until done is set, even while
+        the job is blocked between progress updates
+        """
+        while not done.wait(self.heartbeat_interval):
+            session = Session()
+            try:
+                session.execute(update(SyncJob).where(SyncJob.id == job_id, SyncJob.status == 'running',
+                                                      SyncJob.worker_id == self.worker_id)
+                                .values(heartbeat_at=datetime.now()))
+                session.commit()
+            except Exception as e:
+                logger.warning(f"Could not record heartbeat of job {job_id}: {e}")
+            finally:
+                session.close()
+
+    def run_job(self, job: SyncJob):
+        params = json.loads(job.params or '{}')
+        context = JobContext(job.id, expected_items=params.get('posts_limit') or params.get('conversations_limit'))
+        handler = JOB_HANDLERS.get(job.job_type)
+        if handler is None:
+            self._finish(context, 'failed', error=f"Unknown job type: {job.job_type}")
+            return
+
+        logger.info(f"Worker {self.worker_id} running {job.job_type} job {job.id}")
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job.id, done), name=f'sync-job-heartbeat-{job.id}',
+                         daemon=True).start()
+        try:
+            context.tracker.publish(0, f"Started {job.job_type}")
+            result = handler(context, **params)
+            if context.cancelled:
+                self._finish(context, 'cancelled', result=result)
+            else:
+                self._finish(context, 'succeeded', result=result)
+        except JobCancelled:
+            logger.info(f"Job {job.id} cancelled")
+            self._finish(context, 'cancelled')
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            self._finish(context, 'failed', error=traceback.format_exc())
+        finally:
+            done.set()
+
+    def run(self):
+        """
+        Claim and run jobs until stop() is called
+        """
+        logger.info(f"Job worker {self.worker_id} started")
+        last_prune = 0.0
+        while not self._stop.is_set():
+            try:
+                requeue_stale_jobs(self.stale_timeout)
+                if time.monotonic() - last_prune > 3600:
+                    prune_events(float(os.getenv('SYNC_JOB_EVENT_RETENTION_DAYS', '7')))
+                    last_prune = time.monotonic()
+                job = self.claim_next_job()
+            except Exception as e:
+                logger.error(f"Job worker {self.worker_id} could not poll the queue: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+        logger.info(f"Job worker {self.worker_id} stopped")
+
+
+@register_job('fetch_posts')
+def run_fetch_posts(context: JobContext, posts_limit: int = 100, comments_per_post: int = 100,
+                    incremental: bool = True, page_id: Optional[str] = None):
+    from page_registry import api_for_page
+
+    fb_api = api_for_page(page_id)
+    fb_api.set_progress_callback(context.update_progress)
+    try:
+        posts_saved, comments_saved = fb_api.fetch_and_save_posts_with_comments(
+            posts_limit=posts_limit, comments_per_post=comments_per_post, incremental=incremental)
+        replies_saved = 0
+        if fb_api.sync_replies:
+            # Incremental syncs only read comments past each post's watermark;
+            # pick up new replies to the older ones as well
+            replies_saved = fb_api.sync_comment_replies(
+                comments_limit=int(os.getenv('SYNC_REPLY_WINDOW_COMMENTS', '200')))
+        return {'posts_saved': posts_saved, 'comments_saved': comments_saved, 'replies_saved': replies_saved,
+                'failed_requests': len(fb_api.failed_requests)}
+    finally:
+        fb_api.session.close()
+
+
+@register_job('fetch_messages')
+def run_fetch_messages(context: JobContext, conversations_limit: Optional[int] = None,
+                       page_id: Optional[str] = None):
+    from conversation_sync import ConversationSync
+    from page_registry import api_for_page
+
+    fb_api = api_for_page(page_id)
+    fb_api.set_progress_callback(context.update_progress)
+    try:
+        return ConversationSync(fb_api).run(conversations_limit)
+    finally:
+        fb_api.session.close()
+
+
+_embedded_worker: Optional[JobWorker] = None
+
+
+def start_embedded_worker() -> JobWorker:
+    """
+    Run one worker on a daemon thread of the current process (used by the
+    Flask app so jobs run even when no separate worker is started)
+    """
+    global _embedded_worker
+    if _embedded_worker is None:
+        _embedded_worker = JobWorker()
+        threading.Thread(target=_embedded_worker.run, name='sync-job-worker', daemon=True).start()
+    return _embedded_worker
+
+
+def _worker_process():
+    worker = JobWorker()
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run background sync job workers')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SYNC_JOB_WORKERS', '2')),
+                        help='Number of worker processes (default: SYNC_JOB_WORKERS or 2)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s: %(message)s')
+
+    # Spawned processes open their own database connections and HTTP pools
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_worker_process, name=f'sync-worker-{i}') for i in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    def shutdown(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
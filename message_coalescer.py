@@ -0,0 +1,92 @@
+# message_coalescer.py
+"""
+Coalescing of Messenger message bursts into a single reply.
+
+People often send a few short messages in a row. Instead of answering each
+one, every incoming message is saved right away and added to the pending
+reply of its conversation: a deferred 'messaging_reply' webhook event that
+becomes due WEBHOOK_COALESCE_WINDOW seconds after the latest message. Each
+new message in the window pushes the reply back (but never more than
+WEBHOOK_COALESCE_MAX_WAIT seconds after the first one), and the reply event
+then answers all its messages with one OpenAI call and one send.
+
+Message and reply events of a conversation share its partition, so they are
+handled by one worker thread and the pending reply can be extended without
+racing its own execution. WEBHOOK_COALESCE_WINDOW=0 answers every message
+on its own, as soon as it is saved.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from models import Message, MessageResponse, Session, WebhookEvent
+from webhook_queue import enqueue_events
+
+logger = logging.getLogger('fb_api')
+
+REPLY_EVENT = 'messaging_reply'
+
+
+class MessageCoalescer:
+    def __init__(self, window: Optional[float] = None, max_wait: Optional[float] = None):
+        """
+        Initialize the coalescer
+
+        Args:
+            window (float): Seconds of quiet after the latest message before replying
+                (default: WEBHOOK_COALESCE_WINDOW or 3)
+            max_wait (float): Most seconds a reply waits after the first message of a burst
+                (default: WEBHOOK_COALESCE_MAX_WAIT or 15)
+        """
+        self.window = float(os.getenv('WEBHOOK_COALESCE_WINDOW', '3')) if window is None else window
+        self.max_wait = float(os.getenv('WEBHOOK_COALESCE_MAX_WAIT', '15')) if max_wait is None else max_wait
+
+    def add_message(self, page_id: Optional[str], sender_id: str, recipient_id: str, message_id: str) -> int:
+        """
+        Add a saved incoming message to its conversation's pending reply,
+        queueing a new reply if none is pending. Returns the reply event id.
+        """
+        now = datetime.now()
+        session = Session()
+        try:
+            pending = session.query(WebhookEvent).filter(
+                WebhookEvent.event_type == REPLY_EVENT, WebhookEvent.partition_key == sender_id,
+                WebhookEvent.status == 'queued').order_by(WebhookEvent.id.desc()).first()
+            if pending is not None:
+                payload = json.loads(pending.payload)
+                if message_id not in payload['message_ids']:
+                    payload['message_ids'].append(message_id)
+                pending.payload = json.dumps(payload)
+                pending.available_at = min(now + timedelta(seconds=self.window),
+                                           pending.created_at + timedelta(seconds=self.max_wait))
+                session.commit()
+                logger.info(f"Coalesced message {message_id} into the pending reply to {sender_id} "
+                            f"({len(payload['message_ids'])} messages)")
+                return pending.id
+        finally:
+            session.close()
+
+        payload = {'sender_id': sender_id, 'recipient_id': recipient_id, 'message_ids': [message_id]}
+        return enqueue_events([(REPLY_EVENT, page_id, sender_id, payload)],
+                              available_at=now + timedelta(seconds=self.window))[0]
+
+
+def combined_text(messages: List) -> str:
+    """
+    The texts of a burst of messages as one message to answer
+    """
+    return "\n".join(message.message_text for message in messages if message.message_text)
+
+
+def reply_payload_messages(session, payload: Dict) -> List:
+    """
+    The messages of a reply event that have no response yet, oldest first
+    """
+    answered = {message_id for (message_id,) in session.query(MessageResponse.message_id).filter(
+        MessageResponse.message_id.in_(payload['message_ids']))}
+    return session.query(Message).filter(
+        Message.message_id.in_([message_id for message_id in payload['message_ids'] if message_id not in answered])
+    ).order_by(Message.created_time, Message.id).all()
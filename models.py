@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Text, JSON
+from sqlalchemy import Boolean, create_engine, Column, Integer, String, DateTime, Float, ForeignKey, Text, JSON, UniqueConstraint, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime
@@ -26,6 +26,7 @@ class Post(Base):
     created_time = Column(DateTime, nullable=False)
     avg_sentiment = Column(Float, default=0.0)
     trending_topics = Column(String(500))
+    content_hash = Column(String(64))                   # sha256 of the message, see reconcile.py
     
     # Relationship to comments
     comments = relationship("Comment", backref="post_rel", lazy="select")
@@ -57,6 +58,7 @@ class Comment(Base):
     sentiment_category = Column(String(20), default='neutral')
     user_name = Column(String(200))
     keywords = Column(String(500))
+    content_hash = Column(String(64))                   # sha256 of the message, see reconcile.py
     
     # New fields for auto-reply
     ai_responded = Column(Boolean, default=False)
@@ -102,6 +104,7 @@ class Message(Base):
     message_text = Column(String(1000))
     created_time = Column(DateTime, nullable=False)
     has_attachments = Column(Boolean, default=False)
+    is_ai_generated = Column(Boolean, default=False)    # replies sent by the webhook auto-responder
     
     # Relationship to conversation
     conversation = relationship("Conversation", back_populates="messages")
@@ -201,4 +204,152 @@ class MessageResponse(Base):
     message = relationship("Message", backref="ai_responses")
     
     def __repr__(self):
-        return f"<MessageResponse(id={self.id}, message_id='{self.message_id}')>"
\ No newline at end of file
+        return f"<MessageResponse(id={self.id}, message_id='{self.message_id}')>"
+
+class SyncState(Base):
+    __tablename__ = 'sync_state'
+    
+    id = Column(Integer, primary_key=True)
+    resource_type = Column(String(50), nullable=False)   # 'page_posts', 'post_comments', 'conversation_messages'
+    resource_id = Column(String(100), nullable=False)    # page, post or conversation ID
+    last_seen_time = Column(DateTime, nullable=True)     # newest created/updated time ingested (UTC)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (UniqueConstraint('resource_type', 'resource_id', name='uq_sync_state_resource'),)
+    
+    def __repr__(self):
+        return f"<SyncState(resource_type='{self.resource_type}', resource_id='{self.resource_id}', last_seen_time='{self.last_seen_time}')>"
+
+class FacebookPage(Base):
+    __tablename__ = 'facebook_pages'
+    
+    id = Column(Integer, primary_key=True)
+    page_id = Column(String(100), unique=True, nullable=False)
+    name = Column(String(200))
+    access_token = Column(Text, nullable=False)         # page access token used for this page's syncs
+    enabled = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    def __repr__(self):
+        return f"<FacebookPage(page_id='{self.page_id}', name='{self.name}', enabled={self.enabled})>"
+
+class UserProfile(Base):
+    __tablename__ = 'user_profiles'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String(100), unique=True, nullable=False)  # page-scoped user ID
+    name = Column(String(200))
+    first_name = Column(String(100))
+    last_name = Column(String(100))
+    profile_pic = Column(Text)
+    fetched_at = Column(DateTime, default=datetime.now, nullable=False)
+    
+    def __repr__(self):
+        return f"<UserProfile(user_id='{self.user_id}', name='{self.name}')>"
+
+class SyncJob(Base):
+    __tablename__ = 'sync_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    job_type = Column(String(50), nullable=False)        # 'fetch_posts', 'fetch_messages'
+    params = Column(Text, default='{}')                  # JSON keyword arguments for the job handler
+    dedup_key = Column(String(500), nullable=False)      # job_type + params; one active job per key
+    active_key = Column(String(500))                     # dedup_key while queued or running, NULL after; unique
+    status = Column(String(20), default='queued', nullable=False)  # queued, running, succeeded, failed, cancelled
+    progress = Column(Float, default=0.0)                # percent complete
+    progress_message = Column(String(500))
+    result = Column(Text)                                # JSON result of a finished job
+    error = Column(Text)
+    cancel_requested = Column(Boolean, default=False)
+    worker_id = Column(String(100))
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (Index('ix_sync_jobs_status_created', 'status', 'created_at'),
+                      Index('ix_sync_jobs_dedup_status', 'dedup_key', 'status'),
+                      Index('uq_sync_jobs_active_key', 'active_key', unique=True))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'params': json.loads(self.params or '{}'),
+            'status': self.status,
+            'progress': self.progress,
+            'progress_message': self.progress_message,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f"<SyncJob(id={self.id}, job_type='{self.job_type}', status='{self.status}')>"
+
+class SyncJobEvent(Base):
+    __tablename__ = 'sync_job_events'
+    
+    id = Column(Integer, primary_key=True)             # increasing; doubles as the SSE event id
+    job_id = Column(Integer, ForeignKey('sync_jobs.id'), nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+    status = Column(String(20))                         # job status when the event was published
+    progress = Column(Float)                            # percent complete, if known
+    message = Column(String(500))
+    data = Column(Text)                                 # JSON counts, throughput and ETA
+    
+    def to_dict(self):
+        event = json.loads(self.data) if self.data else {}
+        event.update({
+            'id': self.id,
+            'job_id': self.job_id,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        })
+        return event
+    
+    def __repr__(self):
+        return f"<SyncJobEvent(id={self.id}, job_id={self.job_id}, progress={self.progress})>"
+
+
+class WebhookEvent(Base):
+    __tablename__ = 'webhook_events'
+    
+    id = Column(Integer, primary_key=True)             # increasing; events of a partition run in id order
+    event_type = Column(String(50), nullable=False)     # 'messaging'
+    page_id = Column(String(100))
+    partition_key = Column(String(100), nullable=False) # sender id; events with the same key never run concurrently
+    partition = Column(Integer, nullable=False)         # stable hash of partition_key, owned by one worker thread
+    payload = Column(Text, nullable=False)              # JSON of the webhook event
+    dedup_key = Column(String(200))                     # idempotency key, see idempotency.py
+    status = Column(String(20), default='queued', nullable=False)  # queued, processing, done, duplicate, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    error = Column(Text)
+    worker_id = Column(String(100))
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    available_at = Column(DateTime, nullable=True)      # not handled before this time (deferred replies)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (Index('ix_webhook_events_status_partition', 'status', 'partition', 'id'),)
+    
+    def __repr__(self):
+        return f"<WebhookEvent(id={self.id}, event_type='{self.event_type}', status='{self.status}')>"
+
+
+class ProcessedEvent(Base):
+    __tablename__ = 'processed_events'
+    
+    id = Column(Integer, primary_key=True)
+    event_key = Column(String(200), unique=True, nullable=False)  # e.g. 'mid:<message id>'
+    event_type = Column(String(50), nullable=False)
+    processed_at = Column(DateTime, default=datetime.now, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<ProcessedEvent(event_key='{self.event_key}')>"
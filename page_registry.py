@@ -0,0 +1,166 @@
+# page_registry.py
+"""
+Registry of the Facebook pages we sync.
+
+Each page is a facebook_pages row with its own access token. FacebookAPI
+clients built through api_for_page use that token, a rate limit bucket of
+their own and the page's own sync_state watermarks. The page configured
+through FACEBOOK_PAGE_ID / FACEBOOK_PAGE_ACCESS_TOKEN keeps working
+without being registered.
+
+Manage pages with:
+    python page_registry.py add <page_id> [--name NAME] [--token-env VAR]
+    python page_registry.py disable <page_id>
+    python page_registry.py list
+"""
+
+import argparse
+import getpass
+import logging
+import os
+import sys
+import zlib
+from typing import List, Optional
+
+from models import FacebookPage, Session
+
+logger = logging.getLogger('fb_api')
+
+
+def register_page(page_id: str, access_token: str, name: Optional[str] = None, enabled: bool = True) -> FacebookPage:
+    """
+    Add a page to the registry, or update its token, name and status
+    """
+    session = Session()
+    try:
+        page = session.query(FacebookPage).filter_by(page_id=page_id).first()
+        if page is None:
+            page = FacebookPage(page_id=page_id)
+            session.add(page)
+        page.access_token = access_token
+        page.enabled = enabled
+        if name is not None:
+            page.name = name
+        session.commit()
+        session.refresh(page)
+        session.expunge(page)
+        logger.info(f"Registered page {page_id}")
+        return page
+    finally:
+        session.close()
+
+
+def set_page_enabled(page_id: str, enabled: bool) -> bool:
+    """
+    Enable or disable syncing of a registered page. Returns False if it is not registered.
+    """
+    session = Session()
+    try:
+        updated = session.query(FacebookPage).filter_by(page_id=page_id).update({'enabled': enabled})
+        session.commit()
+        return bool(updated)
+    finally:
+        session.close()
+
+
+def list_pages(enabled_only: bool = True) -> List[FacebookPage]:
+    """
+    Registered pages, detached from their session
+    """
+    session = Session()
+    try:
+        query = session.query(FacebookPage)
+        if enabled_only:
+            query = query.filter(FacebookPage.enabled.is_(True))
+        pages = query.order_by(FacebookPage.page_id).all()
+        for page in pages:
+            session.expunge(page)
+        return pages
+    finally:
+        session.close()
+
+
+def api_for_page(page_id: Optional[str] = None, api_class=None):
+    """
+    FacebookAPI (or api_class) client for a registered page.
+
+    Without page_id, or for the FACEBOOK_PAGE_ID page when it is not
+    registered, the client is configured from the environment.
+    """
+    if api_class is None:
+        from fb_api import FacebookAPI
+        api_class = FacebookAPI
+    if page_id is None:
+        return api_class()
+
+    session = Session()
+    try:
+        page = session.query(FacebookPage).filter_by(page_id=page_id).first()
+    finally:
+        session.close()
+    if page is not None:
+        return api_class(page_id=page.page_id, access_token=page.access_token)
+    if page_id == os.getenv('FACEBOOK_PAGE_ID'):
+        return api_class()
+    raise ValueError(f"Page {page_id} is not registered")
+
+
+def shard_of(page_id: str, shard_count: int) -> int:
+    """
+    Stable shard a page belongs to; the same on every host and process
+    """
+    return zlib.crc32(page_id.encode('utf-8')) % max(shard_count, 1)
+
+
+def pages_for_shard(shard: int, shard_count: int, include_env_page: bool = True) -> List[str]:
+    """
+    IDs of the enabled pages assigned to a shard
+    """
+    page_ids = [page.page_id for page in list_pages()]
+    env_page = os.getenv('FACEBOOK_PAGE_ID')
+    if include_env_page and env_page and env_page not in page_ids:
+        page_ids.append(env_page)
+    return [page_id for page_id in page_ids if shard_of(page_id, shard_count) == shard]
+
+
+def _read_access_token(token_env: Optional[str]) -> str:
+    """
+    Read a page token from an environment variable, a prompt or piped stdin,
+    so it never appears in the process list or shell history
+    """
+    if token_env:
+        return os.getenv(token_env, '').strip()
+    if sys.stdin.isatty():
+        return getpass.getpass('Page access token: ').strip()
+    return sys.stdin.readline().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the Facebook pages that are synced')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='Register a page or update its token (read from a prompt or stdin)')
+    add.add_argument('page_id')
+    add.add_argument('--name')
+    add.add_argument('--token-env', metavar='VAR', help='Read the access token from this environment variable')
+    for command in ('enable', 'disable'):
+        commands.add_parser(command, help=f'{command.capitalize()} syncing of a page').add_argument('page_id')
+    commands.add_parser('list', help='List registered pages')
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        access_token = _read_access_token(args.token_env)
+        if not access_token:
+            parser.error('No access token given')
+        register_page(args.page_id, access_token, args.name)
+        print(f"Registered page {args.page_id}")
+    elif args.command in ('enable', 'disable'):
+        if not set_page_enabled(args.page_id, args.command == 'enable'):
+            parser.error(f"Page {args.page_id} is not registered")
+        print(f"Page {args.page_id} {args.command}d")
+    else:
+        for page in list_pages(enabled_only=False):
+            print(f"{page.page_id}\t{page.name or ''}\t{'enabled' if page.enabled else 'disabled'}")
+
+
+if __name__ == "__main__":
+    main()
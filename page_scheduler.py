@@ -0,0 +1,163 @@
+# page_scheduler.py
+"""
+Sharded multi-page sync scheduler.
+
+Registered pages (page_registry.py) are spread over worker processes by a
+stable hash of their page id; every worker process runs a SyncDaemon for
+each page of its shard, with that page's token, rate limit bucket and
+watermarks. Pages are independent, so throughput grows with the number of
+processes instead of pages being synced one after another.
+
+Several hosts split the pages by running with the same --workers and
+--shard-count and their own --shard-index:
+
+    python page_scheduler.py --workers 8 --shard-count 3 --shard-index 0
+
+Workers re-read the registry every SYNC_PAGE_REFRESH_INTERVAL seconds,
+so pages that are added or disabled are picked up without a restart.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from page_registry import pages_for_shard
+from sync_daemon import SyncDaemon, default_schedules
+
+logger = logging.getLogger('fb_api')
+
+
+class PageWorker:
+    def __init__(self, shard: int, shard_count: int, resources: Optional[List[str]] = None,
+                 freshness_target: Optional[float] = None, refresh_interval: Optional[float] = None):
+        """
+        Initialize the worker of one shard
+
+        Args:
+            shard (int): Shard this worker syncs
+            shard_count (int): Total number of shards over all hosts
+            resources (list): Resources to sync per page (default: all)
+            freshness_target (float): Passed on to every page's SyncDaemon
+            refresh_interval (float): Seconds between registry reads
+                (default: SYNC_PAGE_REFRESH_INTERVAL or 300)
+        """
+        self.shard = shard
+        self.shard_count = shard_count
+        self.resources = resources
+        self.freshness_target = freshness_target
+        self.refresh_interval = refresh_interval or float(os.getenv('SYNC_PAGE_REFRESH_INTERVAL', '300'))
+        self.daemons: Dict[str, Tuple[SyncDaemon, threading.Thread]] = {}
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _start_page(self, page_id: str):
+        schedules = default_schedules()
+        names = self.resources or list(schedules)
+        daemon = SyncDaemon([schedules[name] for name in names], freshness_target=self.freshness_target,
+                            page_id=page_id)
+        thread = threading.Thread(target=daemon.run, name=f'page-{page_id}', daemon=True)
+        thread.start()
+        self.daemons[page_id] = (daemon, thread)
+
+    def _stop_page(self, page_id: str):
+        daemon, thread = self.daemons.pop(page_id)
+        daemon.stop()
+        thread.join()
+
+    def refresh(self):
+        """
+        Start daemons for newly assigned pages and stop those of pages that left the shard
+        """
+        assigned = set(pages_for_shard(self.shard, self.shard_count))
+        for page_id in sorted(assigned - set(self.daemons)):
+            logger.info(f"Shard {self.shard}/{self.shard_count}: starting page {page_id}")
+            self._start_page(page_id)
+        for page_id in sorted(set(self.daemons) - assigned):
+            logger.info(f"Shard {self.shard}/{self.shard_count}: stopping page {page_id}")
+            self._stop_page(page_id)
+
+    def run(self):
+        """
+        Sync the shard's pages until stop() is called
+        """
+        logger.info(f"Page worker for shard {self.shard}/{self.shard_count} started")
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Shard {self.shard}: could not read the page registry: {e}")
+            if self._stop.wait(self.refresh_interval):
+                break
+
+        # Let every page finish its current batch
+        for daemon, _ in self.daemons.values():
+            daemon.stop()
+        for page_id in list(self.daemons):
+            self._stop_page(page_id)
+        logger.info(f"Page worker for shard {self.shard}/{self.shard_count} stopped")
+
+
+def _worker_process(shard: int, shard_count: int, resources: Optional[List[str]],
+                    freshness_target: Optional[float]):
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(processName)s %(threadName)s %(levelname)s: %(message)s')
+    worker = PageWorker(shard, shard_count, resources, freshness_target)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: worker.stop())
+    worker.run()
+
+
+def main():
+    schedules = default_schedules()
+    parser = argparse.ArgumentParser(description='Sync every registered page, sharded over worker processes')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('SYNC_PAGE_WORKERS', os.cpu_count() or 1)),
+                        help='Worker processes on this host (default: SYNC_PAGE_WORKERS or the CPU count)')
+    parser.add_argument('--shard-count', type=int, default=int(os.getenv('SYNC_SHARD_COUNT', '1')),
+                        help='Number of hosts sharing the pages (default: SYNC_SHARD_COUNT or 1)')
+    parser.add_argument('--shard-index', type=int, default=int(os.getenv('SYNC_SHARD_INDEX', '0')),
+                        help='Index of this host, from 0 (default: SYNC_SHARD_INDEX or 0)')
+    parser.add_argument('--resources', default=','.join(schedules),
+                        help=f"Comma-separated resources to sync (default: {','.join(schedules)})")
+    parser.add_argument('--freshness', type=float, default=None,
+                        help='Freshness target in seconds (default: SYNC_FRESHNESS_TARGET or 600)')
+    args = parser.parse_args()
+
+    if not 0 <= args.shard_index < args.shard_count:
+        parser.error('--shard-index must be between 0 and --shard-count - 1')
+    resources = [name.strip() for name in args.resources.split(',') if name.strip()]
+    unknown = [name for name in resources if name not in schedules]
+    if unknown:
+        parser.error(f"Unknown resources: {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s: %(message)s')
+
+    # One shard per process over all hosts; spawned processes open their own
+    # database connections and HTTP pools
+    total_shards = args.shard_count * args.workers
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=_worker_process, name=f'page-worker-{shard}',
+                        args=(shard, total_shards, resources, args.freshness))
+        for shard in range(args.shard_index * args.workers, (args.shard_index + 1) * args.workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def shutdown(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
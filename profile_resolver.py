@@ -0,0 +1,278 @@
+# profile_resolver.py
+"""
+Batched, cached resolution of Messenger user profiles.
+
+Profiles are looked up in an in-memory LRU cache with a TTL, then in the
+user_profiles table, and only the remaining users are read from Graph,
+up to 50 per ?ids= request. backfill_names fills in the placeholder sender
+names and participants stored by the webhook, and schedule_backfill runs
+it on a background thread so request handlers never wait on Graph.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from bulk_ingest import upsert
+from models import Conversation, Message, Session, UserProfile
+
+logger = logging.getLogger('fb_api')
+
+# Name stored for senders whose profile was not resolved yet
+PLACEHOLDER_NAME = 'Customer'
+
+PROFILE_FIELDS = ('name', 'first_name', 'last_name', 'profile_pic')
+
+
+class TTLCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0):
+        """
+        Initialize the cache
+
+        Args:
+            max_size (int): Entries kept before the least recently used are evicted
+            ttl (float): Seconds an entry stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+
+class ProfileResolver:
+    def __init__(self, cache_size: Optional[int] = None, cache_ttl: Optional[float] = None,
+                 db_ttl: Optional[float] = None):
+        """
+        Initialize the resolver
+
+        Args:
+            cache_size (int): Profiles kept in memory (default: FACEBOOK_PROFILE_CACHE_SIZE or 10000)
+            cache_ttl (float): Seconds a profile stays in memory (default: FACEBOOK_PROFILE_CACHE_TTL or 3600)
+            db_ttl (float): Seconds a stored profile is used before it is fetched again
+                (default: FACEBOOK_PROFILE_DB_TTL or 7 days)
+        """
+        self.cache = TTLCache(
+            max_size=cache_size or int(os.getenv('FACEBOOK_PROFILE_CACHE_SIZE', '10000')),
+            ttl=cache_ttl or float(os.getenv('FACEBOOK_PROFILE_CACHE_TTL', '3600'))
+        )
+        self.db_ttl = db_ttl or float(os.getenv('FACEBOOK_PROFILE_DB_TTL', str(7 * 24 * 3600)))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-backfill')
+        self._backfill_pending = threading.Event()
+
+    def cached_name(self, user_id: str) -> Optional[str]:
+        """
+        Name of a user if it is in memory; never touches the database or Graph
+        """
+        profile = self.cache.get(user_id)
+        return profile.get('name') if profile else None
+
+    def _load_stored(self, session, user_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Stored profiles that are still fresh, one query
+        """
+        fresh_after = datetime.now() - timedelta(seconds=self.db_ttl)
+        rows = session.query(UserProfile).filter(UserProfile.user_id.in_(user_ids),
+                                                 UserProfile.fetched_at >= fresh_after).all()
+        return {row.user_id: {'id': row.user_id, **{field: getattr(row, field) for field in PROFILE_FIELDS}}
+                for row in rows}
+
+    def _store(self, session, profiles: Dict[str, Dict]):
+        """
+        Upsert fetched profiles into user_profiles
+        """
+        now = datetime.now()
+        rows = [
+            {'user_id': user_id, 'fetched_at': now, **{field: profile.get(field) for field in PROFILE_FIELDS}}
+            for user_id, profile in profiles.items()
+        ]
+        if upsert(session, UserProfile, rows, ['user_id'], list(PROFILE_FIELDS) + ['fetched_at']) is None:
+            existing = {row.user_id: row for row in
+                        session.query(UserProfile).filter(UserProfile.user_id.in_(list(profiles)))}
+            for row in rows:
+                profile = existing.get(row['user_id'])
+                if profile is None:
+                    session.add(UserProfile(**row))
+                else:
+                    for field, value in row.items():
+                        setattr(profile, field, value)
+        session.commit()
+
+    def resolve(self, user_ids: Iterable[str], fb_api=None) -> Dict[str, Dict]:
+        """
+        Resolve profiles for many users: memory first, then the database,
+        then batched Graph lookups for the rest. Users that cannot be
+        resolved are missing from the result.
+        """
+        user_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id]
+        profiles = {}
+        missing = []
+        for user_id in user_ids:
+            profile = self.cache.get(user_id)
+            if profile is None:
+                missing.append(user_id)
+            elif profile:
+                profiles[user_id] = profile
+        if not missing:
+            return profiles
+
+        session = Session()
+        try:
+            stored = self._load_stored(session, missing)
+            for user_id, profile in stored.items():
+                self.cache.set(user_id, profile)
+            profiles.update(stored)
+            missing = [user_id for user_id in missing if user_id not in stored]
+
+            if missing:
+                if fb_api is None:
+                    from fb_api import FacebookAPI
+                    fb_api = FacebookAPI()
+                fetched = fb_api.fetch_user_profiles(missing)
+                if fetched:
+                    self._store(session, fetched)
+                for user_id in missing:
+                    # Remember users Graph would not return so they aren't asked for again right away
+                    self.cache.set(user_id, fetched.get(user_id, {}))
+                profiles.update(fetched)
+                logger.info(f"Resolved {len(fetched)} of {len(missing)} profiles from Graph")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error resolving profiles: {e}")
+        finally:
+            session.close()
+        return profiles
+
+    def backfill_names(self, limit: int = 1000, fb_api=None) -> int:
+        """
+        Replace placeholder sender/recipient names and webhook-style
+        participants with resolved profile names. Returns the number of
+        messages and conversations updated.
+
+        The newest rows are taken first: rows of users Graph will not return
+        keep their placeholder, and would otherwise fill every batch and
+        keep newer messages from ever being named.
+        """
+        session = Session()
+        try:
+            messages = session.query(Message).filter(
+                (Message.sender_name == PLACEHOLDER_NAME) | (Message.sender_name == '') |
+                (Message.sender_name.is_(None)) | (Message.recipient_name == PLACEHOLDER_NAME)
+            ).order_by(Message.created_time.desc(), Message.id.desc()).limit(limit).all()
+            conversations = session.query(Conversation).filter(
+                Conversation.participants.like('%"sender_id"%')
+            ).order_by(Conversation.updated_time.desc(), Conversation.id.desc()).limit(limit).all()
+
+            user_ids = [message.sender_id for message in messages]
+            user_ids += [message.recipient_id for message in messages]
+            webhook_participants = {}
+            for conversation in conversations:
+                try:
+                    participants = json.loads(conversation.participants)
+                except (TypeError, ValueError):
+                    continue
+                webhook_participants[conversation.conversation_id] = participants
+                user_ids += [participants.get('sender_id'), participants.get('recipient_id')]
+
+            # The page itself is not a user profile and would fail the ?ids= lookup
+            page_id = os.getenv('FACEBOOK_PAGE_ID')
+            profiles = self.resolve([user_id for user_id in user_ids if user_id != page_id], fb_api=fb_api)
+            if page_id:
+                profiles[page_id] = {'id': page_id, 'name': os.getenv('FACEBOOK_PAGE_NAME', 'Page')}
+            updated = 0
+
+            for message in messages:
+                changed = False
+                sender = profiles.get(message.sender_id)
+                if sender and sender.get('name') and message.sender_name in (PLACEHOLDER_NAME, '', None):
+                    message.sender_name = sender['name']
+                    changed = True
+                recipient = profiles.get(message.recipient_id)
+                if recipient and recipient.get('name') and message.recipient_name == PLACEHOLDER_NAME:
+                    message.recipient_name = recipient['name']
+                    changed = True
+                updated += changed
+
+            for conversation in conversations:
+                participants = webhook_participants.get(conversation.conversation_id)
+                if participants is None:
+                    continue
+                ids = [participants.get('sender_id'), participants.get('recipient_id')]
+                if not all(user_id in profiles for user_id in ids if user_id):
+                    continue
+                # Same shape as the participants Graph returns for a conversation
+                conversation.participants = json.dumps({'data': [
+                    {'id': user_id, 'name': profiles[user_id].get('name')} for user_id in ids if user_id
+                ]})
+                updated += 1
+
+            session.commit()
+            if updated:
+                logger.info(f"Backfilled names on {updated} messages and conversations")
+            return updated
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error backfilling profile names: {e}")
+            return 0
+        finally:
+            session.close()
+
+    def schedule_backfill(self):
+        """
+        Run backfill_names on the background thread; requests made while
+        one is already queued are folded into it
+        """
+        if self._backfill_pending.is_set():
+            return
+        self._backfill_pending.set()
+
+        def run():
+            self._backfill_pending.clear()
+            self.backfill_names()
+
+        self._executor.submit(run)
+
+
+_resolver: Optional[ProfileResolver] = None
+_resolver_lock = threading.Lock()
+
+
+def get_profile_resolver() -> ProfileResolver:
+    """
+    Get the process-wide resolver, so every caller shares one cache
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = ProfileResolver()
+        return _resolver
+
+
+if __name__ == "__main__":
+    updated = get_profile_resolver().backfill_names(limit=int(os.getenv('FACEBOOK_PROFILE_BACKFILL_LIMIT', '5000')))
+    print(f"Updated {updated} messages and conversations with profile names")
@@ -0,0 +1,132 @@
+# progress_channel.py
+"""
+Progress channel for background sync jobs.
+
+A running job publishes SyncJobEvent rows through a ProgressTracker, which
+adds post/comment counts, throughput and an ETA to every update. Readers
+such as the SSE endpoint only tail those rows, so any number of browser
+tabs can follow one job, and a reconnecting client resumes from the last
+event id it saw instead of restarting the sync.
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+from models import Session, SyncJob, SyncJobEvent
+
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+
+def publish(job_id: int, progress: Optional[float], message: str = '', status: str = 'running',
+            session=None, **data) -> int:
+    """
+    Append an event to a job's channel and return its id
+    """
+    own_session = session is None
+    session = session or Session()
+    try:
+        event = SyncJobEvent(job_id=job_id, progress=progress, message=(message or '')[:500], status=status,
+                             data=json.dumps(data, default=str) if data else None)
+        session.add(event)
+        session.commit()
+        return event.id
+    finally:
+        if own_session:
+            session.close()
+
+
+def tail(job_id: int, after_id: int = 0, poll_interval: float = 0.5,
+         timeout: Optional[float] = None) -> Iterator[Dict]:
+    """
+    Yield a job's events with id > after_id as they are published, until
+    the job has finished and every event was delivered (or timeout passes)
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    session = Session()
+    try:
+        while True:
+            events = session.query(SyncJobEvent).filter(SyncJobEvent.job_id == job_id,
+                                                         SyncJobEvent.id > after_id)\
+                .order_by(SyncJobEvent.id).limit(100).all()
+            for event in events:
+                after_id = event.id
+                yield event.to_dict()
+            if events:
+                continue
+
+            status = session.query(SyncJob.status).filter(SyncJob.id == job_id).scalar()
+            # End the read transaction so the next poll sees newly committed events
+            session.commit()
+            if status is None or status in FINISHED_STATUSES:
+                # Pick up events committed together with the final status
+                events = session.query(SyncJobEvent).filter(SyncJobEvent.job_id == job_id,
+                                                             SyncJobEvent.id > after_id)\
+                    .order_by(SyncJobEvent.id).all()
+                for event in events:
+                    yield event.to_dict()
+                return
+            if deadline and time.monotonic() > deadline:
+                return
+            time.sleep(poll_interval)
+    finally:
+        session.close()
+
+
+def prune_events(max_age_days: float = 7) -> int:
+    """
+    Delete events older than max_age_days
+    """
+    session = Session()
+    try:
+        deleted = session.query(SyncJobEvent).filter(
+            SyncJobEvent.created_at < datetime.now() - timedelta(days=max_age_days)
+        ).delete(synchronize_session=False)
+        session.commit()
+        return deleted
+    finally:
+        session.close()
+
+
+class ProgressTracker:
+    def __init__(self, job_id: int, expected_items: Optional[int] = None):
+        """
+        Initialize the tracker
+
+        Args:
+            job_id (int): Job whose channel the events are published to
+            expected_items (int): Posts (or conversations) the job expects to
+                process, used for the ETA; optional
+        """
+        self.job_id = job_id
+        self.expected_items = expected_items
+        self.started = time.monotonic()
+
+    def stats(self, progress: Optional[float], counts: Dict) -> Dict:
+        """
+        Add elapsed time, per-second throughput and an ETA to a job's counts.
+
+        The ETA is taken from expected_items when the job processes a known
+        number of items, otherwise from the reported percentage.
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        data = dict(counts)
+        data['elapsed_seconds'] = round(elapsed, 1)
+        for name, value in counts.items():
+            if isinstance(value, (int, float)):
+                data[f"{name}_per_second"] = round(value / elapsed, 2)
+
+        eta = None
+        items = counts.get('posts', counts.get('conversations'))
+        if self.expected_items and items:
+            eta = max(self.expected_items - items, 0) * elapsed / items
+        elif progress and 0 < progress < 100:
+            eta = elapsed * (100 - progress) / progress
+        data['eta_seconds'] = round(eta, 1) if eta is not None else None
+        return data
+
+    def publish(self, progress: Optional[float], message: str = '', status: str = 'running',
+                session=None, **counts) -> int:
+        return publish(self.job_id, progress, message, status=status, session=session,
+                       **self.stats(progress, counts))
@@ -0,0 +1,198 @@
+# rate_limiter.py
+"""
+Adaptive rate limiting for Graph API calls.
+
+Facebook reports how much of the rate-limit quota has been used in the
+X-App-Usage, X-Page-Usage and X-Business-Use-Case-Usage response headers.
+GraphRateLimiter reads those headers after every response and spaces out
+the following requests of all callers that share it: no delay while there
+is headroom, longer gaps as usage approaches 100%, and a full pause when
+Facebook reports a throttling error or a time to regain access.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Mapping, Optional
+
+logger = logging.getLogger('fb_api')
+
+# Graph API error codes that mean the caller is being rate limited
+THROTTLE_ERROR_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+
+USAGE_HEADERS = ('X-App-Usage', 'X-Page-Usage')
+BUSINESS_USAGE_HEADER = 'X-Business-Use-Case-Usage'
+
+
+def is_throttle_error(error: Optional[Dict]) -> bool:
+    """
+    Check whether a Graph API error object is a rate-limit error
+    """
+    if not error:
+        return False
+    return error.get('code') in THROTTLE_ERROR_CODES or error.get('error_subcode') == 2446079
+
+
+def _max_usage(usage: Dict) -> float:
+    """
+    Highest percentage reported in a usage object
+    """
+    values = [usage.get(key, 0) or 0 for key in ('call_count', 'total_cputime', 'total_time')]
+    return float(max(values))
+
+
+class GraphRateLimiter:
+    def __init__(self, min_interval: float = 0.0, max_interval: float = 5.0,
+                 low_watermark: float = 50.0, base_backoff: float = 5.0,
+                 max_backoff: float = 600.0):
+        """
+        Initialize the limiter
+
+        Args:
+            min_interval (float): Gap between requests while usage is below low_watermark
+            max_interval (float): Gap between requests when usage reaches 100%
+            low_watermark (float): Usage percentage at which requests start to slow down
+            base_backoff (float): First pause after a throttling error, in seconds
+            max_backoff (float): Longest pause after repeated throttling errors
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.low_watermark = low_watermark
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self.usage = 0.0
+        self.interval = min_interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+        self._throttle_hits = 0
+
+    @classmethod
+    def from_env(cls) -> 'GraphRateLimiter':
+        """
+        Build a limiter from FACEBOOK_RATE_* environment variables
+        """
+        return cls(
+            min_interval=float(os.getenv('FACEBOOK_RATE_MIN_INTERVAL', '0')),
+            max_interval=float(os.getenv('FACEBOOK_RATE_MAX_INTERVAL', '5')),
+            low_watermark=float(os.getenv('FACEBOOK_RATE_LOW_WATERMARK', '50')),
+            base_backoff=float(os.getenv('FACEBOOK_RATE_BASE_BACKOFF', '5')),
+            max_backoff=float(os.getenv('FACEBOOK_RATE_MAX_BACKOFF', '600'))
+        )
+
+    def _interval_for(self, usage: float) -> float:
+        """
+        Gap between requests for a given usage percentage
+        """
+        if usage <= self.low_watermark:
+            return self.min_interval
+        fraction = min((usage - self.low_watermark) / (100.0 - self.low_watermark), 1.0)
+        return self.min_interval + fraction * (self.max_interval - self.min_interval)
+
+    def reserve(self) -> float:
+        """
+        Claim the next request slot and return how long to wait before sending
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot, self._blocked_until)
+            self._next_slot = start + self.interval
+            return start - now
+
+    def wait(self):
+        """
+        Block until the caller may send its next request
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """
+        Adjust the request rate from the usage headers of a Graph response
+        """
+        usage = None
+        regain_seconds = 0
+
+        for header in USAGE_HEADERS:
+            value = headers.get(header)
+            if not value:
+                continue
+            try:
+                usage = max(usage or 0.0, _max_usage(json.loads(value)))
+            except (ValueError, AttributeError):
+                logger.debug(f"Could not parse {header}: {value}")
+
+        value = headers.get(BUSINESS_USAGE_HEADER)
+        if value:
+            try:
+                for entries in json.loads(value).values():
+                    for entry in entries:
+                        usage = max(usage or 0.0, _max_usage(entry))
+                        regain_minutes = entry.get('estimated_time_to_regain_access') or 0
+                        regain_seconds = max(regain_seconds, regain_minutes * 60)
+            except (ValueError, AttributeError):
+                logger.debug(f"Could not parse {BUSINESS_USAGE_HEADER}: {value}")
+
+        if usage is None and not regain_seconds:
+            return
+
+        with self._lock:
+            if usage is not None:
+                self.usage = usage
+                self.interval = self._interval_for(usage)
+                if usage < self.low_watermark:
+                    self._throttle_hits = 0
+            if regain_seconds:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + regain_seconds)
+
+        if regain_seconds:
+            logger.warning(f"Graph API access blocked for {regain_seconds}s (usage {usage}%)")
+        elif usage is not None and usage > self.low_watermark:
+            logger.info(f"Graph API usage at {usage:.0f}%, spacing requests {self.interval:.2f}s apart")
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        """
+        Pause all callers after a rate-limit error, backing off exponentially
+        """
+        with self._lock:
+            self._throttle_hits += 1
+            backoff = min(self.base_backoff * (2 ** (self._throttle_hits - 1)), self.max_backoff)
+            if retry_after:
+                backoff = max(backoff, retry_after)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + backoff)
+            self.interval = self.max_interval
+
+        logger.warning(f"Graph API throttling detected, pausing requests for {backoff:.0f}s")
+
+    def observe(self, headers: Mapping[str, str], error: Optional[Dict] = None,
+                retry_after: Optional[str] = None):
+        """
+        Feed one Graph response (headers and optional error object) to the limiter
+        """
+        self.update_from_headers(headers)
+        if is_throttle_error(error):
+            try:
+                seconds = float(retry_after) if retry_after else None
+            except ValueError:
+                seconds = None
+            self.record_throttle(seconds)
+
+
+# Limiters are shared process-wide so every FacebookAPI instance, thread and
+# Flask request draws from the same quota
+_limiters: Dict[str, GraphRateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str = 'default') -> GraphRateLimiter:
+    """
+    Get the shared limiter for a quota bucket, creating it on first use
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = GraphRateLimiter.from_env()
+        return _limiters[name]
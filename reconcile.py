@@ -0,0 +1,262 @@
+# reconcile.py
+"""
+Reconcile stored posts and comments with Facebook.
+
+Syncs only ever insert new comments, so edits on Facebook never show up
+and deleted comments stay in the analytics. CommentReconciler re-reads the
+most recent stored posts with their complete comment lists, up to 50 posts
+per ?ids= request, and compares them with the content hashes stored per
+post and comment:
+
+- edited posts and comments (hash differs) get their message, keywords,
+  sentiment and hash rewritten;
+- comments missing from a complete comment list, and posts Graph reports
+  as deleted, are removed with their replies and response drafts;
+- avg_sentiment is recalculated only for posts whose comments changed.
+
+Unchanged rows are not written, so a reconciliation pass over an
+unchanged page only reads. Rows saved before content hashes existed are
+compared by their stored message and get their hash filled in once.
+
+Run with: python reconcile.py [--posts 100]
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, select, update
+
+from fb_api import GRAPH_BATCH_LIMIT, FacebookAPI, content_hash, to_utc_naive
+from models import Comment, CommentReply, Post, ResponseDraft
+from retry_policy import GraphAPIError
+from text_analysis import analyze_comment_sentiments, extract_keywords
+
+logger = logging.getLogger('fb_api')
+
+COMMENT_FIELDS = 'id,message,created_time'
+
+# Comments this much younger than the start of a pass may have been saved
+# by a concurrent sync after the pass read them, so they are never deleted
+DELETE_GRACE_PERIOD = timedelta(minutes=5)
+
+
+def _is_deleted(error: GraphAPIError) -> bool:
+    """
+    Whether a Graph error says the object no longer exists
+    """
+    code = (error.error or {}).get('code')
+    subcode = (error.error or {}).get('error_subcode')
+    return error.status_code == 404 or (code == 100 and subcode == 33)
+
+
+def delete_comments(session, comment_ids: List[str]):
+    """
+    Delete comments with their replies and response drafts (not committed)
+    """
+    if not comment_ids:
+        return
+    session.execute(delete(CommentReply).where(CommentReply.comment_id.in_(comment_ids)))
+    session.execute(delete(ResponseDraft).where(ResponseDraft.comment_id.in_(comment_ids)))
+    session.execute(delete(Comment).where(Comment.comment_id.in_(comment_ids)))
+
+
+class CommentReconciler:
+    def __init__(self, fb_api: Optional[FacebookAPI] = None, comments_page_size: int = 100):
+        """
+        Initialize the reconciler
+
+        Args:
+            fb_api (FacebookAPI): Client to read from; its DB session is used for writes
+            comments_page_size (int): Comments per page of the comments edge
+        """
+        self.fb_api = fb_api or FacebookAPI()
+        self.session = self.fb_api.session
+        self.comments_page_size = comments_page_size
+
+    def _posts_fields(self) -> str:
+        return f"id,message,comments.limit({self.comments_page_size}){{{COMMENT_FIELDS}}}"
+
+    def _complete_comments(self, post: Dict) -> Optional[List[Dict]]:
+        """
+        Every comment of a fetched post, following cursors, or None if a page failed
+        """
+        first_page = post.get('comments') or {'data': []}
+        try:
+            return [comment for page in self.fb_api.iter_edge_pages(None, first_page=first_page, strict=True)
+                    for comment in page]
+        except GraphAPIError as e:
+            logger.warning(f"Comments of post {post['id']} could not be read completely: {e}")
+            return None
+
+    def fetch_posts(self, post_ids: List[str]) -> Tuple[Dict[str, Dict], List[str]]:
+        """
+        Read posts with their complete comment lists.
+
+        Returns ({post id: post with 'comments' list, or None when the list is
+        incomplete}, [ids of posts that no longer exist]). Posts that could
+        not be read are in neither.
+        """
+        fields = self._posts_fields()
+        try:
+            raw_posts = self.fb_api.graph_get('', {'ids': ','.join(post_ids), 'fields': fields})
+        except GraphAPIError as e:
+            # One missing post fails the whole ?ids= lookup, so read them one by one
+            logger.info(f"Lookup of {len(post_ids)} posts failed ({e}), reading them one by one")
+            raw_posts = {}
+            deleted = []
+            for post_id in post_ids:
+                try:
+                    raw_posts[post_id] = self.fb_api.graph_get(post_id, {'fields': fields})
+                except GraphAPIError as error:
+                    if _is_deleted(error):
+                        deleted.append(post_id)
+                    else:
+                        logger.warning(f"Post {post_id} could not be read: {error}")
+        else:
+            deleted = []
+
+        posts = {}
+        for post_id, post in raw_posts.items():
+            comments = self._complete_comments(post)
+            posts[post_id] = dict(post, comments=comments)
+        return posts, deleted
+
+    def reconcile_chunk(self, stored_posts: List[Tuple], started_at: datetime) -> Dict[str, int]:
+        """
+        Reconcile up to GRAPH_BATCH_LIMIT stored posts (id, post_id, content_hash, message)
+        """
+        stats = {'posts_updated': 0, 'posts_deleted': 0, 'comments_updated': 0, 'comments_deleted': 0,
+                 'hashes_filled': 0}
+        posts, deleted_posts = self.fetch_posts([post_id for _, post_id, _, _ in stored_posts])
+
+        stored_comments = {}
+        for row in self.session.execute(
+                select(Comment.id, Comment.comment_id, Comment.post_id, Comment.content_hash,
+                       Comment.message, Comment.created_time)
+                .where(Comment.post_id.in_([post_id for _, post_id, _, _ in stored_posts]))):
+            stored_comments.setdefault(row.post_id, []).append(row)
+
+        post_updates = []
+        comment_updates = []
+        hash_fills = {Post: [], Comment: []}
+        deleted_comments = []
+        touched_posts = set()
+        delete_before = to_utc_naive(started_at - DELETE_GRACE_PERIOD)
+
+        for pk, post_id, stored_hash, stored_message in stored_posts:
+            post = posts.get(post_id)
+            if post is None:
+                continue
+            fresh_hash = content_hash(post.get('message'))
+            if (stored_hash or content_hash(stored_message)) != fresh_hash:
+                post_updates.append({'id': pk, 'message': post.get('message', ''), 'content_hash': fresh_hash,
+                                     'trending_topics': json.dumps(extract_keywords(post.get('message', '')))})
+            elif stored_hash is None:
+                hash_fills[Post].append({'id': pk, 'content_hash': fresh_hash})
+
+            if post['comments'] is None:
+                # Without the complete list we cannot tell deleted comments apart
+                continue
+            fresh = {comment['id']: comment for comment in post['comments']}
+            for row in stored_comments.get(post_id, []):
+                comment = fresh.get(row.comment_id)
+                if comment is None:
+                    if row.created_time < delete_before:
+                        deleted_comments.append(row.comment_id)
+                        touched_posts.add(post_id)
+                    continue
+                fresh_hash = content_hash(comment.get('message'))
+                if (row.content_hash or content_hash(row.message)) != fresh_hash:
+                    analyzed = {'message': comment.get('message', '')}
+                    analyze_comment_sentiments([analyzed])
+                    comment_updates.append({
+                        'id': row.id,
+                        'message': analyzed['message'],
+                        'sentiment_score': analyzed['sentiment_score'],
+                        'sentiment_category': analyzed['sentiment_category'],
+                        'keywords': json.dumps(extract_keywords(analyzed['message'])),
+                        'content_hash': fresh_hash
+                    })
+                    touched_posts.add(post_id)
+                elif row.content_hash is None:
+                    hash_fills[Comment].append({'id': row.id, 'content_hash': fresh_hash})
+
+        try:
+            # Bulk UPDATE ... WHERE id = :id, one statement per table
+            if post_updates:
+                self.session.execute(update(Post), post_updates)
+            if comment_updates:
+                self.session.execute(update(Comment), comment_updates)
+            for model, rows in hash_fills.items():
+                if rows:
+                    self.session.execute(update(model), rows)
+            delete_comments(self.session, deleted_comments)
+
+            if deleted_posts:
+                delete_comments(self.session, self.session.execute(
+                    select(Comment.comment_id).where(Comment.post_id.in_(deleted_posts))).scalars().all())
+                self.session.execute(delete(Post).where(Post.post_id.in_(deleted_posts)))
+
+            self.fb_api.recompute_avg_sentiment(touched_posts - set(deleted_posts))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+
+        stats['posts_updated'] = len(post_updates)
+        stats['posts_deleted'] = len(deleted_posts)
+        stats['comments_updated'] = len(comment_updates)
+        stats['comments_deleted'] = len(deleted_comments)
+        stats['hashes_filled'] = len(hash_fills[Post]) + len(hash_fills[Comment])
+        return stats
+
+    def run(self, posts_limit: int = 100) -> Dict:
+        """
+        Reconcile the posts_limit most recent stored posts of the page and their comments
+        """
+        start = time.time()
+        started_at = datetime.now(timezone.utc)
+        stored_posts = self.session.execute(
+            select(Post.id, Post.post_id, Post.content_hash, Post.message)
+            .where(Post.page_id == self.fb_api.page_id)
+            .order_by(Post.created_time.desc()).limit(posts_limit)
+        ).all()
+
+        stats = {'posts_checked': 0, 'posts_updated': 0, 'posts_deleted': 0, 'comments_updated': 0,
+                 'comments_deleted': 0, 'hashes_filled': 0}
+        for i in range(0, len(stored_posts), GRAPH_BATCH_LIMIT):
+            chunk = stored_posts[i:i + GRAPH_BATCH_LIMIT]
+            for key, value in self.reconcile_chunk(chunk, started_at).items():
+                stats[key] += value
+            stats['posts_checked'] += len(chunk)
+            if self.fb_api.progress_callback:
+                self.fb_api.progress_callback(stats['posts_checked'] * 100 / len(stored_posts),
+                                              f"Reconciled {stats['posts_checked']} posts", posts=stats['posts_checked'],
+                                              comments=stats['comments_updated'] + stats['comments_deleted'])
+
+        stats['elapsed'] = time.time() - start
+        logger.info(f"Reconciliation of page {self.fb_api.page_id} finished in {stats['elapsed']:.1f}s: {stats}")
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile edited and deleted posts and comments with Facebook')
+    parser.add_argument('--posts', type=int, default=int(os.getenv('SYNC_RECONCILE_POSTS', '100')),
+                        help='Most recent stored posts to reconcile (default: SYNC_RECONCILE_POSTS or 100)')
+    parser.add_argument('--page-id', default=None, help='Registered page to reconcile (default: FACEBOOK_PAGE_ID)')
+    args = parser.parse_args()
+
+    from page_registry import api_for_page
+    stats = CommentReconciler(api_for_page(args.page_id)).run(args.posts)
+    print(f"Checked {stats['posts_checked']} posts: {stats['posts_updated']} posts and "
+          f"{stats['comments_updated']} comments updated, {stats['posts_deleted']} posts and "
+          f"{stats['comments_deleted']} comments deleted")
+
+
+if __name__ == "__main__":
+    main()
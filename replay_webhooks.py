@@ -0,0 +1,149 @@
+# replay_webhooks.py
+"""
+Replay logged webhook payloads through the processing pipeline.
+
+Reads a time or offset range of the webhook event log (event_log.py) and
+runs every payload through the same steps as POST /webhook:
+
+- queue mode (default) writes the events to the webhook queue and, with
+  --threads, drains it with an in-process worker pool, measuring how fast
+  the workers keep up;
+- direct mode calls the event handlers inline, one payload after another,
+  without the queue (message replies are still deferred through it).
+
+Payloads are sent as fast as possible, or with their original spacing
+divided by --speed, so a production burst can be reproduced at 1x, 10x
+or more. --repeat sends the range several times; with --unique every
+copy gets fresh message and comment ids so idempotency does not drop it,
+which turns a captured burst into a load test.
+
+Replay writes to DATABASE_URL and runs the real handlers: use a scratch
+database, point FACEBOOK_GRAPH_URL at fake_graph_server.py, and pass
+--skip messaging_reply to leave out OpenAI calls and sends.
+
+Usage:
+    python replay_webhooks.py --since 2026-10-17T09:00 --until 2026-10-17T10:00 --threads 8
+    python replay_webhooks.py --from-offset 1200 --repeat 20 --unique --speed 10 --threads 16
+"""
+
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+from event_log import EventLog, LogRecord
+
+logger = logging.getLogger('fb_api')
+
+
+def _unique_copy(data: Dict, copy: int) -> Dict:
+    """
+    A payload whose message and comment ids are made unique to this copy
+    """
+    suffix = f".replay{copy}"
+    data = json.loads(json.dumps(data))
+    for entry in data.get('entry', []):
+        for event in entry.get('messaging', []):
+            if (event.get('message') or {}).get('mid'):
+                event['message']['mid'] += suffix
+        for change in entry.get('changes', []):
+            value = change.get('value') or {}
+            for key in ('comment_id', 'parent_id'):
+                # Top-level comments have the post as parent, which stays
+                if value.get(key) and value.get(key) != value.get('post_id'):
+                    value[key] += suffix
+    return data
+
+
+def paced_payloads(records: List[LogRecord], speed: float, repeat: int, unique: bool) -> Iterator[Tuple[int, Dict]]:
+    """
+    Yield (offset, payload) of the records repeat times, sleeping to keep
+    their original spacing divided by speed (speed 0: no pauses)
+    """
+    for copy in range(repeat):
+        start = time.monotonic()
+        first_ts = records[0].timestamp if records else 0.0
+        for record in records:
+            if speed:
+                delay = (record.timestamp - first_ts) / speed - (time.monotonic() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                data = json.loads(record.body)
+            except ValueError:
+                logger.warning(f"Record {record.offset} is not JSON, skipped")
+                continue
+            yield record.offset, _unique_copy(data, copy) if unique and copy else data
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay logged webhook payloads through the pipeline')
+    parser.add_argument('--dir', default=None, help='Log directory (default: WEBHOOK_LOG_DIR or logs/webhook_events)')
+    parser.add_argument('--since', type=datetime.fromisoformat, default=None, help='Received at or after (ISO time)')
+    parser.add_argument('--until', type=datetime.fromisoformat, default=None, help='Received before (ISO time)')
+    parser.add_argument('--from-offset', type=int, default=0, help='First offset to replay')
+    parser.add_argument('--to-offset', type=int, default=None, help='Offset to stop before')
+    parser.add_argument('--mode', choices=('queue', 'direct'), default='queue',
+                        help='Write events to the webhook queue, or call the handlers inline')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='Queue mode: worker threads draining the queue in this process (0: leave it to workers)')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='Replay at this multiple of the original pace (default 0: as fast as possible)')
+    parser.add_argument('--repeat', type=int, default=1, help='Times to replay the range')
+    parser.add_argument('--unique', action='store_true', help='Give every repeat fresh message and comment ids')
+    parser.add_argument('--skip', default='', help='Comma-separated event types not to handle, e.g. messaging_reply')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(threadName)s %(levelname)s: %(message)s')
+
+    from webhook_processor import events_from_webhook
+    from webhook_queue import EVENT_HANDLERS, WebhookWorkerPool, enqueue_events, queue_stats
+
+    for event_type in [name.strip() for name in args.skip.split(',') if name.strip()]:
+        EVENT_HANDLERS[event_type] = lambda event, page_id=None: None
+
+    records = list(EventLog(args.dir).read(args.from_offset, args.to_offset, args.since, args.until))
+    if not records:
+        print("No logged payloads in the requested range")
+        return
+    print(f"Replaying {len(records)} payloads (offsets {records[0].offset}-{records[-1].offset}) "
+          f"x{args.repeat} in {args.mode} mode")
+
+    pool = WebhookWorkerPool(args.threads).start() if args.mode == 'queue' and args.threads else None
+    before = queue_stats()
+    payloads = events = queued_events = 0
+    start = time.perf_counter()
+    for offset, data in paced_payloads(records, args.speed, args.repeat, args.unique):
+        queued = events_from_webhook(data)
+        if args.mode == 'queue':
+            # Events already handled are dropped by their idempotency key
+            queued_events += len(enqueue_events(queued))
+        else:
+            for event_type, page_id, _, event in queued:
+                try:
+                    EVENT_HANDLERS[event_type](event, page_id)
+                except Exception as e:
+                    logger.error(f"Event of payload {offset} failed: {e}")
+        payloads += 1
+        events += len(queued)
+    sent = time.perf_counter() - start
+    print(f"Sent {payloads} payloads with {events} events in {sent:.2f}s "
+          f"({payloads / sent:.0f} payloads/s, {events / sent:.0f} events/s)"
+          + (f", {queued_events} queued" if args.mode == 'queue' else ''))
+
+    if pool:
+        # Wait for the workers, including replies deferred by coalescing
+        while queue_stats().get('queued', 0) or queue_stats().get('processing', 0):
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        pool.stop()
+        after = queue_stats()
+        handled = {status: after.get(status, 0) - before.get(status, 0) for status in ('done', 'duplicate', 'failed')}
+        print(f"Workers finished in {elapsed:.2f}s: {handled['done']} done, {handled['duplicate']} duplicates, "
+              f"{handled['failed']} failed ({sum(handled.values()) / elapsed:.0f} events/s)")
+
+
+if __name__ == "__main__":
+    main()
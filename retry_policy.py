@@ -0,0 +1,203 @@
+# retry_policy.py
+"""
+Retry policy for Graph API calls.
+
+Timeouts, connection errors, 5xx responses and throttling errors are
+retried with capped exponential backoff and full jitter, honouring
+Retry-After. Requests that may have side effects (POST) are only retried
+when Facebook cannot have processed them. A process-wide retry budget caps
+retries at a fraction of normal traffic, so an outage does not turn every
+caller into a retry storm.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+
+from rate_limiter import is_throttle_error
+
+logger = logging.getLogger('fb_api')
+
+# HTTP statuses worth another attempt
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Graph API error codes for temporary server-side failures
+TRANSIENT_ERROR_CODES = {1, 2}
+
+# Methods that can be repeated without changing the result
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Request errors that will fail the same way however often they are repeated
+PERMANENT_REQUEST_ERRORS = (
+    requests.exceptions.URLRequired,
+    requests.exceptions.MissingSchema,
+    requests.exceptions.InvalidSchema,
+    requests.exceptions.InvalidURL,
+    requests.exceptions.InvalidHeader,
+    requests.exceptions.TooManyRedirects,
+)
+
+
+class GraphAPIError(Exception):
+    """
+    A Graph API request that failed after all retries
+    """
+
+    def __init__(self, message: str, endpoint: str = '', status_code: Optional[int] = None,
+                 error: Optional[Dict] = None, attempts: int = 1):
+        super().__init__(message)
+        self.endpoint = endpoint
+        self.status_code = status_code
+        self.error = error
+        self.attempts = attempts
+
+    def to_dict(self) -> Dict:
+        return {
+            'endpoint': self.endpoint,
+            'status_code': self.status_code,
+            'error': self.error,
+            'attempts': self.attempts,
+            'message': str(self)
+        }
+
+
+class RetryBudget:
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 100.0):
+        """
+        Initialize the budget
+
+        Args:
+            ratio (float): Retries allowed per first attempt (0.2 = retries add at most 20% load)
+            min_per_second (float): Retries always allowed per second, even with little traffic
+            max_tokens (float): Most retries that can be saved up
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+        self._last_refill = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+
+    def deposit(self):
+        """
+        Record a first attempt, earning a fraction of a retry
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        """
+        Spend one retry if the budget allows it
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0,
+                 budget: Optional[RetryBudget] = None):
+        """
+        Initialize the policy
+
+        Args:
+            max_attempts (int): Attempts per request, including the first one
+            base_delay (float): Backoff ceiling after the first failure, in seconds
+            max_delay (float): Largest backoff between two attempts
+            budget (RetryBudget): Budget shared by every caller of this policy
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+
+    @classmethod
+    def from_env(cls) -> 'RetryPolicy':
+        """
+        Build a policy from FACEBOOK_RETRY_* environment variables
+        """
+        return cls(
+            max_attempts=int(os.getenv('FACEBOOK_RETRY_MAX_ATTEMPTS', '4')),
+            base_delay=float(os.getenv('FACEBOOK_RETRY_BASE_DELAY', '0.5')),
+            max_delay=float(os.getenv('FACEBOOK_RETRY_MAX_DELAY', '30')),
+            budget=RetryBudget(
+                ratio=float(os.getenv('FACEBOOK_RETRY_BUDGET_RATIO', '0.2')),
+                min_per_second=float(os.getenv('FACEBOOK_RETRY_MIN_PER_SECOND', '1'))
+            )
+        )
+
+    def is_retryable(self, method: str, status_code: Optional[int] = None, error: Optional[Dict] = None,
+                     exception: Optional[Exception] = None, idempotent: Optional[bool] = None) -> bool:
+        """
+        Check whether a failed attempt may be repeated.
+
+        Throttled requests and connections that were never established are
+        safe to repeat for any method; other failures only for idempotent
+        requests (idempotent defaults to the HTTP method's semantics).
+        """
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        if exception is not None:
+            if isinstance(exception, requests.exceptions.ConnectTimeout):
+                return True
+            # Timeouts and dropped connections, from requests or aiohttp
+            return idempotent and not isinstance(exception, PERMANENT_REQUEST_ERRORS)
+
+        if status_code == 429 or is_throttle_error(error):
+            return True
+        if error and (error.get('is_transient') or error.get('code') in TRANSIENT_ERROR_CODES):
+            return idempotent
+        return idempotent and status_code in RETRYABLE_STATUS_CODES
+
+    def should_retry(self, attempt: int, method: str, **failure) -> bool:
+        """
+        Decide whether to make another attempt after attempt number attempt failed
+        """
+        if attempt >= self.max_attempts or not self.is_retryable(method, **failure):
+            return False
+        if not self.budget.try_withdraw():
+            logger.warning("Retry budget exhausted, not retrying")
+            return False
+        return True
+
+    def backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Seconds to wait before the next attempt: full jitter over a capped
+        exponential ceiling, but never less than Retry-After
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+
+_policy: Optional[RetryPolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """
+    Get the process-wide retry policy, whose budget all callers share
+    """
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = RetryPolicy.from_env()
+        return _policy
@@ -0,0 +1,321 @@
+# sync_daemon.py
+"""
+Continuous sync service.
+
+Keeps the database within a freshness target without anyone clicking a
+button: posts, comments of recent posts, reply threads, conversations and
+the reconciliation of edited and deleted content (reconcile.py) each run on
+their own schedule, in their own thread, through FacebookAPI.
+
+- Intervals are jittered so syncs of several daemons (or resources) don't
+  line up, and are shortened when needed so that the interval plus the
+  duration of the last run stays within SYNC_FRESHNESS_TARGET.
+- A resource never overlaps itself, and is postponed while a background
+  job doing the same sync (job_runner.py) is running.
+- Every batch written by a sync advances its watermarks in sync_state, and
+  each completed run is checkpointed there too ('sync_daemon' rows), so a
+  restarted daemon picks up where it left off instead of re-running
+  everything at once.
+- SIGTERM/SIGINT stop the daemon after the current batch of each sync.
+
+A daemon syncs one page; page_scheduler.py runs one per registered page,
+sharded across worker processes.
+
+Run with: python sync_daemon.py [--page-id ID] [--resources posts,conversations] [--once]
+"""
+
+import argparse
+import logging
+import os
+import random
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from models import Session, SyncJob, SyncState
+
+logger = logging.getLogger('fb_api')
+
+# sync_state resource type of the per-resource run checkpoints
+SYNC_DAEMON_RUNS = 'sync_daemon'
+
+# Seconds to wait before checking again when a sync is already running elsewhere
+BUSY_RETRY_SECONDS = 30
+
+# Shortest interval the freshness target can shrink a schedule to
+MIN_INTERVAL_SECONDS = 10
+
+
+class SyncStopped(Exception):
+    """
+    Raised from the progress callback once the daemon is shutting down
+    """
+
+
+def _sync_posts(fb_api) -> Dict:
+    posts_saved, comments_saved = fb_api.fetch_and_save_posts_with_comments(
+        posts_limit=int(os.getenv('SYNC_POSTS_LIMIT', '25')), incremental=True)
+    return {'posts': posts_saved, 'comments': comments_saved}
+
+
+def _sync_comments(fb_api) -> Dict:
+    posts_saved, comments_saved = fb_api.sync_stored_post_comments(
+        posts_limit=int(os.getenv('SYNC_COMMENT_WINDOW_POSTS', '100')))
+    return {'posts': posts_saved, 'comments': comments_saved}
+
+
+def _sync_replies(fb_api) -> Dict:
+    replies_saved = fb_api.sync_comment_replies(
+        comments_limit=int(os.getenv('SYNC_REPLY_WINDOW_COMMENTS', '200')))
+    return {'replies': replies_saved}
+
+
+def _sync_reconcile(fb_api) -> Dict:
+    from reconcile import CommentReconciler
+
+    stats = CommentReconciler(fb_api).run(int(os.getenv('SYNC_RECONCILE_POSTS', '100')))
+    return {'posts': stats['posts_updated'] + stats['posts_deleted'],
+            'comments': stats['comments_updated'] + stats['comments_deleted']}
+
+
+def _sync_conversations(fb_api) -> Dict:
+    from conversation_sync import ConversationSync
+
+    limit = os.getenv('SYNC_CONVERSATIONS_LIMIT')
+    stats = ConversationSync(fb_api).run(int(limit) if limit else None)
+    if stats['error']:
+        raise RuntimeError(stats['error'])
+    return {'conversations': stats['conversations_synced'], 'messages': stats['messages_saved']}
+
+
+class SyncSchedule:
+    def __init__(self, name: str, interval: float, sync: Callable, job_type: Optional[str] = None):
+        """
+        Initialize a resource schedule
+
+        Args:
+            name (str): Resource name, also the checkpoint id
+            interval (float): Seconds between the starts of two runs (before jitter)
+            sync (Callable): Function running one sync with a FacebookAPI instance
+            job_type (str): Background job type doing the same sync, if any
+        """
+        self.name = name
+        self.interval = interval
+        self.sync = sync
+        self.job_type = job_type
+        self.last_duration = 0.0
+
+
+def default_schedules() -> Dict[str, SyncSchedule]:
+    """
+    Schedules of every resource, with intervals from SYNC_<NAME>_INTERVAL
+    """
+    defaults = [
+        ('posts', 300, _sync_posts, 'fetch_posts'),
+        ('comments', 300, _sync_comments, None),
+        ('replies', 900, _sync_replies, None),
+        ('conversations', 120, _sync_conversations, 'fetch_messages'),
+        ('reconcile', 3600, _sync_reconcile, None),
+    ]
+    return {
+        name: SyncSchedule(name, float(os.getenv(f'SYNC_{name.upper()}_INTERVAL', str(interval))), sync, job_type)
+        for name, interval, sync, job_type in defaults
+    }
+
+
+class SyncDaemon:
+    def __init__(self, schedules: Optional[List[SyncSchedule]] = None, freshness_target: Optional[float] = None,
+                 jitter: Optional[float] = None, api_factory: Optional[Callable] = None,
+                 page_id: Optional[str] = None):
+        """
+        Initialize the daemon
+
+        Args:
+            schedules (list): Resource schedules to run (default: all of default_schedules())
+            freshness_target (float): Most seconds the stored data of a resource may lag
+                behind (default: SYNC_FRESHNESS_TARGET or 600)
+            jitter (float): Fraction by which intervals are randomly lengthened or
+                shortened (default: SYNC_JITTER or 0.2)
+            api_factory (Callable): Creates the FacebookAPI used for a run
+                (default: page_registry.api_for_page(page_id))
+            page_id (str): Page to sync (default: FACEBOOK_PAGE_ID); its checkpoints
+                are kept apart from other pages'
+        """
+        self.schedules = schedules if schedules is not None else list(default_schedules().values())
+        self.freshness_target = freshness_target or float(os.getenv('SYNC_FRESHNESS_TARGET', '600'))
+        self.jitter = jitter if jitter is not None else float(os.getenv('SYNC_JITTER', '0.2'))
+        self.api_factory = api_factory
+        self.page_id = page_id
+        self.label = f"Sync daemon for page {page_id}" if page_id else "Sync daemon"
+        self._stop = threading.Event()
+
+    def stop(self):
+        """
+        Ask every resource to stop after its current batch
+        """
+        if not self._stop.is_set():
+            logger.info(f"{self.label} stopping")
+        self._stop.set()
+
+    @property
+    def stopping(self) -> bool:
+        return self._stop.is_set()
+
+    def _new_api(self):
+        if self.api_factory:
+            return self.api_factory()
+        from page_registry import api_for_page
+        return api_for_page(self.page_id)
+
+    def _checkpoint_id(self, schedule: SyncSchedule) -> str:
+        return f"{self.page_id}:{schedule.name}" if self.page_id else schedule.name
+
+    def next_delay(self, schedule: SyncSchedule) -> float:
+        """
+        Jittered seconds until the next run, short enough that interval plus
+        run time stays within the freshness target
+        """
+        interval = min(schedule.interval, self.freshness_target - schedule.last_duration)
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        interval = min(interval, self.freshness_target - schedule.last_duration)
+        return max(interval, MIN_INTERVAL_SECONDS)
+
+    def last_run(self, schedule: SyncSchedule) -> Optional[datetime]:
+        """
+        When the last completed run of a resource started (UTC), from its checkpoint
+        """
+        session = Session()
+        try:
+            return session.query(SyncState.last_seen_time).filter_by(
+                resource_type=SYNC_DAEMON_RUNS, resource_id=self._checkpoint_id(schedule)).scalar()
+        finally:
+            session.close()
+
+    def _job_running(self, job_type: Optional[str]) -> bool:
+        if job_type is None:
+            return False
+        session = Session()
+        try:
+            query = session.query(SyncJob.id).filter(SyncJob.job_type == job_type, SyncJob.status == 'running')
+            if self.page_id and self.page_id != os.getenv('FACEBOOK_PAGE_ID'):
+                # Jobs for other pages than the default one carry a page_id parameter
+                query = query.filter(SyncJob.params.like(f'%"page_id": "{self.page_id}"%'))
+            return query.first() is not None
+        finally:
+            session.close()
+
+    def run_once(self, schedule: SyncSchedule) -> bool:
+        """
+        Run one sync of a resource and checkpoint it. Returns False if the
+        sync failed, was interrupted or was postponed.
+        """
+        if self._job_running(schedule.job_type):
+            logger.info(f"{self.label}: {schedule.name} sync already running as a background job, postponing")
+            return False
+
+        started_at = datetime.now(timezone.utc)
+        start = time.monotonic()
+        fb_api = self._new_api()
+
+        def progress_callback(progress, message='', **counts):
+            # Called after every saved batch, i.e. right after its watermarks were committed
+            if self.stopping:
+                raise SyncStopped(f"{schedule.name} sync stopped after {message or 'the current batch'}")
+
+        fb_api.set_progress_callback(progress_callback)
+        try:
+            result = schedule.sync(fb_api)
+            fb_api.set_watermark(SYNC_DAEMON_RUNS, self._checkpoint_id(schedule), started_at)
+            logger.info(f"{self.label}: {schedule.name} synced in {time.monotonic() - start:.1f}s: {result}")
+            return True
+        except SyncStopped as e:
+            logger.info(f"{self.label}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"{self.label}: {schedule.name} sync failed: {e}")
+            return False
+        finally:
+            schedule.last_duration = time.monotonic() - start
+            fb_api.session.close()
+
+    def _check_freshness(self, schedule: SyncSchedule):
+        last_run = self.last_run(schedule)
+        if last_run is None:
+            return
+        age = (datetime.now(timezone.utc).replace(tzinfo=None) - last_run).total_seconds()
+        if age > self.freshness_target:
+            logger.warning(f"{self.label}: {schedule.name} data is {age:.0f}s old, "
+                           f"above the {self.freshness_target:.0f}s freshness target")
+
+    def _run_schedule(self, schedule: SyncSchedule):
+        # Resume the schedule from the checkpoint; spread first runs of due resources
+        delay = random.uniform(0, self.jitter * MIN_INTERVAL_SECONDS)
+        last_run = self.last_run(schedule)
+        if last_run is not None:
+            elapsed = (datetime.now(timezone.utc).replace(tzinfo=None) - last_run).total_seconds()
+            delay = max(delay, self.next_delay(schedule) - elapsed)
+        logger.info(f"{self.label}: first {schedule.name} sync in {delay:.0f}s")
+
+        while not self._stop.wait(delay):
+            if self._job_running(schedule.job_type):
+                delay = BUSY_RETRY_SECONDS
+                continue
+            self.run_once(schedule)
+            self._check_freshness(schedule)
+            delay = self.next_delay(schedule)
+
+    def run(self):
+        """
+        Run every schedule until stop() is called
+        """
+        threads = [
+            threading.Thread(target=self._run_schedule, args=(schedule,),
+                             name=f'sync-{self.page_id}-{schedule.name}' if self.page_id else f'sync-{schedule.name}')
+            for schedule in self.schedules
+        ]
+        logger.info(f"{self.label} started: {', '.join(s.name for s in self.schedules)}, "
+                    f"freshness target {self.freshness_target:.0f}s")
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.info(f"{self.label} stopped")
+
+
+def main():
+    schedules = default_schedules()
+    parser = argparse.ArgumentParser(description='Continuously sync Facebook data into the database')
+    parser.add_argument('--page-id', default=None,
+                        help='Registered page to sync (default: FACEBOOK_PAGE_ID)')
+    parser.add_argument('--resources', default=','.join(schedules),
+                        help=f"Comma-separated resources to sync (default: {','.join(schedules)})")
+    parser.add_argument('--freshness', type=float, default=None,
+                        help='Freshness target in seconds (default: SYNC_FRESHNESS_TARGET or 600)')
+    parser.add_argument('--once', action='store_true',
+                        help='Sync every resource once and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(levelname)s: %(message)s')
+
+    names = [name.strip() for name in args.resources.split(',') if name.strip()]
+    unknown = [name for name in names if name not in schedules]
+    if unknown:
+        parser.error(f"Unknown resources: {', '.join(unknown)}")
+
+    daemon = SyncDaemon([schedules[name] for name in names], freshness_target=args.freshness, page_id=args.page_id)
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+
+    if args.once:
+        for name in names:
+            if daemon.stopping:
+                break
+            daemon.run_once(schedules[name])
+        return
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Tests for the bulk ingestion helpers (bulk_ingest.py) on a temporary SQLite database.
+
+Run with: python test_bulk_ingest.py (or pytest test_bulk_ingest.py)
+"""
+
+import os
+import tempfile
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import bulk_ingest
+from bulk_ingest import existing_keys, insert_ignore, upsert, upsert_max
+from models import Base, Conversation, SyncState
+
+
+def temp_session():
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}")
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def conversation(conversation_id, snippet, updated_time=None):
+    return {'conversation_id': conversation_id, 'snippet': snippet, 'updated_time': updated_time or datetime.now()}
+
+
+def snippets(session):
+    return dict(session.query(Conversation.conversation_id, Conversation.snippet).all())
+
+
+def test_insert_ignore_skips_conflicting_rows():
+    session = temp_session()
+    insert_ignore(session, Conversation, [conversation('t1', 'Hi'), conversation('t2', 'Hello')],
+                  ['conversation_id'])
+    session.commit()
+
+    insert_ignore(session, Conversation, [conversation('t2', 'Changed'), conversation('t3', 'Hey')],
+                  ['conversation_id'])
+    session.commit()
+
+    assert snippets(session) == {'t1': 'Hi', 't2': 'Hello', 't3': 'Hey'}
+    session.close()
+
+
+def test_insert_ignore_in_chunks():
+    session = temp_session()
+    rows = [conversation(f"t{i}", f"Message {i}") for i in range(25)]
+    insert_ignore(session, Conversation, rows, ['conversation_id'], batch_size=10)
+    insert_ignore(session, Conversation, rows, ['conversation_id'], batch_size=10)
+    session.commit()
+
+    assert len(snippets(session)) == 25
+    assert existing_keys(session, Conversation.conversation_id, ['t0', 't24', 'missing'], batch_size=2) == \
+        {'t0', 't24'}
+    session.close()
+
+
+def test_upsert_overwrites_update_columns_only():
+    session = temp_session()
+    first = datetime(2024, 1, 1)
+    upsert(session, Conversation, [dict(conversation('t1', 'Hi', first), participants='u1')],
+           ['conversation_id'], ['snippet', 'updated_time'])
+    upsert(session, Conversation, [conversation('t1', 'Hi again'), conversation('t2', 'Hello')],
+           ['conversation_id'], ['snippet', 'updated_time'])
+    session.commit()
+
+    stored = session.query(Conversation).filter_by(conversation_id='t1').one()
+    assert stored.snippet == 'Hi again'
+    assert stored.participants == 'u1'
+    assert stored.updated_time > first
+    assert snippets(session) == {'t1': 'Hi again', 't2': 'Hello'}
+    session.close()
+
+
+def test_upsert_max_keeps_the_larger_value():
+    session = temp_session()
+    state = {'resource_type': 'page_posts', 'resource_id': 'pg'}
+    upsert_max(session, SyncState, [dict(state, last_seen_time=datetime(2024, 1, 2))],
+               ['resource_type', 'resource_id'], 'last_seen_time')
+    upsert_max(session, SyncState, [dict(state, last_seen_time=datetime(2024, 1, 1))],
+               ['resource_type', 'resource_id'], 'last_seen_time')
+    session.commit()
+    assert session.query(SyncState.last_seen_time).scalar() == datetime(2024, 1, 2)
+
+    upsert_max(session, SyncState, [dict(state, last_seen_time=datetime(2024, 1, 3))],
+               ['resource_type', 'resource_id'], 'last_seen_time')
+    session.commit()
+    assert session.query(SyncState.last_seen_time).scalar() == datetime(2024, 1, 3)
+    session.close()
+
+
+def test_fallback_without_on_conflict_support():
+    session = temp_session()
+    dialects = bulk_ingest._UPSERT_DIALECTS
+    bulk_ingest._UPSERT_DIALECTS = {}
+    try:
+        assert insert_ignore(session, Conversation, [conversation('t1', 'Hi')], ['conversation_id']) == 1
+        # Only the rows that are not stored yet are inserted
+        assert insert_ignore(session, Conversation, [conversation('t1', 'Changed'), conversation('t2', 'Hello')],
+                             ['conversation_id']) == 1
+        # Callers fall back to their per-row path
+        assert upsert(session, Conversation, [conversation('t1', 'Changed')], ['conversation_id'],
+                      ['snippet']) is None
+        assert upsert_max(session, SyncState, [{'resource_type': 'page_posts', 'resource_id': 'pg'}],
+                          ['resource_type', 'resource_id'], 'last_seen_time') is None
+        session.commit()
+    finally:
+        bulk_ingest._UPSERT_DIALECTS = dialects
+
+    assert snippets(session) == {'t1': 'Hi', 't2': 'Hello'}
+    session.close()
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name}: OK")
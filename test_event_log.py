@@ -0,0 +1,121 @@
+"""
+Tests for the append-only webhook event log (event_log.py) in a temporary directory.
+
+Run with: python test_event_log.py (or pytest test_event_log.py)
+"""
+
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+
+from event_log import HEADER, EventLog
+
+
+def temp_log(**kwargs):
+    return EventLog(tempfile.mkdtemp(), **kwargs)
+
+
+def bodies(records):
+    return [record.body for record in records]
+
+
+def test_appends_get_increasing_offsets():
+    log = temp_log()
+    assert [log.append(f"payload {i}".encode()) for i in range(3)] == [0, 1, 2]
+    assert bodies(log.read()) == [b'payload 0', b'payload 1', b'payload 2']
+
+    # A reopened log continues after the last record
+    reopened = EventLog(log.directory)
+    assert reopened.next_offset == 3
+    assert reopened.append(b'payload 3') == 3
+
+
+def test_torn_tail_record_is_truncated_on_open():
+    log = temp_log()
+    log.append(b'first')
+    log.append(b'second')
+    [segment] = log.segments()
+    intact_size = os.path.getsize(segment)
+
+    # A crash in the middle of writing the third record
+    with open(segment, 'ab') as f:
+        f.write(HEADER.pack(2, 0.0, 100, 0) + b'only part of the bo')
+    assert bodies(log.read()) == [b'first', b'second']
+
+    reopened = EventLog(log.directory)
+    assert os.path.getsize(segment) == intact_size
+    assert reopened.append(b'third') == 2
+    assert bodies(reopened.read()) == [b'first', b'second', b'third']
+
+
+def test_corrupt_record_ends_the_read():
+    log = temp_log()
+    log.append(b'first')
+    log.append(b'second')
+    [segment] = log.segments()
+    with open(segment, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'X')
+    assert bodies(log.read()) == [b'first']
+
+
+def test_oversized_bodies_are_not_logged():
+    log = temp_log(max_body_bytes=10)
+    assert log.append(b'0123456789') == 0
+    with pytest.raises(ValueError):
+        log.append(b'0123456789!')
+    # The rejected body takes no offset
+    assert log.append(b'small') == 1
+    assert bodies(log.read()) == [b'0123456789', b'small']
+
+
+def test_segments_rotate_at_segment_bytes():
+    log = temp_log(segment_bytes=3 * (HEADER.size + 10))
+    for i in range(10):
+        log.append(f"payload {i:02d}".encode())
+
+    names = [os.path.basename(path) for path in log.segments()]
+    assert names == [f"{base:020d}.log" for base in (0, 3, 6, 9)]
+    assert [record.offset for record in log.read()] == list(range(10))
+
+
+def test_expired_segments_are_deleted_on_rotation():
+    log = temp_log(segment_bytes=HEADER.size + 1, retention_days=1)
+    log.append(b'a')
+    [old] = log.segments()
+    os.utime(old, (0, 0))
+    log.append(b'b')
+    assert old not in log.segments()
+    assert bodies(log.read()) == [b'b']
+
+
+def test_read_offset_and_time_ranges():
+    log = temp_log(segment_bytes=2 * (HEADER.size + 1))
+    for i in range(8):
+        log.append(str(i).encode(), timestamp=1000.0 + i)
+
+    assert bodies(log.read(3, 6)) == [b'3', b'4', b'5']
+    assert bodies(log.read(6)) == [b'6', b'7']
+    assert bodies(log.read(end_offset=2)) == [b'0', b'1']
+    assert bodies(log.read(since=datetime.fromtimestamp(1002.0), until=datetime.fromtimestamp(1005.0))) == \
+        [b'2', b'3', b'4']
+    assert bodies(log.read(20)) == []
+
+
+def test_two_writers_share_one_sequence():
+    log = temp_log()
+    other = EventLog(log.directory)
+    assert log.append(b'a') == 0
+    # The other writer catches up with records it did not write
+    assert other.append(b'b') == 1
+    assert log.append(b'c') == 2
+    assert bodies(log.read()) == [b'a', b'b', b'c']
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name}: OK")
@@ -0,0 +1,102 @@
+"""
+Tests for applying comment adds, edits and removals from feed webhooks
+(webhook_processor.handle_feed_comment) on a temporary SQLite database,
+with posts read from fake_graph_server.py.
+
+Run with: python test_feed_webhooks.py (or pytest test_feed_webhooks.py)
+"""
+
+from datetime import datetime
+
+import pytest
+
+from fb_api import content_hash
+from models import Comment, CommentReply, Post, ResponseDraft, Session
+from webhook_processor import handle_feed_comment
+
+
+def change(verb, comment_id, message='', post_id='PG_3', parent_id=None, created_time=1700000000):
+    return {'item': 'comment', 'verb': verb, 'post_id': post_id, 'comment_id': comment_id,
+            'parent_id': parent_id or post_id, 'message': message, 'created_time': created_time,
+            'from': {'id': 'fan_1', 'name': 'Fan 1'}}
+
+
+def stored(model, **filters):
+    session = Session()
+    try:
+        rows = session.query(model).filter_by(**filters).all()
+        session.expunge_all()
+        return rows
+    finally:
+        session.close()
+
+
+def test_comment_on_an_unknown_post_stores_the_post(fake_graph):
+    handle_feed_comment(change('add', 'PG_3_c90', 'I love this, great quality'), 'PG')
+
+    [post] = stored(Post, post_id='PG_3')
+    # Read from the Graph API, since the post was never synced
+    assert post.message == fake_graph.data.post('PG', 3)['message']
+    assert post.page_id == 'PG'
+    [comment] = stored(Comment, comment_id='PG_3_c90')
+    assert comment.post_id == 'PG_3'
+    assert comment.user_name == 'Fan 1'
+    assert comment.created_time == datetime(2023, 11, 14, 22, 13, 20)
+    assert post.avg_sentiment == pytest.approx(comment.sentiment_score)
+
+
+def test_edit_rewrites_the_analysis(fake_graph):
+    handle_feed_comment(change('add', 'PG_3_c90', 'I love this, great quality'), 'PG')
+    [before] = stored(Comment, comment_id='PG_3_c90')
+
+    handle_feed_comment(change('edited', 'PG_3_c90', 'Terrible, it arrived broken', created_time=1700000600), 'PG')
+
+    [after] = stored(Comment, comment_id='PG_3_c90')
+    assert after.message == 'Terrible, it arrived broken'
+    assert after.content_hash == content_hash('Terrible, it arrived broken')
+    assert after.sentiment_score < before.sentiment_score
+    assert after.sentiment_category != before.sentiment_category
+    # The original creation time is kept
+    assert after.created_time == before.created_time
+    [post] = stored(Post, post_id='PG_3')
+    assert post.avg_sentiment == pytest.approx(after.sentiment_score)
+
+
+def test_remove_deletes_the_comment_with_its_replies_and_drafts(fake_graph):
+    handle_feed_comment(change('add', 'PG_3_c90', 'I love this'), 'PG')
+    handle_feed_comment(change('add', 'PG_3_c91', 'Terrible, it arrived broken'), 'PG')
+    handle_feed_comment(change('add', 'PG_3_c90_r1', 'Me too', parent_id='PG_3_c90'), 'PG')
+    session = Session()
+    try:
+        session.add(ResponseDraft(comment_id='PG_3_c90', message='Thank you!'))
+        session.commit()
+    finally:
+        session.close()
+    assert len(stored(CommentReply, comment_id='PG_3_c90')) == 1
+
+    handle_feed_comment(change('remove', 'PG_3_c90'), 'PG')
+
+    assert stored(Comment, comment_id='PG_3_c90') == []
+    assert stored(CommentReply, comment_id='PG_3_c90') == []
+    assert stored(ResponseDraft, comment_id='PG_3_c90') == []
+    # The average only counts the remaining comment
+    [remaining] = stored(Comment, post_id='PG_3')
+    [post] = stored(Post, post_id='PG_3')
+    assert post.avg_sentiment == pytest.approx(remaining.sentiment_score)
+
+
+def test_reply_to_an_unknown_comment_is_skipped(fake_graph):
+    handle_feed_comment(change('add', 'PG_3_c90', 'I love this'), 'PG')
+
+    handle_feed_comment(change('add', 'PG_3_c77_r1', 'Me too', parent_id='PG_3_c77'), 'PG')
+    assert stored(CommentReply) == []
+
+    # Replies to stored comments are saved and edited in place
+    handle_feed_comment(change('add', 'PG_3_c90_r1', 'Me too', parent_id='PG_3_c90'), 'PG')
+    handle_feed_comment(change('edited', 'PG_3_c90_r1', 'Me too!', parent_id='PG_3_c90'), 'PG')
+    [reply] = stored(CommentReply)
+    assert (reply.reply_id, reply.message) == ('PG_3_c90_r1', 'Me too!')
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
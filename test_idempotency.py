@@ -0,0 +1,130 @@
+"""
+Tests for webhook event deduplication (idempotency.py, webhook_queue.py)
+on a temporary SQLite database.
+
+Run with: python test_idempotency.py (or pytest test_idempotency.py)
+"""
+
+import pytest
+
+import idempotency
+import webhook_queue
+from conftest import drain, message
+from idempotency import IdempotencyIndex, event_key
+from models import ProcessedEvent, Session, WebhookEvent
+from webhook_queue import WEBHOOK_PARTITIONS, WebhookWorker, enqueue_events
+
+
+@pytest.fixture
+def handled(temp_database, monkeypatch):
+    """
+    Record handled message payloads, in order, instead of answering them
+    """
+    payloads = []
+    monkeypatch.setitem(webhook_queue.EVENT_HANDLERS, 'messaging',
+                        lambda event, page_id=None: payloads.append(event))
+    return payloads
+
+
+def statuses():
+    session = Session()
+    try:
+        return [status for (status,) in session.query(WebhookEvent.status).order_by(WebhookEvent.id)]
+    finally:
+        session.close()
+
+
+def test_event_keys():
+    assert event_key('messaging', message('m1')[3]) == 'mid:m1'
+    assert event_key('messaging', {'sender': {'id': 'u1'}, 'read': {'watermark': 1}}) is None
+
+    change = {'verb': 'edited', 'comment_id': 'c1', 'message': 'first', 'created_time': 1700000000}
+    assert event_key('feed', change) == event_key('feed', dict(change))
+    # An edit is a new event when the text changes
+    assert event_key('feed', change) != event_key('feed', dict(change, message='second'))
+    assert event_key('feed', change) != event_key('feed', dict(change, verb='add'))
+    # ... and when it is made later, even back to an earlier text
+    assert event_key('feed', change) != event_key('feed', dict(change, created_time=1700000060))
+    assert event_key('feed', dict(change, created_time=None)) is None
+
+
+def test_edit_back_to_an_earlier_text_is_not_dropped(temp_database, monkeypatch):
+    edited = []
+    monkeypatch.setitem(webhook_queue.EVENT_HANDLERS, 'feed', lambda event, page_id=None: edited.append(event['message']))
+    for i, text in enumerate(['A', 'B', 'A', 'B']):
+        edit = {'item': 'comment', 'verb': 'edited', 'comment_id': 'c1', 'post_id': 'p1', 'message': text,
+                'created_time': 1700000000 + i}
+        enqueue_events([('feed', 'pg', 'p1', edit)])
+        # Facebook redelivers the same edit
+        enqueue_events([('feed', 'pg', 'p1', edit)])
+        drain()
+    assert edited == ['A', 'B', 'A', 'B']
+
+
+def test_duplicates_in_one_delivery_are_queued_once(handled):
+    assert len(enqueue_events([message('m1'), message('m1'), message('m2')])) == 2
+
+
+def test_redelivery_of_a_handled_event_is_dropped_when_queued(handled):
+    enqueue_events([message('m1')])
+    drain()
+    assert len(handled) == 1
+
+    assert enqueue_events([message('m1')]) == []
+    drain()
+    assert len(handled) == 1
+    assert statuses() == ['done']
+
+
+def test_redelivery_queued_before_the_first_is_handled_is_skipped(handled):
+    # Both deliveries arrive while neither has been handled yet
+    enqueue_events([message('m1')])
+    enqueue_events([message('m1')])
+    assert statuses() == ['queued', 'queued']
+
+    drain()
+    assert len(handled) == 1
+    assert statuses() == ['done', 'duplicate']
+
+
+def test_failed_events_are_not_marked_processed(handled, monkeypatch):
+    def fail(event, page_id=None):
+        raise RuntimeError('handler failed')
+
+    monkeypatch.setitem(webhook_queue.EVENT_HANDLERS, 'messaging', fail)
+    enqueue_events([message('m1')])
+    WebhookWorker(list(range(WEBHOOK_PARTITIONS)), worker_id='test', max_attempts=1).poll()
+    assert statuses() == ['failed']
+    assert not idempotency.get_idempotency_index().is_processed('mid:m1')
+    # A redelivery gets another chance
+    assert len(enqueue_events([message('m1')])) == 1
+
+
+def test_processed_keys_survive_a_restart(handled, monkeypatch):
+    enqueue_events([message('m1')])
+    drain()
+
+    # A new process starts with an empty cache and reads the table
+    monkeypatch.setattr(idempotency, '_index', IdempotencyIndex())
+    assert idempotency.get_idempotency_index().is_processed('mid:m1')
+    assert enqueue_events([message('m1')]) == []
+
+    assert idempotency.prune_processed(0) == 1
+    session = Session()
+    try:
+        assert session.query(ProcessedEvent).count() == 0
+    finally:
+        session.close()
+
+
+def test_cache_is_bounded(temp_database):
+    index = IdempotencyIndex(capacity=2)
+    for key in ('a', 'b', 'c'):
+        index.mark_processed(key, 'messaging')
+    assert list(index._recent) == ['b', 'c']
+    # Evicted keys are still found in the table
+    assert index.processed(['a', 'b', 'c', 'd']) == {'a', 'b', 'c'}
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
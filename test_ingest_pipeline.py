@@ -0,0 +1,132 @@
+"""
+Tests for the pipelined post ingestion (ingest_pipeline.py).
+
+The API is replaced by a stand-in whose parse/analyze/save steps record
+what they were given, so no database or Graph access is needed.
+
+Run with: python test_ingest_pipeline.py (or pytest test_ingest_pipeline.py)
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+from ingest_pipeline import IngestPipeline
+
+BASE_TIME = datetime(2024, 1, 1)
+
+
+class Cancelled(Exception):
+    pass
+
+
+class RecordingAPI:
+    save_batch_size = 3
+
+    def __init__(self, fail_parse=(), cancel_after=None):
+        self.fail_parse = set(fail_parse)
+        self.cancel_after = cancel_after
+        self.batches = []
+        self.progress = []
+
+    def parse_post_with_comments_data(self, raw_post):
+        if raw_post['id'] in self.fail_parse:
+            raise ValueError(f"Cannot parse {raw_post['id']}")
+        return dict(raw_post, parsed=True)
+
+    def analyze_post_with_comments(self, post):
+        return dict(post, analyzed=True)
+
+    def bulk_save_posts_with_comments(self, posts):
+        assert all(post['parsed'] and post['analyzed'] for post in posts)
+        self.batches.append([post['id'] for post in posts])
+        return len(posts), sum(len(post['comments']) for post in posts)
+
+    def _report_sync_progress(self, posts_saved, comments_saved, posts_limit):
+        self.progress.append((posts_saved, comments_saved, posts_limit))
+        if self.cancel_after is not None and posts_saved >= self.cancel_after:
+            raise Cancelled()
+
+
+def raw_posts(count):
+    return [{'id': f"p{i}", 'created_time': BASE_TIME + timedelta(hours=i), 'comments': ['c1', 'c2']}
+            for i in range(count)]
+
+
+def saved_ids(api):
+    return sorted(post_id for batch in api.batches for post_id in batch)
+
+
+def test_every_post_is_saved_in_batches():
+    api = RecordingAPI()
+    result = IngestPipeline(api, parse_workers=2, analyze_workers=2).run(raw_posts(7), expected_posts=7)
+
+    assert result['posts_saved'] == 7
+    assert result['comments_saved'] == 14
+    assert not result['failed']
+    assert result['newest_post_time'] == BASE_TIME + timedelta(hours=6)
+    assert saved_ids(api) == sorted(f"p{i}" for i in range(7))
+    assert all(len(batch) <= api.save_batch_size for batch in api.batches)
+    # Progress is reported after every batch
+    assert len(api.progress) == len(api.batches)
+    assert api.progress[-1] == (7, 14, 7)
+
+
+def test_post_failing_a_stage_is_skipped():
+    api = RecordingAPI(fail_parse={'p2'})
+    result = IngestPipeline(api).run(raw_posts(5))
+
+    assert result['posts_saved'] == 4
+    assert 'p2' not in saved_ids(api)
+
+
+def test_fetch_failure_keeps_the_posts_read_so_far():
+    def posts():
+        yield from raw_posts(4)
+        raise ConnectionError('Graph went away')
+
+    api = RecordingAPI()
+    result = IngestPipeline(api).run(posts())
+
+    assert result['posts_saved'] == 4
+    assert result['failed']
+
+
+def test_cancellation_stops_every_stage():
+    closed = []
+
+    def slow_posts():
+        try:
+            for post in raw_posts(100):
+                time.sleep(0.01)
+                yield post
+        finally:
+            closed.append(True)
+
+    api = RecordingAPI(cancel_after=3)
+    pipeline = IngestPipeline(api, parse_workers=2, analyze_workers=2, queue_size=2)
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = pipeline.run(slow_posts())
+        except Cancelled as e:
+            outcome['error'] = e
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(timeout=10)
+
+    assert not runner.is_alive(), 'pipeline did not stop after the writer was cancelled'
+    assert isinstance(outcome.get('error'), Cancelled)
+    # The fetch iterator is closed rather than drained
+    assert closed == [True]
+    assert saved_ids(api) and len(saved_ids(api)) < 100
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('ingest-')]
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name}: OK")
@@ -0,0 +1,154 @@
+"""
+Tests for persistent background sync jobs (job_runner.py) on a temporary
+SQLite database: deduplication, cancellation and recovery of jobs whose
+worker stopped.
+
+Run with: python test_job_runner.py (or pytest test_job_runner.py)
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import job_runner
+from job_runner import JobWorker, cancel_job, enqueue_job, get_job, requeue_stale_jobs
+from models import Session, SyncJob
+
+
+@pytest.fixture
+def jobs(temp_database, monkeypatch):
+    """
+    Register a 'test' job type whose behaviour each test sets through jobs.run
+    """
+    class Jobs:
+        run = None
+
+    def handler(context, **params):
+        return Jobs.run(context, **params)
+
+    monkeypatch.setitem(job_runner.JOB_HANDLERS, 'test', handler)
+    return Jobs
+
+
+def run_next_job(**kwargs):
+    worker = JobWorker(worker_id='test', **kwargs)
+    job = worker.claim_next_job()
+    assert job is not None
+    worker.run_job(job)
+    return get_job(job.id)
+
+
+def test_identical_jobs_are_queued_once(jobs):
+    job_id, created = enqueue_job('test', {'limit': 10})
+    assert created
+    assert enqueue_job('test', {'limit': 10}) == (job_id, False)
+    assert enqueue_job('test', {'limit': 20})[1]
+
+    # Once the job has finished, the same sync can be queued again
+    jobs.run = lambda context, limit: {'limit': limit}
+    job = run_next_job()
+    assert (job['status'], job['result']) == ('succeeded', {'limit': 10})
+    assert enqueue_job('test', {'limit': 10})[0] != job_id
+
+
+def test_concurrent_requests_create_one_job(jobs):
+    results = []
+
+    def request():
+        results.append(enqueue_job('test', {'limit': 10}))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({job_id for job_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+    session = Session()
+    try:
+        assert session.query(SyncJob).count() == 1
+    finally:
+        session.close()
+
+
+def test_cancelled_job_stops_at_its_next_progress_update(jobs):
+    steps = []
+
+    def run(context):
+        for step in range(10):
+            if step == 2:
+                # The user presses cancel while the job is running
+                assert cancel_job(context.job_id)
+            context.update_progress(None, f"Step {step}")
+            steps.append(step)
+
+    jobs.run = run
+    job_id, _ = enqueue_job('test')
+    job = run_next_job()
+
+    assert steps == [0, 1]
+    assert job['status'] == 'cancelled'
+    # A new sync can be queued right away
+    assert enqueue_job('test')[0] != job_id
+
+
+def test_queued_job_is_cancelled_immediately(jobs):
+    job_id, _ = enqueue_job('test')
+    assert cancel_job(job_id)
+    assert get_job(job_id)['status'] == 'cancelled'
+    assert JobWorker(worker_id='test').claim_next_job() is None
+    # Finished jobs cannot be cancelled again
+    assert not cancel_job(job_id)
+
+
+def test_failed_job_records_the_error(jobs):
+    def run(context):
+        raise RuntimeError('Graph is down')
+
+    jobs.run = run
+    enqueue_job('test')
+    job = run_next_job()
+    assert job['status'] == 'failed'
+    assert 'RuntimeError: Graph is down' in job['error']
+
+
+def test_job_of_a_silent_worker_is_requeued(jobs):
+    job_id, _ = enqueue_job('test')
+    JobWorker(worker_id='gone').claim_next_job()
+    session = Session()
+    try:
+        session.query(SyncJob).filter_by(id=job_id).update(
+            {'heartbeat_at': datetime.now() - timedelta(minutes=20)})
+        session.commit()
+    finally:
+        session.close()
+
+    assert requeue_stale_jobs(timeout=600) == 1
+    assert get_job(job_id)['status'] == 'queued'
+
+    jobs.run = lambda context: 'done'
+    assert run_next_job()['status'] == 'succeeded'
+
+
+def test_heartbeats_continue_while_a_job_is_blocked(jobs):
+    requeued = []
+
+    def run(context):
+        # No progress updates for longer than the stale timeout, e.g. while
+        # waiting out a rate limit block
+        time.sleep(0.6)
+        requeued.append(requeue_stale_jobs(timeout=0.3))
+
+    jobs.run = run
+    enqueue_job('test')
+    job = run_next_job(heartbeat_interval=0.1)
+
+    assert requeued == [0]
+    assert job['status'] == 'succeeded'
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
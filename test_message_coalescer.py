@@ -0,0 +1,104 @@
+"""
+Tests for coalescing Messenger message bursts into one reply
+(message_coalescer.py, webhook_processor.py) on a temporary SQLite database.
+
+OpenAI and the Send API are replaced by stand-ins that record their calls.
+
+Run with: python test_message_coalescer.py (or pytest test_message_coalescer.py)
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import webhook_processor
+from conftest import drain, message
+from message_coalescer import REPLY_EVENT
+from models import Message, MessageResponse, Session, WebhookEvent
+from webhook_queue import enqueue_events
+
+
+def reply_events():
+    session = Session()
+    try:
+        events = session.query(WebhookEvent).filter_by(event_type=REPLY_EVENT).order_by(WebhookEvent.id).all()
+        session.expunge_all()
+        return events
+    finally:
+        session.close()
+
+
+def test_burst_is_added_to_one_pending_reply(messenger_stubs):
+    messenger_stubs.use_coalescer(window=3, max_wait=15)
+    coalescer = webhook_processor.get_message_coalescer()
+    first = coalescer.add_message('pg', 'u1', 'pg', 'm1')
+    assert coalescer.add_message('pg', 'u1', 'pg', 'm2') == first
+    assert coalescer.add_message('pg', 'u1', 'pg', 'm3') == first
+
+    [event] = reply_events()
+    assert json.loads(event.payload)['message_ids'] == ['m1', 'm2', 'm3']
+    # Due one window after the latest message
+    assert datetime.now() + timedelta(seconds=2) < event.available_at <= datetime.now() + timedelta(seconds=3)
+
+
+def test_reply_waits_at_most_max_wait_after_the_first_message(messenger_stubs):
+    messenger_stubs.use_coalescer(window=10, max_wait=1)
+    coalescer = webhook_processor.get_message_coalescer()
+    coalescer.add_message('pg', 'u1', 'pg', 'm1')
+    coalescer.add_message('pg', 'u1', 'pg', 'm2')
+
+    [event] = reply_events()
+    assert event.available_at == event.created_at + timedelta(seconds=1)
+
+
+def test_senders_and_claimed_replies_get_their_own_reply(messenger_stubs):
+    coalescer = webhook_processor.get_message_coalescer()
+    first = coalescer.add_message('pg', 'u1', 'pg', 'm1')
+    assert coalescer.add_message('pg', 'u2', 'pg', 'm2') != first
+
+    # A reply already being handled is not extended
+    session = Session()
+    try:
+        session.query(WebhookEvent).filter_by(id=first).update({'status': 'processing'})
+        session.commit()
+    finally:
+        session.close()
+    assert coalescer.add_message('pg', 'u1', 'pg', 'm3') != first
+    assert len(reply_events()) == 3
+
+
+def test_burst_is_answered_with_one_call_and_one_send(messenger_stubs):
+    messenger_stubs.use_coalescer(window=0.3, max_wait=5)
+    prompts, sends = messenger_stubs.prompts, messenger_stubs.sends
+    enqueue_events([message('m1', 'hi')])
+    enqueue_events([message('m2', 'I have a question')])
+    enqueue_events([message('m3', 'about my order')])
+    drain()
+    assert prompts == [] and sends == []
+
+    time.sleep(0.4)
+    drain()
+    assert prompts == ['hi\nI have a question\nabout my order']
+    assert sends == [('pg', 'u1', 'Thanks, we will get back to you')]
+
+    session = Session()
+    try:
+        responses = session.query(MessageResponse).order_by(MessageResponse.id).all()
+        assert [response.message_id for response in responses] == ['m1', 'm2', 'm3']
+        # Usage is recorded once per reply
+        assert sum(response.tokens_used for response in responses) == 10
+        assert session.query(Message).filter_by(is_ai_generated=True).count() == 1
+    finally:
+        session.close()
+
+    # A redelivered message of the burst does not trigger a second reply
+    assert enqueue_events([message('m2', 'I have a question')]) == []
+    time.sleep(0.4)
+    drain()
+    assert len(prompts) == 1 and len(sends) == 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
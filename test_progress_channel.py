@@ -0,0 +1,88 @@
+"""
+Tests for following sync job progress (progress_channel.py and the SSE
+route) on a temporary SQLite database.
+
+Run with: python test_progress_channel.py (or pytest test_progress_channel.py)
+"""
+
+import re
+import threading
+
+import pytest
+
+import job_runner
+from job_runner import JobWorker, enqueue_job
+from progress_channel import tail
+
+
+@pytest.fixture
+def job(temp_database, monkeypatch):
+    """
+    Queue a job that reports three steps once `proceed` is set
+    """
+    proceed = threading.Event()
+
+    def run(context):
+        proceed.wait(10)
+        for step in range(1, 4):
+            context.update_progress(None, f"Step {step}", posts=step)
+        return {'posts_saved': 3}
+
+    monkeypatch.setitem(job_runner.JOB_HANDLERS, 'test', run)
+    job_id, _ = enqueue_job('test')
+    worker = JobWorker(worker_id='test', heartbeat_interval=60)
+    thread = threading.Thread(target=lambda: worker.run_job(worker.claim_next_job()), daemon=True)
+    thread.start()
+    yield job_id, proceed
+    proceed.set()
+    thread.join(10)
+
+
+def test_tail_follows_the_job_until_it_finishes(job):
+    job_id, proceed = job
+    events = []
+    for event in tail(job_id, poll_interval=0.05, timeout=10):
+        events.append(event)
+        if len(events) == 1:
+            # The reader is waiting before the job reports anything
+            proceed.set()
+
+    assert [event['message'] for event in events] == ['Started test', 'Step 1', 'Step 2', 'Step 3',
+                                                      'Job succeeded']
+    assert events[-1]['status'] == 'succeeded'
+    assert events[2]['posts'] == 2 and 'eta_seconds' in events[2]
+    assert [event['id'] for event in events] == sorted(event['id'] for event in events)
+
+
+def test_tail_resumes_after_the_last_event_seen(job):
+    job_id, proceed = job
+    proceed.set()
+    events = list(tail(job_id, poll_interval=0.05, timeout=10))
+
+    # A reconnecting reader gets only what it missed, and the stream ends
+    # right away because the job has finished
+    resumed = list(tail(job_id, after_id=events[2]['id'], poll_interval=0.05, timeout=10))
+    assert resumed == events[3:]
+    assert list(tail(job_id, after_id=events[-1]['id'])) == []
+
+
+def test_sse_stream_resumes_after_last_event_id(job, monkeypatch):
+    # Importing app must not start workers that would claim the test job
+    monkeypatch.setenv('SYNC_JOB_EMBEDDED_WORKER', 'false')
+    monkeypatch.setenv('WEBHOOK_EMBEDDED_WORKERS', 'false')
+    from app import app
+
+    job_id, proceed = job
+    proceed.set()
+    events = list(tail(job_id, poll_interval=0.05, timeout=10))
+
+    response = app.test_client().get(f'/fetch-posts-with-progress?job_id={job_id}',
+                                     headers={'Last-Event-ID': str(events[1]['id'])})
+    body = response.get_data(as_text=True)
+    assert [int(event_id) for event_id in re.findall(r'^id: (\d+)$', body, re.M)] == \
+        [event['id'] for event in events[2:]]
+    assert 'event: close' in body and '"status": "succeeded"' in body
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,155 @@
+"""
+Tests for reconciling stored posts and comments with Facebook
+(reconcile.py) on a temporary SQLite database, against fake_graph_server.py.
+
+Run with: python test_reconcile.py (or pytest test_reconcile.py)
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from fake_graph_server import graph_error
+from fb_api import FacebookAPI, content_hash, parse_graph_time, to_utc_naive
+from models import Comment, CommentReply, Post, ResponseDraft, Session
+from reconcile import DELETE_GRACE_PERIOD, CommentReconciler
+
+
+def store_page(data, posts=3):
+    """
+    Save the first posts of page PG with all their comments, as a sync would
+    """
+    session = Session()
+    try:
+        for i in range(posts):
+            post = data.post('PG', i)
+            session.add(Post(page_id='PG', post_id=post['id'], message=post['message'],
+                             created_time=to_utc_naive(parse_graph_time(post['created_time'])),
+                             avg_sentiment=0.0, content_hash=content_hash(post['message'])))
+            for j in range(data.comments):
+                comment = data.comment(post['id'], j)
+                session.add(Comment(post_id=post['id'], comment_id=comment['id'], message=comment['message'],
+                                    created_time=to_utc_naive(parse_graph_time(comment['created_time'])),
+                                    user_name=comment['from']['name'], sentiment_score=0.0,
+                                    sentiment_category='neutral', content_hash=content_hash(comment['message'])))
+        session.commit()
+    finally:
+        session.close()
+
+
+def add_comment(post_id, comment_id, created_time):
+    session = Session()
+    try:
+        session.add(Comment(post_id=post_id, comment_id=comment_id, message='Where is my order?',
+                            created_time=created_time, user_name='Fan', sentiment_score=0.0,
+                            sentiment_category='neutral', content_hash=content_hash('Where is my order?')))
+        session.commit()
+    finally:
+        session.close()
+
+
+def stored(model, **filters):
+    session = Session()
+    try:
+        rows = session.query(model).filter_by(**filters).all()
+        session.expunge_all()
+        return rows
+    finally:
+        session.close()
+
+
+def reconcile(comments_page_size=100):
+    fb_api = FacebookAPI()
+    try:
+        return CommentReconciler(fb_api, comments_page_size=comments_page_size).run(posts_limit=10)
+    finally:
+        fb_api.session.close()
+
+
+def test_unchanged_page_is_only_read(fake_graph):
+    store_page(fake_graph.data)
+    stats = reconcile()
+    assert stats['posts_checked'] == 3
+    assert (stats['posts_updated'], stats['posts_deleted'], stats['comments_updated'],
+            stats['comments_deleted']) == (0, 0, 0, 0)
+
+
+def test_edits_and_deletions_are_applied(fake_graph):
+    store_page(fake_graph.data)
+    session = Session()
+    try:
+        session.add(CommentReply(comment_id='PG_1_c1', reply_id='PG_1_c1_r0', message='Same here',
+                                 created_time=datetime(2023, 12, 31), user_name='Fan 0'))
+        session.add(ResponseDraft(comment_id='PG_1_c1', message='Thank you!'))
+        session.commit()
+    finally:
+        session.close()
+
+    fake_graph.data.edit('PG_0', 'New opening hours from Monday')
+    fake_graph.data.edit('PG_1_c0', 'Terrible, it arrived broken')
+    fake_graph.data.delete('PG_1_c1')
+    fake_graph.data.delete('PG_2')
+
+    stats = reconcile()
+
+    assert (stats['posts_updated'], stats['posts_deleted'], stats['comments_updated'],
+            stats['comments_deleted']) == (1, 1, 1, 1)
+    [post] = stored(Post, post_id='PG_0')
+    assert post.message == 'New opening hours from Monday'
+    assert post.content_hash == content_hash('New opening hours from Monday')
+
+    [edited] = stored(Comment, comment_id='PG_1_c0')
+    assert edited.message == 'Terrible, it arrived broken'
+    assert edited.content_hash == content_hash('Terrible, it arrived broken')
+    assert edited.sentiment_score < 0
+    assert stored(Comment, comment_id='PG_1_c1') == []
+    assert stored(CommentReply, comment_id='PG_1_c1') == []
+    assert stored(ResponseDraft, comment_id='PG_1_c1') == []
+    # Only the posts whose comments changed get a new average
+    [post] = stored(Post, post_id='PG_1')
+    assert post.avg_sentiment == pytest.approx(edited.sentiment_score / 3)
+
+    # The deleted post goes with all its comments
+    assert stored(Post, post_id='PG_2') == []
+    assert stored(Comment, post_id='PG_2') == []
+
+
+def test_recently_saved_comments_are_kept(fake_graph):
+    store_page(fake_graph.data, posts=1)
+    now = to_utc_naive(datetime.now(timezone.utc))
+    # Neither comment is on Facebook; one may just not have been seen by the pass yet
+    add_comment('PG_0', 'PG_0_n1', now - DELETE_GRACE_PERIOD - timedelta(minutes=1))
+    add_comment('PG_0', 'PG_0_n2', now)
+
+    stats = reconcile()
+
+    assert stats['comments_deleted'] == 1
+    assert stored(Comment, comment_id='PG_0_n1') == []
+    assert len(stored(Comment, comment_id='PG_0_n2')) == 1
+
+
+def test_nothing_is_deleted_when_a_comment_page_fails(fake_graph, monkeypatch):
+    store_page(fake_graph.data, posts=2)
+    add_comment('PG_1', 'PG_1_n1', datetime(2023, 1, 1))
+    fake_graph.data.edit('PG_1_c0', 'Terrible, it arrived broken')
+    handle_get = fake_graph.handle_get
+
+    def failing_pages(path, params):
+        # The second page of PG_1's comments cannot be read
+        if path.strip('/') == 'PG_1/comments' and params.get('after'):
+            return 400, graph_error('(#100) Invalid cursor')
+        return handle_get(path, params)
+
+    monkeypatch.setattr(fake_graph, 'handle_get', failing_pages)
+
+    stats = reconcile(comments_page_size=2)
+
+    assert stats['comments_deleted'] == 0
+    assert len(stored(Comment, comment_id='PG_1_n1')) == 1
+    # The post itself is still compared
+    assert stats['posts_checked'] == 2
+    assert stored(Comment, comment_id='PG_1_c0')[0].message != 'Terrible, it arrived broken'
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
@@ -0,0 +1,104 @@
+"""
+Tests for the Graph API retry policy and retry budget (retry_policy.py).
+
+Run with: python test_retry_policy.py (or pytest test_retry_policy.py)
+"""
+
+import random
+
+import requests
+
+from retry_policy import RetryBudget, RetryPolicy
+
+
+def generous_policy(max_attempts=4, base_delay=0.5, max_delay=30.0):
+    # A budget large enough that it never limits the test
+    return RetryPolicy(max_attempts=max_attempts, base_delay=base_delay, max_delay=max_delay,
+                       budget=RetryBudget(max_tokens=1000))
+
+
+def test_retries_transient_failures_of_reads():
+    policy = generous_policy()
+    assert policy.should_retry(1, 'GET', status_code=500)
+    assert policy.should_retry(1, 'GET', status_code=503)
+    assert policy.should_retry(1, 'GET', status_code=400, error={'code': 2, 'message': 'Temporary'})
+    assert policy.should_retry(1, 'GET', exception=requests.exceptions.ReadTimeout())
+
+
+def test_does_not_retry_permanent_failures():
+    policy = generous_policy()
+    assert not policy.should_retry(1, 'GET', status_code=400, error={'code': 100, 'message': 'Invalid'})
+    assert not policy.should_retry(1, 'GET', status_code=404)
+    assert not policy.should_retry(1, 'GET', exception=requests.exceptions.InvalidURL())
+
+
+def test_posts_are_only_retried_when_never_processed():
+    policy = generous_policy()
+    # The request may have reached Facebook
+    assert not policy.should_retry(1, 'POST', status_code=500)
+    assert not policy.should_retry(1, 'POST', exception=requests.exceptions.ReadTimeout())
+    # Never sent, or explicitly rejected before processing
+    assert policy.should_retry(1, 'POST', exception=requests.exceptions.ConnectTimeout())
+    assert policy.should_retry(1, 'POST', status_code=429)
+    assert policy.should_retry(1, 'POST', status_code=400, error={'code': 4, 'message': 'Too many calls'})
+    # Unless the caller knows the request is safe to repeat
+    assert policy.should_retry(1, 'POST', status_code=500, idempotent=True)
+
+
+def test_stops_after_max_attempts():
+    policy = generous_policy(max_attempts=3)
+    assert policy.should_retry(2, 'GET', status_code=500)
+    assert not policy.should_retry(3, 'GET', status_code=500)
+
+
+def test_backoff_is_jittered_under_a_capped_ceiling():
+    policy = generous_policy(base_delay=0.5, max_delay=4.0)
+    random.seed(1)
+    for attempt, ceiling in ((1, 0.5), (2, 1.0), (3, 2.0), (4, 4.0), (10, 4.0)):
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+        # Full jitter spreads retries over the whole range
+        assert min(delays) < ceiling * 0.2 and max(delays) > ceiling * 0.8
+
+
+def test_backoff_honours_retry_after():
+    policy = generous_policy(base_delay=0.5, max_delay=4.0)
+    assert policy.backoff(1, retry_after='10') >= 10
+    assert policy.backoff(1, retry_after='not-a-number') <= 0.5
+
+
+def test_budget_caps_retries_at_a_share_of_traffic():
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_tokens=2)
+    assert budget.try_withdraw() and budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+    # Two first attempts earn one retry
+    budget.deposit()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+
+def test_budget_never_saves_up_more_than_max_tokens():
+    budget = RetryBudget(ratio=1.0, min_per_second=0.0, max_tokens=3)
+    for _ in range(10):
+        budget.deposit()
+    assert sum(budget.try_withdraw() for _ in range(10)) == 3
+
+
+def test_exhausted_budget_stops_retries():
+    policy = RetryPolicy(max_attempts=10, budget=RetryBudget(ratio=0.0, min_per_second=0.0, max_tokens=1))
+    assert policy.should_retry(1, 'GET', status_code=500)
+    assert not policy.should_retry(2, 'GET', status_code=500)
+    # Permanent failures never spend the budget
+    policy = RetryPolicy(max_attempts=10, budget=RetryBudget(ratio=0.0, min_per_second=0.0, max_tokens=1))
+    assert not policy.should_retry(1, 'GET', status_code=404)
+    assert policy.should_retry(1, 'GET', status_code=500)
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name}: OK")
@@ -0,0 +1,150 @@
+"""
+Tests for the durable webhook queue (webhook_queue.py) on a temporary
+SQLite database: per-partition ordering, retries with backoff and
+recovery of events whose worker stopped.
+
+Run with: python test_webhook_queue.py (or pytest test_webhook_queue.py)
+"""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import webhook_queue
+from conftest import drain, message
+from models import Session, WebhookEvent
+from webhook_queue import WEBHOOK_PARTITIONS, WebhookWorker, enqueue_events, partition_of, requeue_stale_events
+
+
+class Recorder:
+    """
+    Messaging handler recording the mid of every handled message; mids in
+    failing raise instead
+    """
+
+    def __init__(self):
+        self.handled = []
+        self.failing = set()
+
+    def __call__(self, event, page_id=None):
+        mid = event['message']['mid']
+        if mid in self.failing:
+            raise RuntimeError(f"cannot handle {mid}")
+        self.handled.append(mid)
+
+
+@pytest.fixture
+def recorder(temp_database, monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setitem(webhook_queue.EVENT_HANDLERS, 'messaging', recorder)
+    return recorder
+
+
+def worker(**kwargs):
+    return WebhookWorker(list(range(WEBHOOK_PARTITIONS)), worker_id='test', **kwargs)
+
+
+def events_by_mid():
+    session = Session()
+    try:
+        rows = session.query(WebhookEvent).order_by(WebhookEvent.id).all()
+        session.expunge_all()
+        return {json.loads(row.payload)['message']['mid']: row for row in rows}
+    finally:
+        session.close()
+
+
+def test_events_of_a_sender_are_handled_in_arrival_order(recorder):
+    assert partition_of('u1') != partition_of('u2')
+    for i in range(5):
+        enqueue_events([message(f"a{i}", sender='u1'), message(f"b{i}", sender='u2')])
+    drain()
+
+    assert [mid for mid in recorder.handled if mid.startswith('a')] == [f"a{i}" for i in range(5)]
+    assert [mid for mid in recorder.handled if mid.startswith('b')] == [f"b{i}" for i in range(5)]
+    assert {row.status for row in events_by_mid().values()} == {'done'}
+
+
+def test_failed_event_blocks_the_rest_of_its_partition(recorder):
+    recorder.failing.add('a0')
+    enqueue_events([message('a0', sender='u1'), message('a1', sender='u1'), message('b0', sender='u2')])
+    queue_worker = worker(retry_backoff=0.2)
+
+    queue_worker.poll()
+    # Other senders are not held up
+    assert recorder.handled == ['b0']
+    rows = events_by_mid()
+    assert rows['a0'].status == 'queued' and rows['a0'].attempts == 1
+    assert 'cannot handle a0' in rows['a0'].error
+    assert rows['a1'].status == 'queued' and rows['a1'].attempts == 0
+
+    recorder.failing.clear()
+    time.sleep(0.25)
+    queue_worker.poll()
+    assert recorder.handled == ['b0', 'a0', 'a1']
+
+
+def test_retries_back_off_exponentially(recorder):
+    recorder.failing.add('a0')
+    enqueue_events([message('a0', sender='u1')])
+    queue_worker = worker(retry_backoff=0.3, max_attempts=5)
+    partition = partition_of('u1')
+
+    queue_worker.poll()
+    assert 0.2 < queue_worker._retry_after[partition] - time.monotonic() <= 0.3
+    # The partition is skipped until its backoff has passed
+    assert queue_worker.poll() == 0
+    assert events_by_mid()['a0'].attempts == 1
+    assert 0 < queue_worker.next_wait() <= 0.3
+
+    time.sleep(0.3)
+    queue_worker.poll()
+    assert events_by_mid()['a0'].attempts == 2
+    assert 0.5 < queue_worker._retry_after[partition] - time.monotonic() <= 0.6
+
+
+def test_event_is_failed_after_max_attempts(recorder):
+    recorder.failing.add('a0')
+    enqueue_events([message('a0', sender='u1'), message('a1', sender='u1')])
+    queue_worker = worker(retry_backoff=0.05, max_attempts=2)
+
+    queue_worker.poll()
+    time.sleep(0.06)
+    queue_worker.poll()
+
+    rows = events_by_mid()
+    assert rows['a0'].status == 'failed' and rows['a0'].attempts == 2
+    assert rows['a0'].finished_at is not None
+    # The partition moves on once its head event has given up
+    assert rows['a1'].status == 'done'
+    assert recorder.handled == ['a1']
+    assert queue_worker._retry_after == {}
+
+
+def test_events_of_a_stopped_worker_are_requeued(recorder):
+    enqueue_events([message('a0', sender='u1'), message('b0', sender='u2')])
+    session = Session()
+    try:
+        session.query(WebhookEvent).update({'status': 'processing', 'worker_id': 'gone'})
+        # Only a0's worker has been silent for longer than the timeout
+        session.query(WebhookEvent).filter(WebhookEvent.partition == partition_of('u1')).update(
+            {'started_at': datetime.now() - timedelta(minutes=10)})
+        session.query(WebhookEvent).filter(WebhookEvent.partition == partition_of('u2')).update(
+            {'started_at': datetime.now()})
+        session.commit()
+    finally:
+        session.close()
+
+    assert requeue_stale_events(timeout=300) == 1
+    rows = events_by_mid()
+    assert rows['a0'].status == 'queued' and rows['a0'].worker_id is None
+    assert rows['b0'].status == 'processing'
+
+    drain()
+    assert recorder.handled == ['a0']
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
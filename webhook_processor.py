@@ -0,0 +1,348 @@
+# webhook_processor.py
+"""
+Handlers of queued webhook events (see webhook_queue.py).
+
+Handlers run on webhook worker threads, after Facebook has already been
+answered, so they are free to wait on OpenAI and the Send API. An
+exception raised by a handler makes the queue retry the event.
+
+- 'messaging' events (partitioned by sender) store the message and add it
+  to the conversation's pending 'messaging_reply', which answers a burst of
+  messages with one AI response (message_coalescer.py).
+- 'feed' comment changes (partitioned by post) add, edit or remove the
+  comment or reply right away, with sentiment and keywords, so new comments
+  reach auto-reply within seconds. With the page subscribed to the feed
+  field, the polling comment syncs (SYNC_COMMENTS_INTERVAL) only need to run
+  occasionally, to catch deliveries that never arrived.
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import delete, update
+
+from bulk_ingest import insert_ignore
+from fb_api import FacebookAPI, content_hash, parse_graph_time, to_utc_naive
+from message_coalescer import REPLY_EVENT, MessageCoalescer, combined_text, reply_payload_messages
+from message_evaluator import MessageEvaluator
+from models import Comment, CommentReply, Conversation, Message, MessageResponse, Post, Session
+from profile_resolver import PLACEHOLDER_NAME, get_profile_resolver
+from reconcile import delete_comments
+from text_analysis import enhanced_sentiment_analysis, extract_keywords
+from webhook_queue import register_handler
+
+logger = logging.getLogger('fb_api')
+
+
+def events_from_webhook(data: Dict):
+    """
+    Queue entries (event_type, page_id, partition_key, event) of a webhook delivery
+    """
+    events = []
+    if data.get('object') != 'page':
+        return events
+    for entry in data.get('entry', []):
+        page_id = entry.get('id')
+        for messaging_event in entry.get('messaging', []):
+            sender_id = messaging_event.get('sender', {}).get('id', '')
+            events.append(('messaging', page_id, sender_id, messaging_event))
+        for change in entry.get('changes', []):
+            value = change.get('value') or {}
+            if change.get('field') == 'feed' and value.get('item') == 'comment':
+                events.append(('feed', page_id, value.get('post_id', ''), value))
+    return events
+
+
+def _feed_time(value) -> datetime:
+    """
+    created_time of a feed change (Unix seconds) as naive UTC
+    """
+    if value is None:
+        return to_utc_naive(datetime.now(timezone.utc))
+    return to_utc_naive(datetime.fromtimestamp(int(value), timezone.utc))
+
+
+def _ensure_post(fb_api: FacebookAPI, post_id: str):
+    """
+    Store a post we have not synced yet, so comments on it can be saved
+    """
+    if fb_api.session.query(Post.id).filter_by(post_id=post_id).first():
+        return
+    post = fb_api.graph_get(post_id, {'fields': 'id,message,created_time'})
+    message = post.get('message', '')
+    insert_ignore(fb_api.session, Post, [{
+        'page_id': fb_api.page_id,
+        'post_id': post_id,
+        'message': message,
+        'created_time': to_utc_naive(parse_graph_time(post['created_time'])),
+        'trending_topics': json.dumps(extract_keywords(message)),
+        'avg_sentiment': 0.0,
+        'content_hash': content_hash(message)
+    }], ['post_id'])
+
+
+def _save_comment(fb_api: FacebookAPI, change: Dict):
+    message = change.get('message', '')
+    sentiment_score, sentiment_category = enhanced_sentiment_analysis(message)
+    values = {
+        'message': message,
+        'sentiment_score': sentiment_score,
+        'sentiment_category': sentiment_category,
+        'keywords': json.dumps(extract_keywords(message)),
+        'content_hash': content_hash(message)
+    }
+    updated = fb_api.session.execute(
+        update(Comment).where(Comment.comment_id == change['comment_id']).values(**values)).rowcount
+    if not updated:
+        _ensure_post(fb_api, change['post_id'])
+        insert_ignore(fb_api.session, Comment, [dict(
+            values,
+            post_id=change['post_id'],
+            comment_id=change['comment_id'],
+            created_time=_feed_time(change.get('created_time')),
+            user_name=(change.get('from') or {}).get('name', 'Unknown'),
+            ai_responded=False
+        )], ['comment_id'])
+
+
+def _save_reply(session, change: Dict):
+    updated = session.execute(update(CommentReply).where(CommentReply.reply_id == change['comment_id'])
+                              .values(message=change.get('message', ''))).rowcount
+    if updated:
+        return
+    if not session.query(Comment.id).filter_by(comment_id=change['parent_id']).first():
+        # The next reply sync picks it up together with its parent comment
+        logger.info(f"Reply {change['comment_id']} is to unknown comment {change['parent_id']}, skipped")
+        return
+    insert_ignore(session, CommentReply, [{
+        'comment_id': change['parent_id'],
+        'reply_id': change['comment_id'],
+        'message': change.get('message', ''),
+        'created_time': _feed_time(change.get('created_time')),
+        'user_name': (change.get('from') or {}).get('name', 'Unknown'),
+        'ai_generated': False,
+        'posted_to_facebook': False
+    }], ['reply_id'])
+
+
+@register_handler('feed')
+def handle_feed_comment(change: Dict, page_id: Optional[str] = None):
+    """
+    Apply a comment add, edit or remove from the page feed to the database
+    """
+    from page_registry import api_for_page
+
+    verb = change.get('verb')
+    if verb not in ('add', 'edited', 'remove'):
+        return
+    post_id = change.get('post_id')
+    comment_id = change.get('comment_id')
+    is_reply = change.get('parent_id') not in (None, post_id)
+
+    fb_api = api_for_page(page_id)
+    session = fb_api.session
+    try:
+        if verb == 'remove':
+            if is_reply:
+                session.execute(delete(CommentReply).where(CommentReply.reply_id == comment_id))
+            else:
+                delete_comments(session, [comment_id])
+        elif is_reply:
+            _save_reply(session, change)
+        else:
+            _save_comment(fb_api, change)
+
+        if not is_reply:
+            fb_api.recompute_avg_sentiment([post_id])
+        session.commit()
+        logger.info(f"Applied feed {verb} of {'reply' if is_reply else 'comment'} {comment_id} on post {post_id}")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@register_handler('messaging')
+def handle_message_event(event: Dict, page_id: Optional[str] = None):
+    """
+    Process a message event from Facebook
+    """
+    profile_resolver = get_profile_resolver()
+    session = Session()
+    try:
+        sender_id = event['sender']['id']
+        recipient_id = event['recipient']['id']
+
+        # Check if this is a message event
+        if 'message' in event:
+            message_text = event['message'].get('text', '')
+            message_id = event['message'].get('mid')
+
+            if not message_text:
+                logger.warning("Received message with no text")
+                return
+
+            logger.info(f"New message from {sender_id}: {message_text[:50]}...")
+
+            # Get or create conversation
+            conversation = session.query(Conversation).filter_by(
+                conversation_id=sender_id).first()
+
+            if not conversation:
+                conversation = Conversation(
+                    conversation_id=sender_id,
+                    snippet=message_text[:100],
+                    updated_time=datetime.now(),
+                    participants=json.dumps({'sender_id': sender_id, 'recipient_id': recipient_id})
+                )
+                session.add(conversation)
+
+            # A retry of this event, or a redelivery the idempotency index had
+            # not recorded yet, finds the message already saved
+            if session.query(MessageResponse.id).filter_by(message_id=message_id).first():
+                logger.info(f"Message {message_id} was already answered, skipping")
+                return
+            if not session.query(Message.id).filter_by(message_id=message_id).first():
+                # Save the incoming message
+                message = Message(
+                    conversation_id=sender_id,
+                    message_id=message_id,
+                    sender_id=sender_id,
+                    # Placeholder until the background profile backfill resolves the name
+                    sender_name=profile_resolver.cached_name(sender_id) or PLACEHOLDER_NAME,
+                    recipient_id=recipient_id,
+                    recipient_name=os.getenv('FACEBOOK_PAGE_NAME', 'Page'),
+                    message_text=message_text,
+                    created_time=datetime.now()
+                )
+                session.add(message)
+            session.commit()
+            profile_resolver.schedule_backfill()
+
+            # Answered by the conversation's pending reply, together with
+            # the other messages of the burst
+            get_message_coalescer().add_message(page_id, sender_id, recipient_id, message_id)
+
+    except Exception as e:
+        logger.error(f"Error handling message event: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+@register_handler(REPLY_EVENT)
+def handle_message_reply(payload: Dict, page_id: Optional[str] = None):
+    """
+    Answer a burst of messages from one sender with a single AI response
+    """
+    from page_registry import api_for_page
+
+    profile_resolver = get_profile_resolver()
+    session = Session()
+    fb_api = None
+    try:
+        sender_id = payload['sender_id']
+        recipient_id = payload['recipient_id']
+
+        messages = reply_payload_messages(session, payload)
+        if not messages:
+            logger.info(f"Messages from {sender_id} were already answered, skipping")
+            return
+        message_text = combined_text(messages)
+
+        # Generate AI response
+        message_evaluator = MessageEvaluator()
+
+        # Get conversation history for context, up to the first message of the burst
+        burst_ids = {message.message_id for message in messages}
+        history_messages = session.query(Message).filter(
+            Message.conversation_id == sender_id,
+            Message.created_time <= messages[-1].created_time
+        ).order_by(Message.created_time.desc()).limit(10 + len(messages)).all()
+
+        conversation_history = ""
+        history_list = []
+        for msg in reversed(history_messages):
+            if msg.message_id in burst_ids:
+                continue
+            sender = "Customer" if msg.sender_id == sender_id else "You"
+            history_list.append(f"{sender}: {msg.message_text}")
+        if history_list:
+            conversation_history = "\n".join(history_list[-10:])
+
+        # Replies go out with the token of the page the messages were sent to;
+        # resolved first so an unknown page fails before the OpenAI call
+        fb_api = api_for_page(page_id)
+
+        # Generate response
+        response = message_evaluator.generate_response(message_text, conversation_history)
+
+        if response['success']:
+            # Send the response via Facebook API
+            send_success = fb_api.send_message(sender_id, response['response'])
+
+            # Save the response against every message it answers; usage is
+            # recorded once, on the last one
+            for i, message in enumerate(messages):
+                last = i == len(messages) - 1
+                session.add(MessageResponse(
+                    message_id=message.message_id,
+                    response_text=response['response'],
+                    generated_at=datetime.now(),
+                    sent_at=datetime.now() if send_success else None,
+                    ai_generated=True,
+                    tokens_used=response.get('tokens_used', 0) if last else 0,
+                    processing_time=response.get('processing_time', 0) if last else 0
+                ))
+            # Committed on its own: once they exist, retries of this event stop before the LLM
+            session.commit()
+
+            # If sent successfully, also save as a message in the conversation
+            if send_success:
+                response_message = Message(
+                    conversation_id=sender_id,
+                    message_id=f"ai_{datetime.now().timestamp()}",
+                    sender_id=recipient_id,
+                    sender_name=os.getenv('FACEBOOK_PAGE_NAME', 'Page'),
+                    recipient_id=sender_id,
+                    recipient_name=profile_resolver.cached_name(sender_id) or PLACEHOLDER_NAME,
+                    message_text=response['response'],
+                    created_time=datetime.now(),
+                    is_ai_generated=True
+                )
+                session.add(response_message)
+
+            session.commit()
+            logger.info(f"AI response to {len(messages)} message(s) sent to {sender_id}")
+        else:
+            logger.error(f"Failed to generate response: {response.get('error')}")
+
+    except Exception as e:
+        logger.error(f"Error answering messages: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        if fb_api is not None:
+            fb_api.session.close()
+
+
+_coalescer: Optional[MessageCoalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def get_message_coalescer() -> MessageCoalescer:
+    """
+    Get the process-wide coalescer, configured from the environment
+    """
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = MessageCoalescer()
+        return _coalescer
@@ -0,0 +1,422 @@
+# webhook_queue.py
+"""
+Durable queue between the webhook endpoint and the code that handles events.
+
+The POST /webhook route only writes the events of a delivery to the
+webhook_events table, in one commit, and answers Facebook right away.
+Worker threads handle the events afterwards:
+
+- Every event has a partition key (the sender id) hashed to one of
+  WEBHOOK_PARTITIONS partitions, and each partition is owned by exactly one
+  worker thread, which handles its events one at a time in arrival order.
+  Messages of one sender are therefore answered in order, while different
+  senders are handled concurrently by different threads.
+- Deferred events (available_at, e.g. coalesced message replies) wait in
+  the queue without holding up the later events of their partition; they
+  are picked up within WEBHOOK_POLL_INTERVAL of becoming due.
+- Redelivered events are dropped by their idempotency key (idempotency.py)
+  when queued and before they are handled.
+- A failed event is retried with backoff, up to WEBHOOK_MAX_ATTEMPTS times,
+  before the later events of its partition; events left 'processing' by a
+  worker that died are put back in the queue after WEBHOOK_STALE_TIMEOUT.
+
+Workers run inside the Flask app (WEBHOOK_EMBEDDED_WORKERS; on by default
+under python app.py, off under a WSGI server) or as dedicated processes;
+use one or the other, since each splits all the partitions among its own
+threads:
+
+    python webhook_queue.py --workers 2 --threads 8
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, update
+
+from idempotency import event_key, get_idempotency_index, prune_processed
+from models import Session, WebhookEvent
+from page_registry import shard_of
+
+logger = logging.getLogger('fb_api')
+
+WEBHOOK_PARTITIONS = int(os.getenv('WEBHOOK_PARTITIONS', '64'))
+
+# event_type -> handler(event, page_id)
+EVENT_HANDLERS: Dict[str, Callable] = {}
+
+# Wake-up events of the workers in this process, set when events are queued
+_listeners: List[threading.Event] = []
+
+
+def register_handler(event_type: str):
+    """
+    Decorator registering the handler of a webhook event type
+    """
+    def decorator(func):
+        EVENT_HANDLERS[event_type] = func
+        return func
+    return decorator
+
+
+def partition_of(partition_key: str) -> int:
+    return shard_of(partition_key, WEBHOOK_PARTITIONS)
+
+
+def enqueue_events(events: List[Tuple[str, Optional[str], str, Dict]],
+                   available_at: Optional[datetime] = None) -> List[int]:
+    """
+    Durably queue (event_type, page_id, partition_key, event) tuples in one
+    transaction and return their ids. Events that were already handled, or
+    that repeat an earlier event of the same delivery, are dropped. Events
+    with available_at are not handled before that time.
+    """
+    index = get_idempotency_index()
+    keyed = [(event_key(event_type, event), event_type, page_id, partition_key, event)
+             for event_type, page_id, partition_key, event in events]
+    processed = index.processed(key for key, *_ in keyed)
+    rows = []
+    for key, event_type, page_id, partition_key, event in keyed:
+        if key in processed:
+            logger.info(f"Dropped duplicate webhook event {key}")
+            continue
+        if key:
+            processed.add(key)
+        rows.append(WebhookEvent(event_type=event_type, page_id=page_id, partition_key=partition_key,
+                                 partition=partition_of(partition_key), payload=json.dumps(event),
+                                 dedup_key=key, available_at=available_at))
+    if not rows:
+        return []
+
+    session = Session()
+    try:
+        session.add_all(rows)
+        session.commit()
+        event_ids = [row.id for row in rows]
+    finally:
+        session.close()
+
+    for listener in list(_listeners):
+        listener.set()
+    return event_ids
+
+
+def requeue_stale_events(timeout: float) -> int:
+    """
+    Put events whose worker stopped while handling them back in the queue
+    """
+    session = Session()
+    try:
+        stale_before = datetime.now() - timedelta(seconds=timeout)
+        requeued = session.execute(
+            update(WebhookEvent).where(WebhookEvent.status == 'processing', WebhookEvent.started_at < stale_before)
+            .values(status='queued', worker_id=None)
+        ).rowcount
+        session.commit()
+        if requeued:
+            logger.warning(f"Requeued {requeued} webhook events whose worker stopped responding")
+        return requeued
+    finally:
+        session.close()
+
+
+def prune_events(max_age_days: float) -> int:
+    """
+    Delete handled events older than max_age_days
+    """
+    session = Session()
+    try:
+        deleted = session.execute(
+            delete(WebhookEvent).where(WebhookEvent.status.in_(('done', 'duplicate')),
+                                       WebhookEvent.created_at < datetime.now() - timedelta(days=max_age_days))
+        ).rowcount
+        session.commit()
+        return deleted
+    finally:
+        session.close()
+
+
+def queue_stats() -> Dict[str, int]:
+    """
+    Number of events per status
+    """
+    session = Session()
+    try:
+        return dict(session.query(WebhookEvent.status, func.count(WebhookEvent.id))
+                    .group_by(WebhookEvent.status).all())
+    finally:
+        session.close()
+
+
+class WebhookWorker:
+    def __init__(self, partitions: List[int], worker_id: Optional[str] = None, poll_interval: Optional[float] = None,
+                 batch_size: int = 50, max_attempts: Optional[int] = None, retry_backoff: Optional[float] = None):
+        """
+        Initialize the worker of a set of partitions
+
+        Args:
+            partitions (list): Partitions this worker owns; no other worker may handle them
+            worker_id (str): Name recorded on claimed events (default: host:pid:thread)
+            poll_interval (float): Most seconds between two polls when idle
+                (default: WEBHOOK_POLL_INTERVAL or 1)
+            batch_size (int): Events read per poll
+            max_attempts (int): Attempts before an event is marked failed
+                (default: WEBHOOK_MAX_ATTEMPTS or 3)
+            retry_backoff (float): Seconds before the first retry, doubled per attempt
+                (default: WEBHOOK_RETRY_BACKOFF or 2)
+        """
+        self.partitions = list(partitions)
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval or float(os.getenv('WEBHOOK_POLL_INTERVAL', '1'))
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts or int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '3'))
+        self.retry_backoff = retry_backoff or float(os.getenv('WEBHOOK_RETRY_BACKOFF', '2'))
+        self.wakeup = threading.Event()
+        self._stop = threading.Event()
+        # partition -> monotonic time before which its failed head event is not retried
+        self._retry_after: Dict[int, float] = {}
+
+    def stop(self):
+        self._stop.set()
+        self.wakeup.set()
+
+    def _claim(self, session, event_id: int) -> bool:
+        claimed = session.execute(
+            update(WebhookEvent).where(WebhookEvent.id == event_id, WebhookEvent.status == 'queued')
+            .values(status='processing', worker_id=self.worker_id, started_at=datetime.now(),
+                    attempts=WebhookEvent.attempts + 1)
+        ).rowcount
+        session.commit()
+        return bool(claimed)
+
+    def _set_status(self, event: WebhookEvent, status: str, error: Optional[str] = None):
+        session = Session()
+        try:
+            session.execute(update(WebhookEvent).where(WebhookEvent.id == event.id).values(
+                status=status, error=error, finished_at=None if status == 'queued' else datetime.now()))
+            session.commit()
+        finally:
+            session.close()
+
+    def handle(self, event: WebhookEvent) -> bool:
+        """
+        Run the handler of a claimed event and record the outcome. Returns
+        False if the event failed and will be retried.
+        """
+        index = get_idempotency_index()
+        if index.is_processed(event.dedup_key):
+            # A redelivery queued while the first delivery was still waiting
+            logger.info(f"Skipped duplicate webhook event {event.dedup_key}")
+            self._set_status(event, 'duplicate')
+            return True
+
+        handler = EVENT_HANDLERS.get(event.event_type)
+        error = None
+        if handler is None:
+            error = f"No handler for webhook event type {event.event_type}"
+        else:
+            try:
+                handler(json.loads(event.payload), event.page_id)
+            except Exception as e:
+                logger.error(f"Webhook event {event.id} ({event.event_type}) failed: {e}")
+                error = traceback.format_exc()
+
+        if error is None:
+            index.mark_processed(event.dedup_key, event.event_type)
+        retry = error is not None and handler is not None and event.attempts < self.max_attempts
+        self._set_status(event, 'queued' if retry else ('failed' if error else 'done'), error)
+
+        if retry:
+            self._retry_after[event.partition] = time.monotonic() + self.retry_backoff * 2 ** (event.attempts - 1)
+        else:
+            self._retry_after.pop(event.partition, None)
+        return not retry
+
+    def poll(self) -> int:
+        """
+        Handle the queued events of this worker's partitions, oldest first.
+        Returns the number of events handled.
+        """
+        now = time.monotonic()
+        partitions = [partition for partition in self.partitions if self._retry_after.get(partition, 0) <= now]
+        if not partitions:
+            return 0
+
+        session = Session()
+        try:
+            events = session.query(WebhookEvent).filter(
+                WebhookEvent.status == 'queued', WebhookEvent.partition.in_(partitions),
+                or_(WebhookEvent.available_at.is_(None), WebhookEvent.available_at <= datetime.now())
+            ).order_by(WebhookEvent.id).limit(self.batch_size).all()
+            session.expunge_all()
+
+            handled = 0
+            blocked = set()
+            for event in events:
+                # Keep later events of a partition behind its failed one
+                if event.partition in blocked or not self._claim(session, event.id):
+                    continue
+                event.attempts += 1
+                if not self.handle(event):
+                    blocked.add(event.partition)
+                handled += 1
+            return handled
+        finally:
+            session.close()
+
+    def next_wait(self) -> float:
+        if not self._retry_after:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, min(self._retry_after.values()) - time.monotonic()))
+
+    def run(self):
+        """
+        Handle events until stop() is called
+        """
+        self.worker_id = self.worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        _listeners.append(self.wakeup)
+        try:
+            while not self._stop.is_set():
+                self.wakeup.clear()
+                try:
+                    handled = self.poll()
+                except Exception as e:
+                    logger.error(f"Webhook worker {self.worker_id} could not poll the queue: {e}")
+                    handled = 0
+                if not handled:
+                    self.wakeup.wait(self.next_wait())
+        finally:
+            _listeners.remove(self.wakeup)
+
+
+class WebhookWorkerPool:
+    def __init__(self, threads: Optional[int] = None, shard: int = 0, shard_count: int = 1,
+                 stale_timeout: Optional[float] = None):
+        """
+        Initialize a pool of worker threads
+
+        Args:
+            threads (int): Worker threads (default: WEBHOOK_WORKER_THREADS or 8)
+            shard (int): Index of this pool when several processes split the partitions
+            shard_count (int): Number of pools splitting the partitions
+            stale_timeout (float): Seconds after which an event left 'processing' is requeued
+                (default: WEBHOOK_STALE_TIMEOUT or 300)
+        """
+        self.threads = threads or int(os.getenv('WEBHOOK_WORKER_THREADS', '8'))
+        self.shard = shard
+        self.shard_count = shard_count
+        self.stale_timeout = stale_timeout or float(os.getenv('WEBHOOK_STALE_TIMEOUT', '300'))
+        total = self.threads * shard_count
+        self.workers = [
+            WebhookWorker([partition for partition in range(WEBHOOK_PARTITIONS)
+                           if partition % total == shard * self.threads + i])
+            for i in range(self.threads)
+        ]
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> 'WebhookWorkerPool':
+        # Registers the event handlers
+        import webhook_processor  # noqa: F401
+
+        for i, worker in enumerate(self.workers):
+            thread = threading.Thread(target=worker.run, name=f'webhook-worker-{self.shard}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        maintenance = threading.Thread(target=self._maintain, name='webhook-maintenance', daemon=True)
+        maintenance.start()
+        self._threads.append(maintenance)
+        logger.info(f"Started {self.threads} webhook workers for shard {self.shard}/{self.shard_count}")
+        return self
+
+    def _maintain(self):
+        last_prune = 0.0
+        while not self._stop.wait(min(60.0, self.stale_timeout)):
+            try:
+                requeue_stale_events(self.stale_timeout)
+                if time.monotonic() - last_prune > 3600:
+                    prune_events(float(os.getenv('WEBHOOK_EVENT_RETENTION_DAYS', '7')))
+                    prune_processed(float(os.getenv('WEBHOOK_DEDUP_RETENTION_DAYS', '7')))
+                    last_prune = time.monotonic()
+            except Exception as e:
+                logger.error(f"Webhook queue maintenance failed: {e}")
+
+    def stop(self):
+        """
+        Stop the workers after the events they are handling
+        """
+        self._stop.set()
+        for worker in self.workers:
+            worker.stop()
+        for thread in self._threads:
+            thread.join()
+
+
+_embedded_pool: Optional[WebhookWorkerPool] = None
+
+
+def start_embedded_workers() -> WebhookWorkerPool:
+    """
+    Run a worker pool on daemon threads of the current process (used by the
+    Flask app unless dedicated webhook worker processes are started)
+    """
+    global _embedded_pool
+    if _embedded_pool is None:
+        _embedded_pool = WebhookWorkerPool().start()
+    return _embedded_pool
+
+
+def _worker_process(shard: int, shard_count: int, threads: int):
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(processName)s %(threadName)s %(levelname)s: %(message)s')
+    pool = WebhookWorkerPool(threads, shard, shard_count).start()
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+    while not stopped.wait(1):
+        pass
+    pool.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run webhook event workers')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEBHOOK_WORKER_PROCESSES', '1')),
+                        help='Worker processes (default: WEBHOOK_WORKER_PROCESSES or 1)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEBHOOK_WORKER_THREADS', '8')),
+                        help='Worker threads per process (default: WEBHOOK_WORKER_THREADS or 8)')
+    args = parser.parse_args()
+
+    if args.workers * args.threads > WEBHOOK_PARTITIONS:
+        parser.error(f"--workers x --threads must not exceed WEBHOOK_PARTITIONS ({WEBHOOK_PARTITIONS})")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(processName)s %(levelname)s: %(message)s')
+
+    # Spawned processes open their own database connections and HTTP pools
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_worker_process, name=f'webhook-worker-{i}',
+                                 args=(i, args.workers, args.threads))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    def shutdown(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()